@@ -2,11 +2,46 @@ import os
 import glob
 import csv
 import json
-from tqdm import tqdm
+import argparse
+import functools
+from parallel_runner import run_parallel
+from row_sampler import sample_csv_rows, make_rng, ratio_estimate, sampling_info, SAMPLE_METHODS
 
 # ★★★ 最終版のバケツ定義 ★★★
 LENGTH_BINS = [0, 1, 10, 50, 100, 250, 500, 1000, 5000] 
 
+def calculate_bins(lengths):
+    """
+    与えられた長さのリストを、LENGTH_BINSに基づいて集計する。
+    """
+    last_bin_threshold = LENGTH_BINS[-1]
+    last_bin_key = f"{last_bin_threshold}+"
+
+    # バケツを0で初期化
+    bins = {b: 0 for b in LENGTH_BINS}
+    bins[last_bin_key] = 0
+
+    for length in lengths:
+        if length > last_bin_threshold:
+            bins[last_bin_key] += 1
+            continue
+
+        # 該当する最小の上限バケツを見つけてカウント
+        binned = False
+        for b in LENGTH_BINS:
+            if length <= b:
+                bins[b] += 1
+                binned = True
+                break
+
+        # このロジックではLENGTH_BINSに0が含まれていれば、
+        # length=0はbins[0]に正しくカウントされる
+
+    # 最終的な出力形式を整える (0件のバケツは出力しない)
+    final_bins = {str(k): v for k, v in bins.items() if v > 0}
+
+    return final_bins
+
 def analyze_file_distribution(csv_path):
     """単一のCSVファイルをストリーミング処理し、分布を分析する"""
     header_lengths = []
@@ -33,38 +68,6 @@ def analyze_file_distribution(csv_path):
                 max_cell_len = current_max
             total_cell_count += len(row)
 
-    def calculate_bins(lengths):
-        """
-        与えられた長さのリストを、LENGTH_BINSに基づいて集計する。
-        """
-        last_bin_threshold = LENGTH_BINS[-1]
-        last_bin_key = f"{last_bin_threshold}+"
-        
-        # バケツを0で初期化
-        bins = {b: 0 for b in LENGTH_BINS}
-        bins[last_bin_key] = 0
-
-        for length in lengths:
-            if length > last_bin_threshold:
-                bins[last_bin_key] += 1
-                continue
-
-            # 該当する最小の上限バケツを見つけてカウント
-            binned = False
-            for b in LENGTH_BINS:
-                if length <= b:
-                    bins[b] += 1
-                    binned = True
-                    break
-            
-            # このロジックではLENGTH_BINSに0が含まれていれば、
-            # length=0はbins[0]に正しくカウントされる
-        
-        # 最終的な出力形式を整える (0件のバケツは出力しない)
-        final_bins = {str(k): v for k, v in bins.items() if v > 0}
-        
-        return final_bins
-
     header_dist = calculate_bins(header_lengths)
     cell_dist = calculate_bins(cell_lengths)
 
@@ -81,19 +84,61 @@ def analyze_file_distribution(csv_path):
         "cell_len_distribution": cell_dist
     }
 
-def main(csv_dir, output_filepath):
-    """メインの実行関数"""
+def analyze_file_distribution_sampled(csv_path, sample_rows, seed=0, method="reservoir"):
+    """
+    行のサンプルから分布を推定する (探索用の高速モード)。
+    セル数と分布の件数はサンプルを総行数に拡大した推定値で、平均セル長には95%信頼区間が付く。
+    max_cell_lenはサンプル内の最大値 (真の最大値の下限)。
+    """
+    filename = os.path.basename(csv_path)
+    sample = sample_csv_rows(csv_path, sample_rows, make_rng(seed, filename), method)
+    if not sample:
+        return None
+    header, rows = sample["header"], sample["rows"]
+    header_lengths = [len(h) for h in header]
+
+    cell_lengths = []
+    len_per_row, cells_per_row = [], []
+    for row in rows:
+        row_lengths = [len(cell) for cell in row]
+        cell_lengths.extend(row_lengths)
+        len_per_row.append(sum(row_lengths))
+        cells_per_row.append(len(row))
+
+    scale = sample["total_rows"] / len(rows) if rows else 0
+    avg_cell_len, avg_cell_len_ci = ratio_estimate(len_per_row, cells_per_row, sample["total_rows"])
+    cell_dist = {k: int(round(v * scale)) for k, v in calculate_bins(cell_lengths).items()}
+
+    return {
+        "filename": filename,
+        "column_count": len(header),
+        "cell_count": int(round(len(cell_lengths) * scale)),
+        "max_header_len": max(header_lengths) if header_lengths else 0,
+        "avg_header_len": round(sum(header_lengths) / len(header_lengths), 1) if header_lengths else 0,
+        "max_cell_len": max(cell_lengths) if cell_lengths else 0,
+        "avg_cell_len": round(avg_cell_len, 1),
+        "avg_cell_len_ci95": [round(v, 1) for v in avg_cell_len_ci],
+        "header_len_distribution": calculate_bins(header_lengths),
+        "cell_len_distribution": cell_dist,
+        "sampling": sampling_info(sample, seed)
+    }
+
+def main(csv_dir, output_filepath, workers=None, sample_rows=None, seed=0, sample_method="reservoir"):
+    """メインの実行関数 (sample_rowsを指定するとサンプリングによる推定モード)"""
     print(f"--- '{csv_dir}' 内のCSVデータ分布分析を開始 ---")
-    csv_files = glob.glob(os.path.join(csv_dir, '*.csv'))
+    if sample_rows:
+        print(f"サンプリングモード: 各ファイル {sample_rows:,} 行 ({sample_method})")
+    csv_files = sorted(glob.glob(os.path.join(csv_dir, '*.csv')))
     if not csv_files:
         print("分析対象のCSVファイルが見つかりません。")
         return
 
-    all_results = []
-    for csv_path in tqdm(csv_files, desc="Analyzing distributions"):
-        result = analyze_file_distribution(csv_path)
-        if result:
-            all_results.append(result)
+    if sample_rows:
+        worker_func = functools.partial(analyze_file_distribution_sampled, sample_rows=sample_rows, seed=seed, method=sample_method)
+    else:
+        worker_func = analyze_file_distribution
+    results = run_parallel(worker_func, csv_files, workers, desc="Analyzing distributions")
+    all_results = [r for r in results if r]
 
     with open(output_filepath, 'w', encoding='utf-8') as f:
         json.dump(all_results, f, ensure_ascii=False, indent=2)
@@ -108,10 +153,18 @@ def main(csv_dir, output_filepath):
     print(f"分析結果が出力されました: {output_filepath}")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CSVのデータ分布を分析する")
+    parser.add_argument("--workers", type=int, default=None, help="並列ワーカー数 (既定: CPUコア数)")
+    parser.add_argument("--sample", type=int, default=None, metavar="N", help="各ファイルからN行をサンプリングして推定する")
+    parser.add_argument("--sample-method", choices=SAMPLE_METHODS, default="reservoir", help="サンプリング方式")
+    parser.add_argument("--seed", type=int, default=0, help="サンプリングの乱数シード")
+    args = parser.parse_args()
+
     project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     csv_input_dir = os.path.join(project_root, 'data', 'csv')
     analysis_dir = os.path.join(project_root, 'analysis')
     os.makedirs(analysis_dir, exist_ok=True)
-    dist_output_path = os.path.join(analysis_dir, 'data_distribution_summary.json')
-    main(csv_input_dir, dist_output_path)
+    output_name = 'data_distribution_summary_sampled.json' if args.sample else 'data_distribution_summary.json'
+    dist_output_path = os.path.join(analysis_dir, output_name)
+    main(csv_input_dir, dist_output_path, args.workers, args.sample, args.seed, args.sample_method)
     print("\n★★★ 分布分析が完了しました ★★★")
\ No newline at end of file
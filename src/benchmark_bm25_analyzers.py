@@ -0,0 +1,166 @@
+import os
+import json
+import time
+import shutil
+import argparse
+import statistics
+from tqdm import tqdm
+from row_sampler import make_rng, reservoir_sample
+from corpus_manifest import parent_doc_id, manifest_path
+from char_bigram import bigram_tokens, ANALYZERS
+from build_bm25_index import build_bm25_index, open_searcher
+import preprocess_docs
+
+# クエリに使う値の長さ (文字数) の範囲。短すぎる値や長文はクエリとして不自然なため除く
+QUERY_MIN_CHARS = 4
+QUERY_MAX_CHARS = 40
+SEARCH_KS = (1, 5, 10)
+# fields レイアウトで、値 (contents) に対するラベル (labels) の既定の重み
+DEFAULT_LABEL_WEIGHT = 0.2
+
+def sample_documents(docs_filepath: str, sample_docs: int, seed: int) -> list:
+    with open(docs_filepath, 'r', encoding='utf-8') as f:
+        docs, _ = reservoir_sample((json.loads(line) for line in f), sample_docs, make_rng(seed, "docs"))
+    return docs
+
+def build_queries(docs: list, num_queries: int, seed: int) -> list:
+    """
+    既知項目検索のクエリを作る: サンプル内のドキュメントの「詳細: 値」の値をクエリとし、
+    そのドキュメントの親 (事業) を正解とする。
+    """
+    candidates = []
+    for doc in docs:
+        for fragment in doc["contents"].split(preprocess_docs.FRAGMENT_SEPARATOR):
+            _, separator, value = fragment.partition(preprocess_docs.LABEL_SEPARATOR)
+            value = value.strip()
+            if separator and QUERY_MIN_CHARS <= len(value) <= QUERY_MAX_CHARS:
+                candidates.append({"query": value, "relevant": doc.get("parent_id", parent_doc_id(doc["id"]))})
+    queries, _ = reservoir_sample(candidates, num_queries, make_rng(seed, "queries"))
+    return queries
+
+def make_query_analyzer(analyzer: str):
+    if analyzer == "bigram":
+        return lambda query: ' '.join(bigram_tokens(query))
+    from sudachipy import tokenizer, dictionary
+    tokenizer_obj, mode = dictionary.Dictionary().create(), tokenizer.Tokenizer.SplitMode.C
+    return lambda query: ' '.join(m.surface() for m in tokenizer_obj.tokenize(query, mode))
+
+def config_name(analyzer: str, layout: str) -> str:
+    return analyzer if layout == "combined" else f"{analyzer}_{layout}"
+
+def evaluate_queries(index_dir: str, analyzer: str, queries: list, fields: dict = None) -> dict:
+    """
+    クエリごとの解析+検索の所要時間と、親ドキュメント単位のrecall@kを測る。
+    fieldsを指定した場合は、{フィールド名: 重み} の複数フィールドを検索する。
+    """
+    searcher = open_searcher(index_dir)
+    analyze = make_query_analyzer(analyzer)
+    max_k = max(SEARCH_KS)
+    search_options = {"fields": fields} if fields else {}
+    # 1件目のクエリはJVMのウォームアップを含むため、計測の前に一度検索しておく
+    if queries:
+        searcher.search(analyze(queries[0]["query"]), k=max_k, **search_options)
+
+    latencies_ms, hits_at_k = [], {k: 0 for k in SEARCH_KS}
+    for q in tqdm(queries, desc=f"Querying ({analyzer})"):
+        start = time.perf_counter()
+        # チャンク・セクションの重複を親にまとめるため多めに取る
+        hits = searcher.search(analyze(q["query"]), k=max_k * 3, **search_options)
+        latencies_ms.append((time.perf_counter() - start) * 1000)
+        parents = list(dict.fromkeys(parent_doc_id(hit.docid) for hit in hits))
+        for k in SEARCH_KS:
+            hits_at_k[k] += q["relevant"] in parents[:k]
+
+    n = max(len(queries), 1)
+    return {
+        "queries": len(queries),
+        "latency_ms_mean": statistics.fmean(latencies_ms) if latencies_ms else None,
+        "latency_ms_p95": statistics.quantiles(latencies_ms, n=20)[-1] if len(latencies_ms) >= 2 else None,
+        **{f"recall@{k}": hits_at_k[k] / n for k in SEARCH_KS},
+    }
+
+def benchmark_analyzer(analyzer: str, sample_path: str, work_dir: str, queries: list, workers, threads: int,
+                       layout: str = "combined", label_weight: float = DEFAULT_LABEL_WEIGHT) -> dict:
+    name = config_name(analyzer, layout)
+    prep_path = os.path.join(work_dir, f"preprocessed_{name}.jsonl")
+    corpus_dir = os.path.join(work_dir, f"corpus_{name}")
+    index_dir = os.path.join(work_dir, f"index_{name}")
+    # 計測のたびに最初から処理させる (差分更新やチェックポイントを使わない)
+    for path in (prep_path, manifest_path(prep_path), preprocess_docs.checkpoint_path(prep_path)):
+        if os.path.exists(path): os.remove(path)
+
+    start = time.monotonic()
+    preprocess_docs.main(sample_path, prep_path, workers, True, corpus_dir, threads, analyzer, layout)
+    preprocess_seconds = time.monotonic() - start
+
+    index_stats = build_bm25_index(corpus_dir, index_dir, threads)
+    if not index_stats:
+        return {"analyzer": analyzer, "layout": layout, "error": "インデックスの構築に失敗しました"}
+    fields = {"contents": 1.0, "labels": label_weight} if layout == "fields" else None
+    return {
+        "analyzer": analyzer,
+        "layout": layout,
+        **({"label_weight": label_weight} if fields else {}),
+        "preprocess_seconds": preprocess_seconds,
+        **index_stats,
+        **evaluate_queries(index_dir, analyzer, queries, fields),
+    }
+
+def main(docs_filepath: str, output_filepath: str, work_dir: str, sample_docs: int, num_queries: int,
+         workers=None, threads: int = 8, seed: int = 0, keep_work_dir: bool = False,
+         analyzers: list = ANALYZERS, layouts: list = ("combined",), label_weight: float = DEFAULT_LABEL_WEIGHT):
+    """analyzers × layouts の組み合わせごとに、前処理・索引付け・検索を行って比較する"""
+    print("--- BM25アナライザー・フィールド構成のベンチマークを開始 ---")
+    if not os.path.exists(docs_filepath):
+        print(f"[エラー] 入力ファイルが見つかりません: {docs_filepath}")
+        return
+
+    os.makedirs(work_dir, exist_ok=True)
+    docs = sample_documents(docs_filepath, sample_docs, seed)
+    sample_path = os.path.join(work_dir, "sample_documents.jsonl")
+    with open(sample_path, 'w', encoding='utf-8') as f:
+        for doc in docs:
+            f.write(json.dumps(doc, ensure_ascii=False) + '\n')
+    queries = build_queries(docs, num_queries, seed)
+    print(f"サンプル: {len(docs):,}件のドキュメント / クエリ: {len(queries):,}件")
+
+    results = [benchmark_analyzer(analyzer, sample_path, work_dir, queries, workers, threads, layout, label_weight)
+               for analyzer in analyzers for layout in layouts]
+    report = {"source": os.path.basename(docs_filepath), "sample_docs": len(docs), "seed": seed, "results": results}
+    with open(output_filepath, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    print("\n--- 結果 ---")
+    for r in results:
+        name = config_name(r['analyzer'], r['layout'])
+        if "error" in r:
+            print(f"{name:>15}: {r['error']}")
+            continue
+        print(f"{name:>15}: 前処理 {r['preprocess_seconds']:.1f}秒 / 索引 {r['build_seconds']:.1f}秒 / "
+              f"サイズ {r['index_bytes'] / 1024**2:.1f}MB / 検索 平均{r['latency_ms_mean']:.2f}ms (p95 {r['latency_ms_p95']:.2f}ms) / "
+              + " / ".join(f"recall@{k} {r[f'recall@{k}']:.3f}" for k in SEARCH_KS))
+    if not keep_work_dir:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    print(f"\n結果を保存しました: {output_filepath}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="アナライザー・フィールド構成の異なるBM25インデックスを、構築時間・サイズ・検索速度・再現率で比較する")
+    parser.add_argument("--input", default="analysis/search_documents.jsonl", help="検索ドキュメント (JSONL)")
+    parser.add_argument("--sample", type=int, default=20000, help="ベンチマークに使うドキュメント数")
+    parser.add_argument("--queries", type=int, default=500, help="クエリ数")
+    parser.add_argument("--workers", type=int, default=None, help="前処理の並列ワーカー数 (既定: CPUコア数)")
+    parser.add_argument("--threads", type=int, default=8, help="索引付けのスレッド数 (シャード数)")
+    parser.add_argument("--seed", type=int, default=0, help="サンプリングの乱数シード")
+    parser.add_argument("--analyzers", nargs="+", choices=ANALYZERS, default=list(ANALYZERS), help="比較するアナライザー")
+    parser.add_argument("--layouts", nargs="+", choices=preprocess_docs.LAYOUTS, default=["combined"], help="比較するフィールド構成")
+    parser.add_argument("--label-weight", type=float, default=DEFAULT_LABEL_WEIGHT, help="fields レイアウトでのラベルの重み")
+    parser.add_argument("--keep-work-dir", action="store_true", help="作業用のコーパス・インデックスを削除せずに残す")
+    args = parser.parse_args()
+
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    main(os.path.join(project_root, args.input),
+         os.path.join(project_root, 'analysis', 'bm25_analyzer_benchmark.json'),
+         os.path.join(project_root, 'analysis', 'bm25_benchmark_work'),
+         args.sample, args.queries, args.workers, args.threads, args.seed, args.keep_work_dir,
+         args.analyzers, args.layouts, args.label_weight)
+    print("\n★★★ ベンチマークが完了しました ★★★")
@@ -0,0 +1,120 @@
+import os
+import json
+import time
+import argparse
+import numpy as np
+from tqdm import tqdm
+from row_sampler import make_rng, reservoir_sample
+from embedding_backend import BACKENDS, Encoder
+from build_faiss_index import ST_MODEL_NAME, ENCODE_BATCH_SIZE, PASSAGE_MAX_BYTES, split_passages
+
+# 近傍の一致率 (基準の方式での上位k件のうち、比較する方式でも上位k件に入る割合) を測るk
+NEIGHBOR_K = 10
+
+def sample_passages(docs_filepath: str, sample_docs: int, seed: int, max_bytes: int = PASSAGE_MAX_BYTES) -> list:
+    with open(docs_filepath, 'r', encoding='utf-8') as f:
+        docs, _ = reservoir_sample((json.loads(line) for line in f), sample_docs, make_rng(seed, "docs"))
+    return [passage for doc in docs for passage in split_passages(doc['contents'], max_bytes)]
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+def neighbor_overlap(baseline: np.ndarray, candidate: np.ndarray, k: int = NEIGHBOR_K) -> float:
+    """サンプル内の各パッセージについて、コサイン類似度での上位k件の近傍がどれだけ一致するか"""
+    k = min(k, len(baseline) - 1)
+    if k <= 0:
+        return 1.0
+    def top_k(vectors):
+        unit = normalize(vectors)
+        similarity = unit @ unit.T
+        np.fill_diagonal(similarity, -np.inf)
+        return np.argsort(-similarity, axis=1)[:, :k]
+    base_top, cand_top = top_k(baseline), top_k(candidate)
+    return float(np.mean([len(set(b) & set(c)) / k for b, c in zip(base_top, cand_top)]))
+
+def measure(model_name: str, backend: str, workers: int, passages: list, batch_size: int):
+    """読み込み時間とエンコードのスループットを測り、(結果の指標, ベクトル) を返す"""
+    start = time.monotonic()
+    with Encoder(model_name, backend, workers) as encoder:
+        encoder.get_sentence_embedding_dimension()  # プロセスプールの場合も、各ワーカーの読み込みが始まるまで待つ
+        load_seconds = time.monotonic() - start
+        start = time.monotonic()
+        vectors = encoder.encode(passages, batch_size=batch_size)
+        encode_seconds = time.monotonic() - start
+    return {
+        "backend": backend,
+        "workers": workers,
+        "load_seconds": load_seconds,
+        "encode_seconds": encode_seconds,
+        "passages_per_sec": len(passages) / max(encode_seconds, 1e-9),
+    }, np.asarray(vectors, dtype='float32')
+
+def drift(baseline: np.ndarray, vectors: np.ndarray) -> dict:
+    """基準の方式 (torch) のベクトルとのずれ: パッセージごとのコサイン類似度と、近傍の一致率"""
+    cosine = np.sum(normalize(baseline) * normalize(vectors), axis=1)
+    return {
+        "cosine_mean": float(np.mean(cosine)),
+        "cosine_min": float(np.min(cosine)),
+        "cosine_p5": float(np.percentile(cosine, 5)),
+        f"neighbor_overlap@{NEIGHBOR_K}": neighbor_overlap(baseline, vectors),
+    }
+
+def main(docs_filepath: str, output_filepath: str, model_name: str, backends: list, workers_list: list,
+         sample_docs: int, batch_size: int = ENCODE_BATCH_SIZE, seed: int = 0):
+    print("--- エンコード方式 (torch / int8 / onnx) とプロセス数のベンチマークを開始 ---")
+    if not os.path.exists(docs_filepath):
+        print(f"[エラー] 入力ファイルが見つかりません: {docs_filepath}")
+        return
+
+    passages = sample_passages(docs_filepath, sample_docs, seed)
+    print(f"モデル: {model_name} / サンプル: {sample_docs:,}件のドキュメント ({len(passages):,}パッセージ)")
+
+    # 基準: torch (float32) を1プロセスで実行した結果
+    baseline_result, baseline = measure(model_name, "torch", 1, passages, batch_size)
+    results = [{**baseline_result, **drift(baseline, baseline)}]
+    configs = [(backend, workers) for backend in backends for workers in workers_list if (backend, workers) != ("torch", 1)]
+    for backend, workers in tqdm(configs, desc="Backends"):
+        try:
+            result, vectors = measure(model_name, backend, workers, passages, batch_size)
+        except Exception as e:
+            tqdm.write(f"[エラー] {backend} (プロセス数 {workers}) の実行中にエラー: {e}")
+            results.append({"backend": backend, "workers": workers, "error": str(e)})
+            continue
+        results.append({**result, **drift(baseline, vectors)})
+
+    baseline_speed = baseline_result["passages_per_sec"]
+    for r in results:
+        if "error" not in r:
+            r["speedup"] = r["passages_per_sec"] / baseline_speed
+    report = {"source": os.path.basename(docs_filepath), "model": model_name, "sample_docs": sample_docs,
+              "passages": len(passages), "cpu_count": os.cpu_count(), "seed": seed, "results": results}
+    with open(output_filepath, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    print("\n--- 結果 ---")
+    for r in results:
+        label = f"{r['backend']} x{r['workers']}"
+        if "error" in r:
+            print(f"{label:>10}: [エラー] {r['error']}")
+            continue
+        print(f"{label:>10}: {r['passages_per_sec']:,.1f}パッセージ/秒 ({r['speedup']:.2f}倍) / 読み込み {r['load_seconds']:.1f}秒 / "
+              f"コサイン類似度 平均{r['cosine_mean']:.4f} (最小{r['cosine_min']:.4f}) / "
+              f"近傍の一致率@{NEIGHBOR_K} {r[f'neighbor_overlap@{NEIGHBOR_K}']:.3f}")
+    print(f"\n結果を保存しました: {output_filepath}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="エンコードの方式・プロセス数ごとのスループットと、torch (float32) に対するベクトルのずれを比較する")
+    parser.add_argument("--input", default="analysis/search_documents.jsonl", help="検索ドキュメント (JSONL)")
+    parser.add_argument("--model", default=ST_MODEL_NAME, help="モデル名、またはローカルに保存したモデルのディレクトリ")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS), help="比較する方式")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count() or 1], help="比較するプロセス数")
+    parser.add_argument("--sample", type=int, default=500, help="ベンチマークに使うドキュメント数")
+    parser.add_argument("--batch-size", type=int, default=ENCODE_BATCH_SIZE, help="model.encode のバッチサイズ")
+    parser.add_argument("--seed", type=int, default=0, help="サンプリングの乱数シード")
+    args = parser.parse_args()
+
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    main(os.path.join(project_root, args.input),
+         os.path.join(project_root, 'analysis', 'encoder_backend_benchmark.json'),
+         args.model, args.backends, sorted(set(args.workers)), args.sample, args.batch_size, args.seed)
+    print("\n★★★ ベンチマークが完了しました ★★★")
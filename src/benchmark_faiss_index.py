@@ -0,0 +1,146 @@
+import os
+import json
+import time
+import argparse
+import statistics
+import faiss
+import numpy as np
+from tqdm import tqdm
+from faiss_index_factory import (INDEX_TYPES, TRAINED_INDEX_TYPES, IVF_INDEX_TYPES, DEFAULT_PQ_M, DEFAULT_HNSW_M,
+                                 DEFAULT_TRAIN_SAMPLE, create_index, index_type_of, apply_search_params, sample_training_vectors)
+
+SEARCH_KS = (1, 10)
+# 検索パラメータの候補 (IVFはnprobe、HNSWはefSearch)。値を大きくするほど再現率が上がり、検索は遅くなる
+DEFAULT_NPROBES = (1, 4, 16, 64)
+DEFAULT_EF_SEARCHES = (16, 64, 256)
+
+def load_vectors(faiss_index_path: str, max_vectors: int, seed: int) -> np.ndarray:
+    """
+    構築済みのflatインデックスから、最大max_vectors件のベクトルを無作為に取り出す。
+    (flat以外のインデックスは近似・圧縮されているため、比較の基準にならない)
+    """
+    index = faiss.read_index(faiss_index_path)
+    if index_type_of(index) != "flat":
+        raise ValueError("ベンチマークには --index-type flat で構築したインデックスが必要です。")
+    inner = faiss.downcast_index(index.index)
+    rows = np.arange(inner.ntotal)
+    if len(rows) > max_vectors:
+        rows = np.sort(np.random.default_rng(seed).choice(len(rows), max_vectors, replace=False))
+    return np.stack([inner.reconstruct(int(i)) for i in rows]).astype('float32')
+
+def search_latencies(index, queries: np.ndarray, k: int):
+    """1件ずつ検索したときの所要時間 (ms) と、全クエリの検索結果を返す (RAGアプリの検索と同じく1クエリずつ)"""
+    latencies_ms, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        _, ids = index.search(query[None, :], k)
+        latencies_ms.append((time.perf_counter() - start) * 1000)
+        results.append(ids[0])
+    return latencies_ms, np.stack(results)
+
+def recall_at_k(results: np.ndarray, ground_truth: np.ndarray, k: int) -> float:
+    """flatの上位k件のうち、近似インデックスの上位k件に含まれた割合"""
+    hits = sum(len(set(r[:k]) & set(g[:k])) for r, g in zip(results, ground_truth))
+    return hits / (len(ground_truth) * k)
+
+def evaluate(index, queries: np.ndarray, ground_truth: np.ndarray, **params) -> dict:
+    latencies_ms, results = search_latencies(index, queries, max(SEARCH_KS))
+    return {
+        **params,
+        "latency_ms_mean": statistics.fmean(latencies_ms),
+        "latency_ms_p95": statistics.quantiles(latencies_ms, n=20)[-1] if len(latencies_ms) >= 2 else None,
+        **{f"recall@{k}": recall_at_k(results, ground_truth, k) for k in SEARCH_KS},
+    }
+
+def benchmark_index_type(index_type: str, base: np.ndarray, queries: np.ndarray, ground_truth: np.ndarray,
+                         nlist=None, pq_m=DEFAULT_PQ_M, hnsw_m=DEFAULT_HNSW_M, train_sample=DEFAULT_TRAIN_SAMPLE,
+                         nprobes=DEFAULT_NPROBES, ef_searches=DEFAULT_EF_SEARCHES) -> dict:
+    """インデックスを構築し、構築時間・メモリ (シリアライズ後のサイズ) と、検索パラメータごとの再現率・速度を測る"""
+    start = time.monotonic()
+    training_vectors = sample_training_vectors(base, train_sample) if index_type in TRAINED_INDEX_TYPES else None
+    try:
+        index = create_index(index_type, base.shape[1], training_vectors, nlist, pq_m, hnsw_m)
+        index.add_with_ids(base, np.arange(len(base)).astype('int64'))
+    except RuntimeError as e:
+        return {"index_type": index_type, "error": str(e).splitlines()[0]}
+    build_seconds = time.monotonic() - start
+
+    if index_type in IVF_INDEX_TYPES:
+        param_sets = [{"nprobe": n} for n in nprobes]
+    elif index_type == "hnsw":
+        param_sets = [{"ef_search": ef} for ef in ef_searches]
+    else:
+        param_sets = [{}]
+    runs = []
+    for params in param_sets:
+        apply_search_params(index, **params)
+        runs.append(evaluate(index, queries, ground_truth, **params))
+    return {
+        "index_type": index_type,
+        "build_seconds": build_seconds,
+        "index_bytes": int(faiss.serialize_index(index).nbytes),
+        "runs": runs,
+    }
+
+def main(faiss_index_path: str, output_filepath: str, index_types: list, max_vectors: int, num_queries: int,
+         nlist=None, pq_m=DEFAULT_PQ_M, hnsw_m=DEFAULT_HNSW_M, train_sample=DEFAULT_TRAIN_SAMPLE,
+         nprobes=DEFAULT_NPROBES, ef_searches=DEFAULT_EF_SEARCHES, seed: int = 0):
+    print("--- Faissインデックスの種類ごとのベンチマークを開始 ---")
+    if not os.path.exists(faiss_index_path):
+        print(f"[エラー] Faissインデックスが見つかりません: {faiss_index_path}")
+        return
+    try:
+        vectors = load_vectors(faiss_index_path, max_vectors + num_queries, seed)
+    except ValueError as e:
+        print(f"[エラー] {e}")
+        return
+
+    # ベクトルの一部をクエリとして取り分け、残りを検索対象にする。正解はflatでの厳密な上位k件
+    queries, base = vectors[:num_queries], vectors[num_queries:]
+    print(f"検索対象: {len(base):,}件 / クエリ: {len(queries):,}件 / 次元数: {vectors.shape[1]}")
+    flat = faiss.IndexFlatL2(base.shape[1])
+    flat.add(base)
+    _, ground_truth = flat.search(queries, max(SEARCH_KS))
+
+    results = []
+    for index_type in tqdm(index_types, desc="Index types"):
+        results.append(benchmark_index_type(index_type, base, queries, ground_truth, nlist, pq_m, hnsw_m,
+                                            train_sample, nprobes, ef_searches))
+    report = {"source": os.path.basename(faiss_index_path), "base_vectors": len(base), "queries": len(queries),
+              "dim": int(vectors.shape[1]), "seed": seed, "results": results}
+    with open(output_filepath, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    print("\n--- 結果 ---")
+    for r in results:
+        if "error" in r:
+            print(f"{r['index_type']:>8}: [エラー] {r['error']}")
+            continue
+        print(f"{r['index_type']:>8}: 構築 {r['build_seconds']:.1f}秒 / サイズ {r['index_bytes'] / 1024**2:.1f}MB")
+        for run in r["runs"]:
+            param = ", ".join(f"{key}={run[key]}" for key in ("nprobe", "ef_search") if key in run) or "-"
+            print(f"{'':>10}{param:<14} 検索 平均{run['latency_ms_mean']:.3f}ms (p95 {run['latency_ms_p95']:.3f}ms) / "
+                  + " / ".join(f"recall@{k} {run[f'recall@{k}']:.3f}" for k in SEARCH_KS))
+    print(f"\n結果を保存しました: {output_filepath}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Faissインデックスの種類 (flat / IVF / HNSW / スカラー量子化) を、flatに対する再現率・検索速度・メモリで比較する")
+    parser.add_argument("--index", default="analysis/faiss_index.bin", help="ベクトルを取り出すflatインデックス")
+    parser.add_argument("--index-types", nargs="+", choices=INDEX_TYPES, default=list(INDEX_TYPES), help="比較するインデックスの種類")
+    parser.add_argument("--vectors", type=int, default=200000, help="検索対象にするベクトル数")
+    parser.add_argument("--queries", type=int, default=1000, help="クエリ数")
+    parser.add_argument("--nlist", type=int, default=None, help="IVFのクラスタ数 (既定: ベクトル数から決める)")
+    parser.add_argument("--pq-m", type=int, default=DEFAULT_PQ_M, help="IVF-PQのサブベクトル数 (次元数の約数)")
+    parser.add_argument("--hnsw-m", type=int, default=DEFAULT_HNSW_M, help="HNSWの各ノードの接続数")
+    parser.add_argument("--train-sample", type=int, default=DEFAULT_TRAIN_SAMPLE, help="IVFの学習に使うベクトル数")
+    parser.add_argument("--nprobes", type=int, nargs="+", default=list(DEFAULT_NPROBES), help="試すnprobeの値")
+    parser.add_argument("--ef-searches", type=int, nargs="+", default=list(DEFAULT_EF_SEARCHES), help="試すefSearchの値")
+    parser.add_argument("--seed", type=int, default=0, help="サンプリングの乱数シード")
+    args = parser.parse_args()
+
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    main(os.path.join(project_root, args.index),
+         os.path.join(project_root, 'analysis', 'faiss_index_benchmark.json'),
+         args.index_types, args.vectors, args.queries, args.nlist, args.pq_m, args.hnsw_m,
+         args.train_sample, args.nprobes, args.ef_searches, args.seed)
+    print("\n★★★ ベンチマークが完了しました ★★★")
@@ -0,0 +1,116 @@
+import os
+import sys
+import json
+import time
+import shutil
+import typing
+import argparse
+import subprocess
+
+# 検索 (HybridRetriever) は本文を自前のドキュメントストアから読むため、既定では索引に本文やベクトルを保存しない
+# {オプション名: Pyseriniのフラグ}
+STORE_OPTION_FLAGS = {"store_positions": "-storePositions", "store_docvectors": "-storeDocvectors", "store_raw": "-storeRaw"}
+
+def load_config(project_root: str) -> dict:
+    """config.json を読み込む。無ければ config.template.json の既定値を使う"""
+    for name in ('config.json', 'config.template.json'):
+        path = os.path.join(project_root, name)
+        if os.path.exists(path):
+            if name != 'config.json':
+                print(f"[警告] config.json が見つからないため、{name} の設定を使います。")
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+    return {}
+
+def directory_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+def build_index_command(input_dir: str, index_dir: str, threads: int, store_positions: bool = False,
+                        store_docvectors: bool = False, store_raw: bool = False, extra_args: list = ()) -> list:
+    command = [
+        sys.executable, '-m', 'pyserini.index.lucene',
+        '-collection', 'JsonCollection',
+        '-input', input_dir,
+        '-index', index_dir,
+        '-generator', 'DefaultLuceneDocumentGenerator',
+        '-threads', str(threads),
+        '-pretokenized',
+    ]
+    store_options = {"store_positions": store_positions, "store_docvectors": store_docvectors, "store_raw": store_raw}
+    command += [STORE_OPTION_FLAGS[option] for option, enabled in store_options.items() if enabled]
+    return command + list(extra_args)
+
+def open_searcher(index_dir: str):
+    """
+    build_bm25_indexで構築したインデックスを検索するLuceneSearcherを開く。
+    インデックスは分かち書き済み (-pretokenized) のため、クエリも空白で区切るだけのWhitespaceAnalyzerで解析する
+    (既定の英語アナライザーは漢字・かなを1文字ずつに分けるため、「道路」のようなトークンが一致しなくなる)。
+    クエリは、インデックスと同じアナライザー (Sudachi / 文字バイグラム) で空白区切りにしてから渡すこと。
+    """
+    from pyserini.search.lucene import LuceneSearcher
+    from pyserini.analysis import JWhiteSpaceAnalyzer
+    searcher = LuceneSearcher(index_dir)
+    searcher.set_analyzer(JWhiteSpaceAnalyzer())
+    return searcher
+
+def build_bm25_index(input_dir: str, index_dir: str, threads: int, extra_args: list = (), **store_options) -> typing.Optional[dict]:
+    """
+    前処理済み (分かち書き済み) のシャードが入ったディレクトリからLuceneのBM25インデックスを構築する。
+    一時ディレクトリに構築し、成功した場合だけ既存のインデックスと置き換える。
+    成功した場合は構築時間とサイズを返し、失敗した場合はNoneを返す。
+    """
+    print("--- BM25 (Pyserini) インデックスの構築を開始 ---")
+    if not os.path.isdir(input_dir):
+        print(f"[エラー] 入力ディレクトリが見つかりません: {input_dir}")
+        print("先に 'preprocess_docs.py --shards N' を実行してください。")
+        return None
+
+    input_files = [name for name in os.listdir(input_dir) if name.endswith(('.jsonl', '.json'))]
+    input_bytes = sum(os.path.getsize(os.path.join(input_dir, name)) for name in input_files)
+    print(f"入力: {input_dir} ({len(input_files)}ファイル, {input_bytes / 1024**2:,.1f} MB)")
+    print(f"出力: {index_dir}")
+    print(f"スレッド数: {threads} / 保存オプション: {store_options}")
+    if len(input_files) < threads:
+        print(f"[情報] 入力ファイル数 ({len(input_files)}) がスレッド数より少ないため、一部のスレッドは使われません。")
+
+    tmp_index_dir = f"{index_dir}.tmp"
+    shutil.rmtree(tmp_index_dir, ignore_errors=True)
+    command = build_index_command(input_dir, tmp_index_dir, threads, extra_args=extra_args, **store_options)
+
+    start = time.monotonic()
+    result = subprocess.run(command)
+    elapsed = time.monotonic() - start
+    if result.returncode != 0:
+        print(f"[エラー] インデックスの構築に失敗しました (終了コード: {result.returncode})")
+        shutil.rmtree(tmp_index_dir, ignore_errors=True)
+        return None
+
+    shutil.rmtree(index_dir, ignore_errors=True)
+    os.replace(tmp_index_dir, index_dir)
+    index_bytes = directory_size(index_dir)
+    print(f"\n構築時間: {elapsed:,.1f} 秒")
+    print(f"インデックスサイズ: {index_bytes / 1024**2:,.1f} MB (入力の {index_bytes / max(input_bytes, 1):.2f} 倍)")
+    return {"build_seconds": elapsed, "index_bytes": index_bytes, "input_bytes": input_bytes}
+
+if __name__ == "__main__":
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    config = load_config(project_root)
+    paths, pyserini_config = config.get("paths", {}), config.get("pyserini", {})
+
+    parser = argparse.ArgumentParser(description="PyseriniでBM25インデックスを構築する (設定は config.json の pyserini セクション)")
+    parser.add_argument("--input", default=paths.get("pyserini_corpus", "analysis/pyserini_corpus"), help="分かち書き済みシャードのディレクトリ")
+    parser.add_argument("--index", default=paths.get("pyserini_index", "analysis/pyserini_index"), help="インデックスの出力先")
+    parser.add_argument("--threads", type=int, default=pyserini_config.get("threads", os.cpu_count() or 1), help="索引付けのスレッド数")
+    for option, flag in STORE_OPTION_FLAGS.items():
+        parser.add_argument(f"--{option.replace('_', '-')}", dest=option, action=argparse.BooleanOptionalAction,
+                            default=pyserini_config.get(option, False),
+                            help=f"{flag} を付けて構築する (--no-{option.replace('_', '-')} で付けない。既定: config.json の設定)")
+    args = parser.parse_args()
+
+    store_options = {option: getattr(args, option) for option in STORE_OPTION_FLAGS}
+    stats = build_bm25_index(os.path.join(project_root, args.input), os.path.join(project_root, args.index), args.threads, **store_options)
+    if stats:
+        print("\n★★★ BM25インデックスの構築が完了しました ★★★")
@@ -1,47 +1,291 @@
 # src/build_faiss_index.py
-import os, json, faiss, numpy as np
-from sentence_transformers import SentenceTransformer
+import os, json, time, hashlib, argparse, faiss, numpy as np
+from tqdm import tqdm
+from corpus_manifest import content_hash, manifest_path, load_manifest, write_manifest, compute_delta, format_delta
+from faiss_index_factory import (INDEX_TYPES, TRAINED_INDEX_TYPES, DEFAULT_PQ_M, DEFAULT_HNSW_M,
+                                 DEFAULT_TRAIN_SAMPLE, create_index, index_type_of, has_broken_id_map, supports_remove, renumber_ids,
+                                 sample_training_vectors)
+from build_bm25_index import load_config
+from build_search_docs import pack_fragments, FRAGMENT_SEPARATOR
+from embedding_cache import EmbeddingCache, default_cache_dir
+from embedding_backend import BACKENDS, Encoder, encoder_name
+from parallel_runner import default_workers
+from id_mapping import write_id_mapping, binary_path
 
 ST_MODEL_NAME = 'sonoisa/sentence-luke-japanese-base-lite'
 
-def main(docs_filepath, output_dir):
+# 1回に読み込んでエンコードするドキュメント数 (本文はこの件数ずつしかメモリに載せない)
+EMBED_BATCH_DOCS = 1024
+# model.encode に渡すバッチサイズ
+ENCODE_BATCH_SIZE = 32
+# チェックポイントを記録する間隔 (秒)
+CHECKPOINT_INTERVAL_SEC = 60
+# エンコード結果を書き込むメモリマップファイルの型 (float16にするとファイルサイズが半分になる)
+EMBEDDING_DTYPES = ("float32", "float16")
+# パッセージ (ベクトル1件あたりの本文) の上限バイト数。モデルの最大系列長 (512トークン) で切り捨てられない長さにする
+# (日本語は1文字3バイト・1トークン1〜2文字程度のため、約400文字)
+PASSAGE_MAX_BYTES = 1200
+# IDマッピングの欠番 (削除されたベクトル) がこの割合を超えたら、IDを詰め直す (IVF系は全件から構築し直す)
+ID_MAPPING_MAX_TOMBSTONE_RATIO = 0.2
+# パッセージのIDで、ドキュメントIDの後ろに付ける目印 (corpus_manifest.PARENT_ID_MARKERS にも含める)
+PASSAGE_ID_MARKER = "_psg_"
+
+def split_passages(contents, max_bytes=PASSAGE_MAX_BYTES):
+    """本文を「詳細: 値」の断片の境界で、max_bytes以下のパッセージに分ける"""
+    return pack_fragments(contents.split(FRAGMENT_SEPARATOR), max_bytes) or [contents]
+
+def passage_id(doc_id, n):
+    return f"{doc_id}{PASSAGE_ID_MARKER}{n}"
+
+def passage_doc_id(pid):
+    """パッセージのIDから、元のドキュメント (検索ドキュメントの1行) のIDを取り出す"""
+    return pid.rsplit(PASSAGE_ID_MARKER, 1)[0]
+
+def embedding_hash(contents, max_bytes, encoder):
+    """
+    本文・パッセージの長さ・エンコーダー (encoder_nameの「モデル名@方式」) から計算するハッシュ。
+    パッセージの長さやモデル・方式を変えると全件が「変更」として扱われ、異なる埋め込み空間のベクトルが混ざらない
+    """
+    return content_hash(f"{encoder}\n{max_bytes}\n{contents}")
+
+def embeddings_path(output_dir):
+    """エンコード中のベクトルを書き込むメモリマップファイル (.npy) のパス"""
+    return os.path.join(output_dir, "faiss_embeddings.npy")
+
+def checkpoint_path(output_dir):
+    return os.path.join(output_dir, "faiss_embeddings.checkpoint.json")
+
+def write_checkpoint(path, state):
+    with open(f"{path}.tmp", 'w', encoding='utf-8') as f: json.dump(state, f, ensure_ascii=False)
+    os.replace(f"{path}.tmp", path)
+
+def pending_digest(pending, hashes):
+    """エンコード対象 (ドキュメントIDと本文のハッシュ) を識別するハッシュ。入力が変わっていればチェックポイントを使わない"""
+    h = hashlib.sha1()
+    for doc_id, _, _ in pending:
+        h.update(f"{doc_id}\t{hashes[doc_id]}\n".encode('utf-8'))
+    return h.hexdigest()
+
+def load_resume_state(output_dir, digest, model_name, dtype):
+    """有効なチェックポイントがあればその内容を返す。エンコード対象や設定が変わっていれば破棄してNoneを返す"""
+    path = checkpoint_path(output_dir)
+    if not os.path.exists(path) or not os.path.exists(embeddings_path(output_dir)): return None
+    with open(path, 'r', encoding='utf-8') as f: state = json.load(f)
+    if state.get("pending_digest") != digest or state.get("model") != model_name or state.get("dtype") != dtype:
+        print("-> 入力または設定が変わったため、チェックポイントを破棄して最初からエンコードします。"); return None
+    return state
+
+def iter_passage_batches(docs_filepath, pending, start, batch_docs, max_bytes):
+    """pending[start:] のドキュメントを入力のバイト位置から batch_docs 件ずつ読み込み、パッセージのリストにして返す"""
+    with open(docs_filepath, 'rb') as f:
+        for batch_start in range(start, len(pending), batch_docs):
+            passages = []
+            for _, offset, _ in pending[batch_start:batch_start + batch_docs]:
+                f.seek(offset); passages.extend(split_passages(json.loads(f.readline())['contents'], max_bytes))
+            yield batch_start + len(pending[batch_start:batch_start + batch_docs]), passages
+
+def encode_passages(model, passages, cache):
+    """パッセージをエンコードする。キャッシュがあれば、キャッシュに無いパッセージだけをエンコードしてキャッシュに追加する"""
+    if cache is None:
+        return model.encode(passages, batch_size=ENCODE_BATCH_SIZE, show_progress_bar=False), 0
+    keys = [EmbeddingCache.key(passage) for passage in passages]
+    cached = cache.get_many(keys)
+    hits = sum(1 for key in keys if key in cached)
+    missing = list(dict.fromkeys(key for key in keys if key not in cached))
+    if missing:
+        texts = {key: passage for key, passage in zip(keys, passages)}
+        vectors = model.encode([texts[key] for key in missing], batch_size=ENCODE_BATCH_SIZE, show_progress_bar=False)
+        cache.put_many(missing, vectors)
+        cached.update(zip(missing, vectors))
+    return np.stack([cached[key] for key in keys]), hits
+
+def encode_to_memmap(docs_filepath, output_dir, pending, hashes, dtype, batch_docs, max_bytes, cache_dir=None,
+                     backend="torch", encode_workers=1):
+    """
+    エンコード対象のドキュメントを batch_docs 件ずつパッセージに分けてエンコードし、メモリマップファイルに書き込む。
+    backend・encode_workersでエンコードの方式とプロセス数を選ぶ (embedding_backend.py)。
+    cache_dirを指定した場合は、(モデル名, パッセージのハッシュ) をキーにした埋め込みキャッシュを使う (embedding_cache.py)。
+    定期的にチェックポイントを記録し、中断された場合はエンコード済みのドキュメントの次から再開する。
+    書き込み済みのメモリマップ配列 (パッセージ数 × 次元数) を返す。
+    """
+    digest = pending_digest(pending, hashes)
+    ckpt_path, emb_path = checkpoint_path(output_dir), embeddings_path(output_dir)
+    model_key = encoder_name(ST_MODEL_NAME, backend)
+    state = load_resume_state(output_dir, digest, model_key, dtype)
+    total_passages = sum(n for _, _, n in pending)
+
+    print(f"'{ST_MODEL_NAME}' モデルをロード中... (方式: {backend} / プロセス数: {encode_workers or default_workers()})")
+    with Encoder(ST_MODEL_NAME, backend, encode_workers) as model:
+        if state:
+            print(f"-> チェックポイントから再開します ({state['encoded']:,} / {len(pending):,}件はエンコード済み)")
+            embeddings = np.load(emb_path, mmap_mode='r+')
+        else:
+            dim = model.get_sentence_embedding_dimension()
+            embeddings = np.lib.format.open_memmap(emb_path, mode='w+', dtype=dtype, shape=(total_passages, dim))
+            state = {"pending_digest": digest, "model": model_key, "dtype": dtype, "encoded": 0, "rows": 0}
+            write_checkpoint(ckpt_path, state)
+        cache = EmbeddingCache(cache_dir, model_key, embeddings.shape[1]) if cache_dir else None
+        if cache is not None:
+            print(f"埋め込みキャッシュ: {cache.dir} ({len(cache):,}件)")
+
+        print(f"ドキュメントをベクトルにエンコード中... ({len(pending):,}件 / {total_passages:,}パッセージ / 保存形式: {dtype})")
+        last_checkpoint, cache_hits, start_rows = time.monotonic(), 0, state["rows"]
+        with tqdm(total=total_passages, initial=state["rows"], desc="Encoding passages") as pbar:
+            for encoded, passages in iter_passage_batches(docs_filepath, pending, state["encoded"], batch_docs, max_bytes):
+                rows = state["rows"]
+                vectors, hits = encode_passages(model, passages, cache)
+                embeddings[rows:rows + len(passages)] = vectors
+                cache_hits += hits
+                state["encoded"], state["rows"] = encoded, rows + len(passages)
+                pbar.update(len(passages))
+                if time.monotonic() - last_checkpoint >= CHECKPOINT_INTERVAL_SEC:
+                    embeddings.flush(); write_checkpoint(ckpt_path, state)
+                    last_checkpoint = time.monotonic()
+    embeddings.flush(); write_checkpoint(ckpt_path, state)
+    if cache is not None:
+        print(f"-> キャッシュから再利用: {cache_hits:,}パッセージ / 新たにエンコード: {state['rows'] - start_rows - cache_hits:,}パッセージ")
+    return embeddings
+
+def main(docs_filepath, output_dir, dtype="float32", batch_docs=EMBED_BATCH_DOCS, index_type="flat", nlist=None,
+         pq_m=DEFAULT_PQ_M, hnsw_m=DEFAULT_HNSW_M, train_sample=DEFAULT_TRAIN_SAMPLE, passage_max_bytes=PASSAGE_MAX_BYTES,
+         use_embedding_cache=True, backend="torch", encode_workers=1):
+    """
+    各ドキュメントをpassage_max_bytes以下のパッセージに分けてエンコードし、パッセージ単位でインデックスに追加する。
+    IDマッピングにはパッセージのID ({ドキュメントID}_psg_{n}) を記録する。
+    use_embedding_cacheが真の場合は、output_dir/embedding_cache に保存したエンコード結果を再利用する
+    (インデックスを構築し直す場合や、一部の断片だけが変わったドキュメントでも、同じパッセージはエンコードしない)。
+    index_typeでインデックスの種類 (flat / ivf_flat / ivf_pq / hnsw / sq8 / sq_fp16) を選ぶ (faiss_index_factory.pyを参照)。
+    IVF系・sq8は、新規に構築するときにエンコードしたベクトルから最大train_sample件を選んで学習する。
+    backend (torch / int8 / onnx) とencode_workers (プロセス数) でエンコードの方式を選ぶ (embedding_backend.py)。
+    """
     print("--- Faiss (ベクトル) インデックスの構築を開始 ---")
-    
+
     faiss_index_path = os.path.join(output_dir, "faiss_index.bin")
     id_mapping_path = os.path.join(output_dir, "faiss_id_mapping.json")
+    hashes_path = manifest_path(faiss_index_path)
 
-    if os.path.exists(faiss_index_path):
-        print("-> Faissインデックスが既に存在するため、処理を中断します。")
-        return
-        
-    print(f"'{ST_MODEL_NAME}' モデルをロード中...")
-    model = SentenceTransformer(ST_MODEL_NAME)
-    
-    docs_for_faiss, doc_ids = [], []
-    with open(docs_filepath, 'r', encoding='utf-8') as f:
+    # 既存のインデックスとハッシュ一覧があれば、追加・変更・削除されたドキュメントだけを反映する
+    index_mapped, doc_ids, previous = None, [], {}
+    if os.path.exists(faiss_index_path) and not os.path.exists(hashes_path):
+        print("-> ハッシュ一覧の無い既存のインデックスは更新できないため、全件から構築し直して置き換えます。")
+    elif os.path.exists(faiss_index_path):
+        index_mapped = faiss.read_index(faiss_index_path)
+        existing_type = index_type_of(index_mapped)
+        if existing_type != index_type:
+            print(f"-> 既存のインデックス ({existing_type}) と種類 ({index_type}) が異なるため、全件から構築し直します。")
+            index_mapped = None
+        elif has_broken_id_map(index_mapped):
+            print(f"-> 既存の {existing_type} はIndexIDMapで包まれており、差分の反映でIDがずれるため、全件から構築し直します。")
+            index_mapped = None
+        else:
+            with open(id_mapping_path, 'r', encoding='utf-8') as f:
+                doc_ids = json.load(f)
+            # 前回の書き出しが途中で中断された場合は、インデックスとIDマッピングのベクトル数が合わない
+            if index_mapped.ntotal != len(doc_ids) - doc_ids.count(None):
+                print("-> インデックスとIDマッピングの件数が一致しないため、全件から構築し直します。")
+                index_mapped, doc_ids = None, []
+            else:
+                previous = load_manifest(hashes_path)
+
+    # 本文はメモリに載せず、ドキュメントIDと入力のバイト位置・パッセージ数だけを記録する
+    hashes, offsets, encoder = {}, {}, encoder_name(ST_MODEL_NAME, backend)
+    with open(docs_filepath, 'rb') as f:
+        offset = 0
         for line in f:
             doc = json.loads(line)
-            docs_for_faiss.append(doc['contents'])
-            doc_ids.append(doc['id'])
-    
-    print("ドキュメントをベクトルにエンコード中...")
-    embeddings = model.encode(docs_for_faiss, show_progress_bar=True)
-    
-    d = embeddings.shape[1]
-    index = faiss.IndexFlatL2(d)
-    ids_np = np.array(range(len(doc_ids))).astype('int64')
-    index_mapped = faiss.IndexIDMap(index)
-    index_mapped.add_with_ids(embeddings.astype('float32'), ids_np)
+            hashes[doc['id']] = embedding_hash(doc['contents'], passage_max_bytes, encoder)
+            offsets[doc['id']] = (offset, len(split_passages(doc['contents'], passage_max_bytes)))
+            offset += len(line)
+
+    delta = compute_delta(hashes, previous)
+    print(f"前回からの差分: {format_delta(delta)}")
+    pending = [(doc_id, *offsets[doc_id]) for doc_id, doc_hash in hashes.items() if previous.get(doc_id) != doc_hash]
+    if index_mapped is not None and not pending and not delta["removed"]:
+        print("-> 更新されたドキュメントはありません。")
+        return
+
+    # エンコードし直すドキュメントと削除されたドキュメントのベクトルを取り除く (IDマッピングの該当位置は欠番にする)
+    # (前回がハッシュ一覧の更新前に中断された場合、「追加」のドキュメントもインデックスに入っていることがある)
+    stale = {doc_id for doc_id, _, _ in pending} | set(delta["removed"])
+    stale_ids = [i for i, pid in enumerate(doc_ids) if pid is not None and passage_doc_id(pid) in stale]
+    if stale_ids and not supports_remove(index_type):
+        print(f"-> {index_type} はベクトルの削除に対応しないため、全件から構築し直します。")
+        index_mapped, doc_ids, stale_ids = None, [], []
+        pending = [(doc_id, *position) for doc_id, position in offsets.items()]
+    if stale_ids:
+        index_mapped.remove_ids(np.array(stale_ids, dtype='int64'))
+        for i in stale_ids:
+            doc_ids[i] = None
+
+    # 欠番が増えすぎたら、IDマッピングを詰め直す (IDを付け替えられないIVF系は全件から構築し直す)
+    tombstones = doc_ids.count(None)
+    if tombstones and tombstones > len(doc_ids) * ID_MAPPING_MAX_TOMBSTONE_RATIO:
+        live = [i for i, pid in enumerate(doc_ids) if pid is not None]
+        remap = np.full(len(doc_ids), -1, dtype='int64')
+        remap[live] = np.arange(len(live))
+        if renumber_ids(index_mapped, remap):
+            print(f"-> IDマッピングの欠番 {tombstones:,}件を詰めました。")
+            doc_ids = [doc_ids[i] for i in live]
+        else:
+            print(f"-> IDマッピングの欠番が {tombstones:,}件に増えたため、全件から構築し直します。")
+            index_mapped, doc_ids = None, []
+            pending = [(doc_id, *position) for doc_id, position in offsets.items()]
+    del offsets
 
     os.makedirs(output_dir, exist_ok=True)
-    faiss.write_index(index_mapped, faiss_index_path)
-    with open(id_mapping_path, 'w', encoding='utf-8') as f:
+    if pending:
+        embeddings = encode_to_memmap(docs_filepath, output_dir, pending, hashes, dtype, batch_docs, passage_max_bytes,
+                                      default_cache_dir(output_dir) if use_embedding_cache else None, backend, encode_workers)
+
+        if index_mapped is None:
+            print(f"インデックスの種類: {index_type}")
+            training_vectors = sample_training_vectors(embeddings, train_sample) if index_type in TRAINED_INDEX_TYPES else None
+            index_mapped = create_index(index_type, embeddings.shape[1], training_vectors, nlist, pq_m, hnsw_m)
+            del training_vectors
+        # Faissにはfloat32で渡す必要があるため、メモリマップから batch_docs 件ずつ変換して追加する
+        for start in tqdm(range(0, len(embeddings), batch_docs), desc="Adding"):
+            end = min(start + batch_docs, len(embeddings))
+            ids_np = np.arange(len(doc_ids) + start, len(doc_ids) + end).astype('int64')
+            index_mapped.add_with_ids(np.ascontiguousarray(embeddings[start:end], dtype='float32'), ids_np)
+        doc_ids.extend(passage_id(doc_id, n) for doc_id, _, num_passages in pending for n in range(num_passages))
+        del embeddings
+
+    # すべて一時ファイルに書いてから置き換え、ハッシュ一覧は最後に更新する
+    # (途中で中断しても、次回は件数の不一致を検出するか、前回のハッシュ一覧から同じ差分を反映し直す)
+    faiss.write_index(index_mapped, f"{faiss_index_path}.tmp")
+    with open(f"{id_mapping_path}.tmp", 'w', encoding='utf-8') as f:
         json.dump(doc_ids, f)
+    os.replace(f"{faiss_index_path}.tmp", faiss_index_path)
+    os.replace(f"{id_mapping_path}.tmp", id_mapping_path)
+    # 検索側 (retriever.py) がメモリマップで読むバイナリ形式 (faiss_id_mapping.bin) も書き出す
+    write_id_mapping(binary_path(id_mapping_path), doc_ids)
+    write_manifest(hashes_path, hashes)
+    # インデックスに反映し終えたら、エンコード途中の成果物は不要になる
+    for path in (embeddings_path(output_dir), checkpoint_path(output_dir)):
+        if os.path.exists(path): os.remove(path)
 
     print(f"-> FaissインデックスとIDマッピングが構築されました。")
 
 if __name__ == "__main__":
     project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    faiss_config = load_config(project_root).get("faiss", {})
+
+    parser = argparse.ArgumentParser(description="検索ドキュメントをベクトルにエンコードし、Faissインデックスを構築する (設定は config.json の faiss セクション)")
+    parser.add_argument("--dtype", choices=EMBEDDING_DTYPES, default="float32", help="エンコード途中のベクトルを保存する型 (float16はディスク使用量が半分)")
+    parser.add_argument("--batch-docs", type=int, default=EMBED_BATCH_DOCS, help="1回に読み込んでエンコードするドキュメント数")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default=faiss_config.get("index_type", "flat"), help="インデックスの種類")
+    parser.add_argument("--nlist", type=int, default=faiss_config.get("nlist"), help="IVFのクラスタ数 (既定: ベクトル数から決める)")
+    parser.add_argument("--pq-m", type=int, default=faiss_config.get("pq_m", DEFAULT_PQ_M), help="IVF-PQのサブベクトル数 (次元数の約数)")
+    parser.add_argument("--hnsw-m", type=int, default=faiss_config.get("hnsw_m", DEFAULT_HNSW_M), help="HNSWの各ノードの接続数")
+    parser.add_argument("--passage-bytes", type=int, default=faiss_config.get("passage_max_bytes", PASSAGE_MAX_BYTES), help="パッセージの上限バイト数")
+    parser.add_argument("--backend", choices=BACKENDS, default=faiss_config.get("encoder_backend", "torch"), help="エンコードの方式 (int8: 動的量子化 / onnx: ONNX Runtime)")
+    parser.add_argument("--encode-workers", type=int, default=faiss_config.get("encode_workers", 1), help="エンコードのプロセス数 (0: CPUコア数)")
+    parser.add_argument("--no-embedding-cache", action="store_true", help="埋め込みキャッシュを使わずに全パッセージをエンコードする")
+    parser.add_argument("--train-sample", type=int, default=faiss_config.get("train_sample", DEFAULT_TRAIN_SAMPLE), help="IVFの学習に使うベクトル数")
+    args = parser.parse_args()
+
     analysis_dir = os.path.join(project_root, 'analysis')
     docs_input_path = os.path.join(analysis_dir, 'search_documents.jsonl')
-    main(docs_input_path, analysis_dir) # 出力先はanalysisフォルダ
\ No newline at end of file
+    main(docs_input_path, analysis_dir, args.dtype, args.batch_docs, args.index_type, args.nlist,
+         args.pq_m, args.hnsw_m, args.train_sample, args.passage_bytes,
+         not args.no_embedding_cache, args.backend, args.encode_workers or None) # 出力先はanalysisフォルダ
@@ -0,0 +1,220 @@
+import os
+import re
+import argparse
+import unicodedata
+from collections import defaultdict
+import duckdb
+from tqdm import tqdm
+
+# --- 年度間の事業対応付けのルール定義 ---
+# 事業名が入っている列 (original_column_name または concept)
+PROJECT_NAME_COLUMNS = ["事業名"]
+# 事業番号が一致した場合に、同一事業とみなすための最低限の事業名類似度 (番号の振り直し対策)
+ID_MATCH_MIN_SIMILARITY = 0.5
+# 事業番号が一致した候補に加える順位付け用のボーナス
+ID_MATCH_BONUS = 0.2
+# 事業番号が一致しない場合に、事業名だけで同一事業とみなす類似度 (文字バイグラムのJaccard係数)
+NAME_MATCH_THRESHOLD = 0.8
+# 出現する事業名がこれより多いバイグラムは、ブロッキングのキーに使わない (「事業」など)
+MAX_BLOCK_SIZE = 500
+
+LINEAGE_TABLE = "project_lineage"
+
+def normalize_name(name: str) -> str:
+    """全角・半角の揺れと空白を除去した事業名"""
+    if not name:
+        return ""
+    return re.sub(r'\s+', '', unicodedata.normalize('NFKC', name))
+
+def name_bigrams(name: str) -> set:
+    normalized = normalize_name(name)
+    if len(normalized) < 2:
+        return {normalized} if normalized else set()
+    return {normalized[i:i + 2] for i in range(len(normalized) - 1)}
+
+def jaccard(a: set, b: set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+def has_business_id(business_id: str) -> bool:
+    """transform_parquet_to_load_db.py で空の部品が '' になったID ('--' など) を除外する"""
+    return bool(business_id) and business_id.strip('-') != ""
+
+def ensure_lineage_table(con):
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {LINEAGE_TABLE} (
+            year VARCHAR,
+            business_id VARCHAR,
+            project_key VARCHAR,
+            project_name VARCHAR,
+            match_method VARCHAR,
+            match_score DOUBLE
+        )
+    """)
+    con.execute(f"CREATE INDEX IF NOT EXISTS idx_{LINEAGE_TABLE}_year_id ON {LINEAGE_TABLE} (year, business_id)")
+    con.execute(f"CREATE INDEX IF NOT EXISTS idx_{LINEAGE_TABLE}_key ON {LINEAGE_TABLE} (project_key)")
+
+def load_year_projects(con, year: str) -> list:
+    """clean_long_dataから、指定年度の (business_id, 事業名) の一覧を取得する"""
+    placeholders = ', '.join('?' for _ in PROJECT_NAME_COLUMNS)
+    query = f"""
+        SELECT
+            business_id,
+            min(value) FILTER (WHERE original_column_name IN ({placeholders}) OR concept IN ({placeholders})) AS project_name
+        FROM clean_long_data
+        WHERE year = ?
+        GROUP BY business_id
+        ORDER BY business_id
+    """
+    return con.execute(query, PROJECT_NAME_COLUMNS + PROJECT_NAME_COLUMNS + [year]).fetchall()
+
+class LineageMatcher:
+    """
+    既知の事業 (project_keyごとの最新の出現) を保持し、新しい年度の事業を対応付ける。
+    事業名の照合は、出現頻度の低いバイグラムを共有する事業だけを候補にするブロッキングで絞り込む。
+    """
+    def __init__(self):
+        self.latest = {}  # project_key -> {"business_id", "bigrams"}
+        self.by_business_id = defaultdict(set)
+        self.block_index = defaultdict(set)
+
+    def register(self, project_key: str, business_id: str, project_name: str):
+        previous = self.latest.get(project_key)
+        if previous:
+            self.by_business_id[previous["business_id"]].discard(project_key)
+            for gram in previous["bigrams"]:
+                self.block_index[gram].discard(project_key)
+        bigrams = name_bigrams(project_name)
+        if not bigrams and previous:
+            bigrams = previous["bigrams"] # 事業名が取れなかった年度は、前回の事業名で照合を続ける
+        self.latest[project_key] = {"business_id": business_id, "bigrams": bigrams}
+        if has_business_id(business_id):
+            self.by_business_id[business_id].add(project_key)
+        for gram in bigrams:
+            self.block_index[gram].add(project_key)
+
+    def candidates(self, business_id: str, bigrams: set) -> list:
+        """(順位付けスコア, project_key, method, 事業名の類似度) の候補リストを返す"""
+        results = []
+        id_matches = self.by_business_id.get(business_id, ()) if has_business_id(business_id) else ()
+        for project_key in id_matches:
+            known_bigrams = self.latest[project_key]["bigrams"]
+            if not bigrams or not known_bigrams:
+                # 事業名が取れない年度もあるため、名前が欠けている場合は番号一致のみで対応付ける
+                results.append((ID_MATCH_BONUS, project_key, "id", None))
+                continue
+            similarity = jaccard(bigrams, known_bigrams)
+            if similarity >= ID_MATCH_MIN_SIMILARITY:
+                results.append((similarity + ID_MATCH_BONUS, project_key, "id", similarity))
+
+        blocked = set()
+        for gram in bigrams:
+            keys = self.block_index.get(gram)
+            if keys and len(keys) <= MAX_BLOCK_SIZE:
+                blocked |= keys
+        for project_key in blocked:
+            similarity = jaccard(bigrams, self.latest[project_key]["bigrams"])
+            if similarity >= NAME_MATCH_THRESHOLD:
+                results.append((similarity, project_key, "name", similarity))
+        return results
+
+    def match_year(self, year: str, projects: list) -> list:
+        """
+        1年度分の事業を既知の事業に1対1で対応付ける (スコアの高い組から貪欲に確定)。
+        対応先がなければ新しいproject_keyを発行する。戻り値はlineageテーブルの行。
+        """
+        scored = []
+        for business_id, project_name in projects:
+            bigrams = name_bigrams(project_name)
+            for score, project_key, method, similarity in self.candidates(business_id, bigrams):
+                scored.append((score, business_id, project_key, method, similarity))
+        scored.sort(key=lambda x: (-x[0], x[1], x[2]))
+
+        assigned, used_keys = {}, set()
+        for score, business_id, project_key, method, similarity in scored:
+            if business_id in assigned or project_key in used_keys:
+                continue
+            assigned[business_id] = (project_key, method, round(similarity, 3) if similarity is not None else None)
+            used_keys.add(project_key)
+
+        rows = []
+        for business_id, project_name in projects:
+            if business_id in assigned:
+                project_key, method, score = assigned[business_id]
+            else:
+                project_key, method, score = f"{year}:{business_id}", "new", None
+            rows.append((year, business_id, project_key, project_name, method, score))
+            self.register(project_key, business_id, project_name)
+        return rows
+
+def build_project_lineage(db_filepath: str, rebuild: bool = False):
+    """
+    clean_long_dataから年度横断の事業対応表 (project_lineage) を構築・更新する。
+    既存の表がある場合は、まだ登録されていない年度だけを追加で対応付ける。
+    """
+    print("--- 年度横断の事業対応表 (project_lineage) の構築を開始 ---")
+    if not os.path.exists(db_filepath):
+        print(f"[エラー] データベースファイルが見つかりません: {db_filepath}")
+        return
+
+    con = None
+    try:
+        con = duckdb.connect(database=db_filepath, read_only=False)
+        if rebuild:
+            con.execute(f"DROP TABLE IF EXISTS {LINEAGE_TABLE}")
+        ensure_lineage_table(con)
+
+        all_years = sorted((row[0] for row in con.execute("SELECT DISTINCT year FROM clean_long_data WHERE year IS NOT NULL AND year != ''").fetchall()), key=int)
+        done_years = {row[0] for row in con.execute(f"SELECT DISTINCT year FROM {LINEAGE_TABLE}").fetchall()}
+        new_years = [y for y in all_years if y not in done_years]
+        if not new_years:
+            print("追加する年度はありません。")
+            return
+        if done_years and int(new_years[0]) < max(int(y) for y in done_years):
+            print(f"[警告] 既存の年度より前の年度 {new_years[0]} が追加されています。対応付けの順序を保つため --rebuild での再構築を推奨します。")
+
+        # 既存の対応表から、各事業の最新の出現を復元する
+        matcher = LineageMatcher()
+        existing = con.execute(f"SELECT project_key, business_id, project_name FROM {LINEAGE_TABLE} ORDER BY CAST(year AS INTEGER)").fetchall()
+        for project_key, business_id, project_name in existing:
+            matcher.register(project_key, business_id, project_name)
+
+        for year in tqdm(new_years, desc="Linking years"):
+            projects = load_year_projects(con, year)
+            rows = matcher.match_year(year, projects)
+            con.executemany(f"INSERT INTO {LINEAGE_TABLE} VALUES (?, ?, ?, ?, ?, ?)", rows)
+            methods = defaultdict(int)
+            for row in rows:
+                methods[row[4]] += 1
+            tqdm.write(f"  {year}年度: {len(rows):,}件 (番号一致 {methods['id']:,} / 名称一致 {methods['name']:,} / 新規 {methods['new']:,})")
+
+        total = con.execute(f"SELECT COUNT(*), COUNT(DISTINCT project_key) FROM {LINEAGE_TABLE}").fetchone()
+        print(f"\n対応表の行数: {total[0]:,} 件 / 事業数 (project_key): {total[1]:,} 件")
+
+    except Exception as e:
+        print(f"[エラー] 処理中に問題が発生しました: {e}")
+    finally:
+        if con:
+            con.close()
+
+def lookup_project_history(con, year: str, business_id: str) -> list:
+    """指定した年度・事業番号の事業について、全年度の (year, business_id, project_name) を返す"""
+    return con.execute(f"""
+        SELECT l.year, l.business_id, l.project_name
+        FROM {LINEAGE_TABLE} l
+        JOIN {LINEAGE_TABLE} target ON l.project_key = target.project_key
+        WHERE target.year = ? AND target.business_id = ?
+        ORDER BY CAST(l.year AS INTEGER)
+    """, [year, business_id]).fetchall()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="年度横断の事業対応表 (project_lineage) を構築する")
+    parser.add_argument("--rebuild", action="store_true", help="既存の対応表を破棄して全年度を再構築する")
+    args = parser.parse_args()
+
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    db_path = os.path.join(project_root, 'data', 'header_matrix.duckdb')
+
+    build_project_lineage(db_path, args.rebuild)
+    print("\n★★★ 事業対応表の構築が完了しました ★★★")
@@ -1,12 +1,80 @@
 import os
 import duckdb
 import json
+import hashlib
+import argparse
 from tqdm import tqdm
+from corpus_manifest import content_hash, manifest_path, load_manifest, write_manifest, compute_delta, format_delta
 
-def create_search_documents(db_filepath, output_filepath):
+# DuckDBから一度に受け取るグループ数 (1件が数MBになることもあるため小さめにする)
+DOC_BATCH_ROWS = 256
+
+# セクション単位のドキュメント1件あたりの本文の上限 (UTF-8のバイト数)
+SECTION_MAX_BYTES = 64 * 1024
+# 「詳細: 値」の断片をつなぐ区切り文字
+FRAGMENT_SEPARATOR = '。 '
+# セクションのドキュメントIDで、親 (事業) のIDとセクション部分を区切る文字列
+SECTION_ID_MARKER = "_sec_"
+
+GRANULARITIES = ("section", "project")
+
+def section_key(concept, block) -> str:
+    """
+    concept/blockから、年度をまたいで変わらない短いキーを作る。
+    セクションの追加・削除で他のセクションのIDがずれないよう、連番ではなくハッシュを使う。
+    """
+    return hashlib.sha1(f"{concept or ''}\x1f{block or ''}".encode('utf-8')).hexdigest()[:10]
+
+def split_text_by_bytes(text: str, max_bytes: int) -> list:
+    """上限を超える1つの断片を、文字の途中で切らないようにバイト数で分割する"""
+    parts, text_bytes, start = [], text.encode('utf-8'), 0
+    while start < len(text_bytes):
+        part = text_bytes[start:start + max_bytes].decode('utf-8', errors='ignore')
+        parts.append(part)
+        start += len(part.encode('utf-8'))
+    return parts
+
+def pack_fragments(fragments: list, max_bytes: int = SECTION_MAX_BYTES) -> list:
+    """断片を順番に詰め、1件あたりmax_bytes以下の本文のリストにする"""
+    packed, current, current_bytes = [], [], 0
+    separator_bytes = len(FRAGMENT_SEPARATOR.encode('utf-8'))
+    for fragment in fragments:
+        for piece in split_text_by_bytes(fragment, max_bytes):
+            piece_bytes = len(piece.encode('utf-8'))
+            if current and current_bytes + separator_bytes + piece_bytes > max_bytes:
+                packed.append(FRAGMENT_SEPARATOR.join(current))
+                current, current_bytes = [], 0
+            current_bytes += piece_bytes + (separator_bytes if current else 0)
+            current.append(piece)
+    if current:
+        packed.append(FRAGMENT_SEPARATOR.join(current))
+    return packed
+
+def build_documents(year, business_id, concept, block, fragments, granularity: str) -> list:
+    """集約した1グループ (事業、または事業内のconcept/block) からドキュメントを作る"""
+    parent_id = f"{year}-{business_id}"
+    fragments = [fragment for fragment in fragments if fragment is not None]
+    if granularity == "project":
+        return [{"id": parent_id, "contents": FRAGMENT_SEPARATOR.join(fragments)}]
+
+    section = " / ".join(part for part in (concept, block) if part)
+    key = section_key(concept, block)
+    return [
+        {
+            "id": f"{parent_id}{SECTION_ID_MARKER}{key}_{part_num}",
+            "parent_id": parent_id,
+            "section": section,
+            "contents": contents,
+        }
+        for part_num, contents in enumerate(pack_fragments(fragments))
+    ]
+
+def create_search_documents(db_filepath, output_filepath, granularity="section"):
     """
-    DuckDBのclean_long_dataテーブルから、事業ごとの検索ドキュメントを作成し、
-    JSONL形式で出力する。
+    DuckDBのclean_long_dataテーブルから検索ドキュメントを作成し、JSONL形式で出力する。
+    granularity="section" (既定) では、事業内のconcept/blockごとに上限サイズ以下のドキュメントを作り、
+    親 (事業) のIDを parent_id に持たせる。"project" では従来通り事業ごとに1件のドキュメントを作る。
+    各ドキュメントの本文のハッシュを隣のマニフェストに保存し、前回からの差分 (追加・変更・削除) を報告する。
     """
     print("--- 検索ドキュメントの作成を開始します ---")
 
@@ -19,37 +87,49 @@ def create_search_documents(db_filepath, output_filepath):
         con = duckdb.connect(database=db_filepath, read_only=True)
         print(f"データベースに接続しました: {db_filepath}")
 
-        aggregation_query = """
+        group_columns = "year, business_id" if granularity == "project" else "year, business_id, concept, block"
+        aggregation_query = f"""
         SELECT
             year,
             business_id,
-            string_agg(detail || ': ' || value, '。 ') AS contents
+            {'NULL AS concept, NULL AS block' if granularity == 'project' else 'concept, block'},
+            -- 差分検出のため、同じデータからは常に同じ本文になるよう並び順を固定する
+            list(detail || ': ' || value ORDER BY concept, block, TRY_CAST(item_index AS INTEGER), detail, value) AS fragments
         FROM
             clean_long_data
         GROUP BY
-            year, business_id;
+            {group_columns};
         """
 
-        print("SQLクエリを実行し、事業ごとに情報を集約しています...")
-        results = con.execute(aggregation_query).fetchall()
-        
-        if not results:
+        # 全件をfetchall()でPythonのメモリに載せず、Arrowのレコードバッチ単位で受け取りながら書き出す
+        # (件数を数えるためだけにclean_long_dataを再スキャンしないよう、進捗バーの総数は指定しない。
+        #  差分はマニフェストのハッシュで検出するため、グループの出力順は固定しない)
+        print("SQLクエリを実行し、集約した結果をJSONLファイルに書き込んでいます...")
+        reader = con.execute(aggregation_query).fetch_record_batch(DOC_BATCH_ROWS)
+
+        written, hashes = 0, {}
+        tmp_path = f"{output_filepath}.tmp"
+        unit = "事業" if granularity == "project" else "セクション"
+        with open(tmp_path, 'w', encoding='utf-8') as f, tqdm(desc="Writing Documents", unit=unit) as pbar:
+            for batch in reader:
+                columns = batch.to_pydict()
+                for row in zip(columns["year"], columns["business_id"], columns["concept"], columns["block"], columns["fragments"]):
+                    for doc in build_documents(*row, granularity=granularity):
+                        f.write(json.dumps(doc, ensure_ascii=False) + '\n')
+                        hashes[doc["id"]] = content_hash(doc["contents"])
+                        written += 1
+                pbar.update(batch.num_rows)
+        if not written:
+            os.remove(tmp_path)
             print("[警告] データベースに集約対象のデータがありませんでした。")
             return
+        os.replace(tmp_path, output_filepath)
 
-        print(f"集約された事業（ドキュメント）数: {len(results)}件")
-        print("JSONLファイルに書き込んでいます...")
-
-        with open(output_filepath, 'w', encoding='utf-8') as f:
-            for row in tqdm(results, desc="Writing Documents"):
-                year, business_id, contents = row
-                doc_id = f"{year}-{business_id}"
-                doc = {
-                    "id": doc_id,
-                    "contents": contents
-                }
-                f.write(json.dumps(doc, ensure_ascii=False) + '\n')
-        
+        hashes_path = manifest_path(output_filepath)
+        delta = compute_delta(hashes, load_manifest(hashes_path))
+        write_manifest(hashes_path, hashes)
+        print(f"書き込んだドキュメント数: {written}件")
+        print(f"前回からの差分: {format_delta(delta)}")
         print("\n★★★ 検索ドキュメントの作成が完了しました ★★★")
 
     except Exception as e:
@@ -61,13 +141,18 @@ def create_search_documents(db_filepath, output_filepath):
             con.close()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="clean_long_dataから検索ドキュメントを作成する")
+    parser.add_argument("--granularity", choices=GRANULARITIES, default="section",
+                        help="section: concept/blockごとの上限サイズ付きドキュメント / project: 事業ごとに1件")
+    args = parser.parse_args()
+
     print("★★★ RAGフェーズ ステップ2.1: 検索ドキュメントの作成 ★★★")
     project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     db_input_path = os.path.join(project_root, 'data', 'header_matrix.duckdb')
-    
+
     analysis_dir = os.path.join(project_root, 'analysis')
     os.makedirs(analysis_dir, exist_ok=True)
     docs_output_path = os.path.join(analysis_dir, 'search_documents.jsonl')
-    
-    create_search_documents(db_input_path, docs_output_path)
-    print(f"\n成果物が作成されました: {docs_output_path}")
\ No newline at end of file
+
+    create_search_documents(db_input_path, docs_output_path, args.granularity)
+    print(f"\n成果物が作成されました: {docs_output_path}")
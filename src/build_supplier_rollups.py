@@ -0,0 +1,267 @@
+import os
+import re
+import json
+import glob
+import argparse
+import unicodedata
+import typing
+import pandas as pd
+import duckdb
+from tqdm import tqdm
+from identify_key_metadata import extract_year_from_filename
+from sample_cache import file_fingerprint
+
+# 本体データ (_main) から府省を取得するための列名 (完全一致を優先し、無ければ部分一致)
+GOVERNING_AGENCY_COLUMNS = ["府省庁", "府省名", "府省"]
+
+# 法人格の表記揺れの統一 (NFKC正規化の後に適用)
+CORPORATE_FORM_PATTERNS = [
+    (re.compile(r'\(株\)'), '株式会社'),
+    (re.compile(r'\(有\)'), '有限会社'),
+    (re.compile(r'\(一社\)'), '一般社団法人'),
+    (re.compile(r'\(一財\)'), '一般財団法人'),
+    (re.compile(r'\(公社\)'), '公益社団法人'),
+    (re.compile(r'\(公財\)'), '公益財団法人'),
+    (re.compile(r'\(独\)'), '独立行政法人'),
+]
+
+EXPENDITURES_TABLE = "supplier_expenditures"
+SOURCES_TABLE = "supplier_source_files"
+ROLLUP_TABLE = "supplier_rollup"  # 法人(支出先)×年度×府省
+TOTALS_TABLE = "supplier_totals"  # 法人(支出先)ごとの全期間合計
+
+def normalize_supplier_name(name) -> typing.Optional[str]:
+    if not isinstance(name, str) or not name.strip():
+        return None
+    normalized = re.sub(r'\s+', '', unicodedata.normalize('NFKC', name))
+    for pattern, replacement in CORPORATE_FORM_PATTERNS:
+        normalized = pattern.sub(replacement, normalized)
+    return normalized
+
+def normalize_corporate_id(value) -> typing.Optional[str]:
+    """法人番号 (13桁) を数字だけの文字列に揃える。13桁でなければNone"""
+    if not isinstance(value, str):
+        return None
+    digits = re.sub(r'\D', '', unicodedata.normalize('NFKC', value))
+    return digits if len(digits) == 13 else None
+
+def parse_amount(value) -> typing.Optional[float]:
+    """支出額 (百万円) の文字列を数値に変換する。桁区切りや全角数字を許容し、変換できなければNone"""
+    if not isinstance(value, str):
+        return None
+    text = unicodedata.normalize('NFKC', value).replace(',', '').strip()
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+def read_table(path: str, columns: typing.Optional[list] = None) -> pd.DataFrame:
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path, columns=columns)
+    return pd.read_csv(path, usecols=columns, dtype=str, low_memory=False)
+
+def read_columns(path: str) -> list:
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        return pq.read_schema(path).names
+    return pd.read_csv(path, nrows=0, dtype=str).columns.tolist()
+
+def find_agency_column(columns: list) -> typing.Optional[str]:
+    for name in GOVERNING_AGENCY_COLUMNS:
+        if name in columns:
+            return name
+    return next((c for c in columns if any(name in c for name in GOVERNING_AGENCY_COLUMNS)), None)
+
+def load_expenditure_file(exp_path: str, id_map: dict) -> pd.DataFrame:
+    """
+    支出先ファイル1件を読み込み、型付け・正規化したレコードを返す。
+    府省は同じファイルの本体データ (_main) から、事業ID列で結合して付与する。
+    """
+    exp_filename = os.path.basename(exp_path)
+    base, ext = os.path.splitext(exp_filename)
+    source_name = base[:-len('_expenditures')] + '.csv'
+    main_path = os.path.join(os.path.dirname(exp_path), base[:-len('_expenditures')] + '_main' + ext)
+
+    df = read_table(exp_path)
+    df["project_id"] = df["project_id"].astype(str)
+
+    ministry = pd.Series([None] * len(df), dtype=object)
+    project_id_col = id_map.get(source_name)
+    if project_id_col and os.path.exists(main_path):
+        agency_col = find_agency_column(read_columns(main_path))
+        if agency_col and agency_col != project_id_col:
+            main_df = read_table(main_path, [project_id_col, agency_col]).dropna(subset=[project_id_col])
+            main_df = main_df.drop_duplicates(subset=[project_id_col]).astype(str)
+            agency_map = dict(zip(main_df[project_id_col], main_df[agency_col]))
+            ministry = df["project_id"].map(agency_map)
+
+    year = extract_year_from_filename(exp_filename)
+    return pd.DataFrame({
+        "source_file": exp_filename,
+        "year": str(year) if year else None,
+        "ministry": ministry.map(lambda v: unicodedata.normalize('NFKC', v).strip() if isinstance(v, str) else None),
+        "project_id": df["project_id"],
+        "expenditure_index": pd.to_numeric(df["expenditure_index"], errors='coerce').astype('Int64'),
+        "supplier_name": df.get("supplier_name"),
+        "supplier_name_normalized": df.get("supplier_name", pd.Series(dtype=object)).map(normalize_supplier_name),
+        "supplier_corporate_id": df.get("supplier_corporate_id", pd.Series(dtype=object)).map(normalize_corporate_id),
+        "amount_jpy_million": df.get("expenditure_amount_jpy_million", pd.Series(dtype=object)).map(parse_amount),
+        "contract_summary": df.get("contract_summary"),
+    })
+
+def ensure_tables(con):
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {EXPENDITURES_TABLE} (
+            source_file VARCHAR, year VARCHAR, ministry VARCHAR, project_id VARCHAR,
+            expenditure_index INTEGER, supplier_name VARCHAR, supplier_name_normalized VARCHAR,
+            supplier_corporate_id VARCHAR, amount_jpy_million DOUBLE, contract_summary VARCHAR
+        )
+    """)
+    con.execute(f"CREATE TABLE IF NOT EXISTS {SOURCES_TABLE} (source_file VARCHAR PRIMARY KEY, fingerprint VARCHAR, year VARCHAR)")
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {ROLLUP_TABLE} (
+            supplier_key VARCHAR, supplier_corporate_id VARCHAR, supplier_name VARCHAR,
+            year VARCHAR, ministry VARCHAR,
+            total_amount_jpy_million DOUBLE, record_count BIGINT, project_count BIGINT
+        )
+    """)
+    con.execute(f"CREATE INDEX IF NOT EXISTS idx_{ROLLUP_TABLE}_key ON {ROLLUP_TABLE} (supplier_key)")
+    con.execute(f"CREATE INDEX IF NOT EXISTS idx_{ROLLUP_TABLE}_corp ON {ROLLUP_TABLE} (supplier_corporate_id)")
+
+# 法人番号があればそれを、無ければ正規化した支出先名を集計キーにする
+SUPPLIER_KEY_SQL = "COALESCE(supplier_corporate_id, 'name:' || supplier_name_normalized)"
+
+def refresh_rollups(con, years: list):
+    """指定した年度のロールアップを作り直し、全期間合計を再集計する"""
+    placeholders = ', '.join('?' for _ in years)
+    con.execute(f"DELETE FROM {ROLLUP_TABLE} WHERE year IN ({placeholders})", years)
+    con.execute(f"""
+        INSERT INTO {ROLLUP_TABLE}
+        SELECT
+            {SUPPLIER_KEY_SQL} AS supplier_key,
+            any_value(supplier_corporate_id) AS supplier_corporate_id,
+            mode(supplier_name_normalized) AS supplier_name,
+            year, ministry,
+            SUM(amount_jpy_million) AS total_amount_jpy_million,
+            COUNT(*) AS record_count,
+            COUNT(DISTINCT project_id) AS project_count
+        FROM {EXPENDITURES_TABLE}
+        WHERE year IN ({placeholders}) AND {SUPPLIER_KEY_SQL} IS NOT NULL
+        GROUP BY ALL
+    """, years)
+    con.execute(f"""
+        CREATE OR REPLACE TABLE {TOTALS_TABLE} AS
+        SELECT
+            supplier_key,
+            any_value(supplier_corporate_id) AS supplier_corporate_id,
+            mode(supplier_name) AS supplier_name,
+            SUM(total_amount_jpy_million) AS total_amount_jpy_million,
+            SUM(record_count) AS record_count,
+            COUNT(DISTINCT year) AS year_count,
+            COUNT(DISTINCT ministry) AS ministry_count
+        FROM {ROLLUP_TABLE}
+        GROUP BY supplier_key
+    """)
+    con.execute(f"CREATE INDEX IF NOT EXISTS idx_{TOTALS_TABLE}_key ON {TOTALS_TABLE} (supplier_key)")
+
+def find_expenditure_files(separated_dir: str) -> list:
+    """
+    分離済みの支出先ファイルを返す。同じ元ファイルがCSVとParquetの両方で出力されている場合は、
+    二重に集計しないようParquetだけを使う。
+    """
+    files = {}
+    for ext in ('.csv', '.parquet'):  # 後に見つけた形式 (Parquet) で上書きする
+        for path in glob.glob(os.path.join(separated_dir, f'*_expenditures{ext}')):
+            files[os.path.splitext(os.path.basename(path))[0]] = path
+    return [files[stem] for stem in sorted(files)]
+
+def build_supplier_rollups(separated_dir: str, db_filepath: str, id_map: dict, rebuild: bool = False):
+    """
+    分離済みの支出先データをDuckDBにロードし、法人番号×年度×府省のロールアップを構築する。
+    内容が変わった (または新しい) ファイルだけを読み込み、無くなったファイルのレコードは削除して、
+    影響する年度のロールアップだけを更新する。ロードとロールアップの更新は1つのトランザクションで行い、
+    途中で失敗した場合はすべて取り消す (次回の実行で同じファイルが再び更新対象になる)。
+    """
+    print("--- 支出先ロールアップの構築を開始 ---")
+    exp_files = find_expenditure_files(separated_dir)
+    if not exp_files:
+        print("支出先ファイルが見つかりません。先に 'separate_expenditure_data.py' を実行してください。")
+        return
+
+    con, in_transaction = None, False
+    try:
+        con = duckdb.connect(database=db_filepath, read_only=False)
+        if rebuild:
+            for table in (EXPENDITURES_TABLE, SOURCES_TABLE, ROLLUP_TABLE, TOTALS_TABLE):
+                con.execute(f"DROP TABLE IF EXISTS {table}")
+        ensure_tables(con)
+
+        loaded = dict(con.execute(f"SELECT source_file, fingerprint FROM {SOURCES_TABLE}").fetchall())
+        current = {os.path.basename(path) for path in exp_files}
+        removed = sorted(set(loaded) - current)
+        affected_years = set()
+        con.execute("BEGIN TRANSACTION")
+        in_transaction = True
+
+        # 無くなったファイル (形式を変えて出力し直した場合を含む) のレコードを削除する
+        for exp_filename in removed:
+            previous_years = [r[0] for r in con.execute(f"SELECT DISTINCT year FROM {EXPENDITURES_TABLE} WHERE source_file = ?", [exp_filename]).fetchall()]
+            con.execute(f"DELETE FROM {EXPENDITURES_TABLE} WHERE source_file = ?", [exp_filename])
+            con.execute(f"DELETE FROM {SOURCES_TABLE} WHERE source_file = ?", [exp_filename])
+            affected_years.update(y for y in previous_years if y)
+        if removed:
+            print(f"-> 無くなったファイル {len(removed)} 件のレコードを削除しました。")
+
+        for exp_path in tqdm(exp_files, desc="Loading expenditures"):
+            exp_filename = os.path.basename(exp_path)
+            fingerprint = file_fingerprint(exp_path)
+            if loaded.get(exp_filename) == fingerprint:
+                continue
+
+            records = load_expenditure_file(exp_path, id_map)
+            previous_years = [r[0] for r in con.execute(f"SELECT DISTINCT year FROM {EXPENDITURES_TABLE} WHERE source_file = ?", [exp_filename]).fetchall()]
+            con.execute(f"DELETE FROM {EXPENDITURES_TABLE} WHERE source_file = ?", [exp_filename])
+            con.register("records_df", records)
+            con.execute(f"INSERT INTO {EXPENDITURES_TABLE} SELECT * FROM records_df")
+            con.unregister("records_df")
+            con.execute(f"INSERT OR REPLACE INTO {SOURCES_TABLE} VALUES (?, ?, ?)", [exp_filename, fingerprint, records["year"].iloc[0] if len(records) else None])
+            affected_years.update(y for y in previous_years + records["year"].dropna().unique().tolist() if y)
+
+        if not affected_years:
+            con.execute("COMMIT"); in_transaction = False
+            print("更新されたファイルはありません。")
+            return
+
+        print(f"ロールアップを更新しています (対象年度: {', '.join(sorted(affected_years))})...")
+        refresh_rollups(con, sorted(affected_years))
+        con.execute("COMMIT"); in_transaction = False
+        counts = con.execute(f"SELECT COUNT(*), SUM(total_amount_jpy_million) FROM {TOTALS_TABLE}").fetchone()
+        print(f"支出先数: {counts[0]:,} 件 / 支出額合計: {counts[1] or 0:,.0f} 百万円")
+
+    except Exception as e:
+        if in_transaction:
+            con.execute("ROLLBACK")
+        print(f"[エラー] 処理中に問題が発生しました: {e}")
+    finally:
+        if con:
+            con.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="支出先 (法人番号) ごとのロールアップをDuckDBに構築する")
+    parser.add_argument("--rebuild", action="store_true", help="既存のテーブルを破棄して全ファイルを再ロードする")
+    args = parser.parse_args()
+
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    separated_dir = os.path.join(project_root, 'data', 'separated')
+    db_path = os.path.join(project_root, 'data', 'header_matrix.duckdb')
+    id_map_path = os.path.join(project_root, 'analysis', 'project_id_map.json')
+
+    id_map = {}
+    if os.path.exists(id_map_path):
+        with open(id_map_path, 'r', encoding='utf-8') as f:
+            id_map = json.load(f)
+    else:
+        print(f"[警告] 事業IDの対応表 '{id_map_path}' が見つからないため、府省は付与されません。")
+
+    build_supplier_rollups(separated_dir, db_path, id_map, args.rebuild)
+    print("\n★★★ 支出先ロールアップの構築が完了しました ★★★")
@@ -0,0 +1,119 @@
+import math
+import base64
+import hashlib
+
+# HyperLogLogのレジスタ数 m = 2^p。相対標準誤差はおよそ 1.04 / sqrt(m)
+#   p=10 -> m=1,024  -> 約3.3%  (1KB)
+#   p=12 -> m=4,096  -> 約1.6%  (4KB)
+#   p=14 -> m=16,384 -> 約0.8%  (16KB)
+# 小さなカーディナリティ(2.5m以下)ではLinear Countingに切り替わるため、
+# ユニーク値が数千件程度の列ではほぼ正確な値が得られる。
+DEFAULT_PRECISION = 12
+MIN_PRECISION = 4
+MAX_PRECISION = 18
+
+def _hash64(value: str) -> int:
+    """文字列を64bitのハッシュ値に変換する（実行環境に依存しない安定したハッシュ）"""
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+
+def relative_standard_error(precision: int) -> float:
+    """指定された精度でのHyperLogLogの相対標準誤差を返す"""
+    return 1.04 / math.sqrt(1 << precision)
+
+class HyperLogLog:
+    """
+    ユニーク値の個数を固定メモリで近似するHyperLogLogスケッチ。
+    同じ精度のスケッチ同士は merge() で統合でき、ファイル・年度・府省などの
+    任意の単位でユニーク数を積み上げることができる。
+    """
+    def __init__(self, precision: int = DEFAULT_PRECISION):
+        if not MIN_PRECISION <= precision <= MAX_PRECISION:
+            raise ValueError(f"precisionは{MIN_PRECISION}〜{MAX_PRECISION}の範囲で指定してください: {precision}")
+        self.precision = precision
+        self.num_registers = 1 << precision
+        self.registers = bytearray(self.num_registers)
+
+    def add(self, value: str):
+        h = _hash64(value)
+        idx = h >> (64 - self.precision)
+        remaining_bits = 64 - self.precision
+        w = h & ((1 << remaining_bits) - 1)
+        rank = remaining_bits - w.bit_length() + 1
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+
+    def merge(self, other: "HyperLogLog"):
+        """別のスケッチを自身に統合する（和集合のユニーク数を表すようになる）"""
+        if other.precision != self.precision:
+            raise ValueError(f"精度の異なるスケッチは統合できません: {self.precision} != {other.precision}")
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+        return self
+
+    def count(self) -> int:
+        m = self.num_registers
+        if m >= 128:
+            alpha = 0.7213 / (1 + 1.079 / m)
+        else:
+            alpha = {16: 0.673, 32: 0.697, 64: 0.709}[m]
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+
+        # 小さなカーディナリティではLinear Countingの方が正確
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros > 0:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def __len__(self):
+        return self.count()
+
+    def to_dict(self) -> dict:
+        return {
+            "type": "hll",
+            "precision": self.precision,
+            "registers": base64.b64encode(bytes(self.registers)).decode('ascii'),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "HyperLogLog":
+        sketch = cls(data["precision"])
+        sketch.registers = bytearray(base64.b64decode(data["registers"]))
+        return sketch
+
+class ExactCounter:
+    """HyperLogLogと同じインターフェースを持つ、setによる厳密なユニーク数カウンタ"""
+    def __init__(self):
+        self.values = set()
+
+    def add(self, value: str):
+        self.values.add(value)
+
+    def merge(self, other: "ExactCounter"):
+        if not isinstance(other, ExactCounter):
+            raise ValueError("厳密カウンタとスケッチは統合できません。")
+        self.values |= other.values
+        return self
+
+    def count(self) -> int:
+        return len(self.values)
+
+    def __len__(self):
+        return self.count()
+
+    def to_dict(self) -> dict:
+        return {"type": "exact", "values": sorted(self.values)}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ExactCounter":
+        counter = cls()
+        counter.values = set(data["values"])
+        return counter
+
+def create_counter(exact: bool = False, precision: int = DEFAULT_PRECISION):
+    """モードに応じて厳密カウンタまたはHyperLogLogスケッチを生成する"""
+    return ExactCounter() if exact else HyperLogLog(precision)
+
+def counter_from_dict(data: dict):
+    """to_dict()で書き出したカウンタを復元する"""
+    if data.get("type") == "exact":
+        return ExactCounter.from_dict(data)
+    return HyperLogLog.from_dict(data)
@@ -0,0 +1,26 @@
+import re
+import unicodedata
+
+# 漢字・ひらがな・カタカナ (長音記号・々を含む) の連続
+CJK_RUN = r'[々぀-ヿ㐀-䶿一-鿿豈-﫿]+'
+# 英数字の連続 (単語として1トークンにする)
+ALNUM_RUN = r'[0-9a-z]+'
+TOKEN_PATTERN = re.compile(f'{CJK_RUN}|{ALNUM_RUN}')
+
+ANALYZERS = ("sudachi", "bigram")
+
+def bigram_tokens(text: str) -> list:
+    """
+    形態素解析を使わずに、文字バイグラムのトークン列を作る (LuceneのCJKBigramFilterと同じ考え方)。
+    NFKC正規化・小文字化した上で、漢字・かなの連続は重なりのある2文字ずつ (1文字だけの連続はそのまま)、
+    英数字の連続は1語として扱う。記号や空白はトークンの区切りになる。
+    インデックス側 (preprocess_docs.py) と検索側 (retriever.py) で同じ関数を使うこと。
+    """
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(unicodedata.normalize('NFKC', text).lower()):
+        run = match.group()
+        if run[0].isascii() or len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
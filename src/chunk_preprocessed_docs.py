@@ -5,6 +5,49 @@ from tqdm import tqdm
 # Anserini/Jacksonのデフォルト上限(20MB)より安全な値を設定
 MAX_CONTENTS_BYTES = 10 * 1024 * 1024  # 10MB
 
+def chunk_document(doc):
+    """
+    分かち書き済みのドキュメントを、MAX_CONTENTS_BYTES以下のチャンクのリストにする。
+    上限以下ならそのまま1件で返す。チャンクの切れ目は単語 (スペース) の境界に合わせる。
+    contents以外のフィールド (labelsなど) は、同じ語が重複して数えられないよう最初のチャンクにだけ付ける。
+    """
+    doc_id = doc["id"]
+    contents = doc["contents"] # これは既にスペース区切りの単語列
+
+    contents_bytes = contents.encode('utf-8')
+
+    # コンテンツが上限を超えていなければ、そのまま返す
+    if len(contents_bytes) <= MAX_CONTENTS_BYTES:
+        return [doc]
+
+    # 上限を超えている場合は、チャンクに分割
+    tqdm.write(f"\n[情報] 巨大ドキュメントを分割中: ID={doc_id}, Size={len(contents_bytes):,} bytes")
+    chunks = []
+    extra_fields = {key: value for key, value in doc.items() if key not in ("id", "contents")}
+    chunk_num = 0
+    start = 0
+    while start < len(contents_bytes):
+        end = start + MAX_CONTENTS_BYTES
+        chunk_str = contents_bytes[start:end].decode('utf-8', errors='ignore')
+
+        # チャンクの切れ目が単語の途中にならないように、最後のスペースで区切る
+        # (もしチャンクの末尾にスペースがあれば、そのままでOK)
+        if end < len(contents_bytes) and ' ' in chunk_str:
+            last_space_index = chunk_str.rfind(' ')
+            if last_space_index != -1:
+                chunk_str = chunk_str[:last_space_index]
+
+        chunks.append({
+            "id": f"{doc_id}_chunk_{chunk_num}",
+            "contents": chunk_str.strip(),
+            **(extra_fields if chunk_num == 0 else {})
+        })
+
+        # 次のチャンクの開始位置を、実際に処理したバイト数で更新
+        start += len(chunk_str.encode('utf-8'))
+        chunk_num += 1
+    return chunks
+
 def chunk_preprocessed_documents(input_filepath, output_filepath):
     print("--- 前処理済み巨大ドキュメントの分割処理を開始 ---")
     
@@ -12,47 +55,15 @@ def chunk_preprocessed_documents(input_filepath, output_filepath):
         print(f"[エラー] 入力ファイルが見つかりません: {input_filepath}")
         return
 
-    total_lines = sum(1 for _ in open(input_filepath, 'r', encoding='utf-8'))
-    
-    with open(input_filepath, 'r', encoding='utf-8') as f_in, \
-         open(output_filepath, 'w', encoding='utf-8') as f_out:
+    # 行数を数えるためだけにファイルを読まないよう、進捗はバイト数で表示する
+    with open(input_filepath, 'rb') as f_in, \
+         open(output_filepath, 'w', encoding='utf-8') as f_out, \
+         tqdm(total=os.path.getsize(input_filepath), unit='B', unit_scale=True, desc="Chunking Preprocessed Docs") as pbar:
         
-        for line in tqdm(f_in, total=total_lines, desc="Chunking Preprocessed Docs"):
-            doc = json.loads(line)
-            doc_id = doc["id"]
-            contents = doc["contents"] # これは既にスペース区切りの単語列
-            
-            contents_bytes = contents.encode('utf-8')
-            
-            # コンテンツが上限を超えていなければ、そのまま書き出す
-            if len(contents_bytes) <= MAX_CONTENTS_BYTES:
-                f_out.write(json.dumps(doc, ensure_ascii=False) + '\n')
-                continue
-            
-            # 上限を超えている場合は、チャンクに分割
-            tqdm.write(f"\n[情報] 巨大ドキュメントを分割中: ID={doc_id}, Size={len(contents_bytes):,} bytes")
-            chunk_num = 0
-            start = 0
-            while start < len(contents_bytes):
-                end = start + MAX_CONTENTS_BYTES
-                chunk_str = contents_bytes[start:end].decode('utf-8', errors='ignore')
-                
-                # チャンクの切れ目が単語の途中にならないように、最後のスペースで区切る
-                # (もしチャンクの末尾にスペースがあれば、そのままでOK)
-                if end < len(contents_bytes) and ' ' in chunk_str:
-                    last_space_index = chunk_str.rfind(' ')
-                    if last_space_index != -1:
-                        chunk_str = chunk_str[:last_space_index]
-                
-                chunk_doc = {
-                    "id": f"{doc_id}_chunk_{chunk_num}",
-                    "contents": chunk_str.strip()
-                }
+        for line in f_in:
+            for chunk_doc in chunk_document(json.loads(line)):
                 f_out.write(json.dumps(chunk_doc, ensure_ascii=False) + '\n')
-                
-                # 次のチャンクの開始位置を、実際に処理したバイト数で更新
-                start += len(chunk_str.encode('utf-8'))
-                chunk_num += 1
+            pbar.update(len(line))
 
     print("\n★★★ ドキュメントの分割が完了しました ★★★")
 
@@ -0,0 +1,55 @@
+import os
+import json
+import hashlib
+
+# セクション単位・チャンク単位・パッセージ単位のIDで、親 (事業) のIDの後ろに付く目印
+# (build_search_docs.py / chunk_preprocessed_docs.py / build_faiss_index.py)
+PARENT_ID_MARKERS = ("_sec_", "_chunk_", "_psg_")
+
+def parent_doc_id(doc_id: str) -> str:
+    """セクションやチャンクのドキュメントIDから、親 (事業) のドキュメントIDを取り出す"""
+    for marker in PARENT_ID_MARKERS:
+        if marker in doc_id:
+            doc_id = doc_id.split(marker)[0]
+    return doc_id
+
+def content_hash(text: str) -> str:
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def manifest_path(output_filepath: str) -> str:
+    """成果物 (JSONL・インデックス) の隣に置く、処理済みドキュメントのハッシュ一覧のパス"""
+    return os.path.splitext(output_filepath)[0] + '.hashes.json'
+
+def load_manifest(path: str) -> dict:
+    """{ドキュメントID: 元の本文のハッシュ} を返す。無ければ空の辞書"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def write_manifest(path: str, hashes: dict):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(hashes, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def compute_delta(current: dict, previous: dict) -> dict:
+    """前回処理したハッシュ一覧と比較し、追加・変更・削除されたドキュメントIDを返す"""
+    return {
+        "added": [doc_id for doc_id in current if doc_id not in previous],
+        "changed": [doc_id for doc_id, h in current.items() if doc_id in previous and previous[doc_id] != h],
+        "removed": [doc_id for doc_id in previous if doc_id not in current],
+    }
+
+def format_delta(delta: dict) -> str:
+    return f"追加 {len(delta['added']):,}件 / 変更 {len(delta['changed']):,}件 / 削除 {len(delta['removed']):,}件"
+
+def index_jsonl_offsets(filepath: str) -> dict:
+    """JSONLファイルの {ドキュメントID: 行の先頭バイト位置} を返す (前回の成果物から行を再利用するため)"""
+    offsets = {}
+    with open(filepath, 'rb') as f:
+        offset = 0
+        for line in f:
+            offsets[json.loads(line)["id"]] = offset
+            offset += len(line)
+    return offsets
@@ -2,6 +2,7 @@ import os
 import glob
 import pandas as pd
 from tqdm import tqdm
+from sample_cache import load_sample, SAMPLE_ROWS
 
 # --- 診断対象のキーワード ---
 ID_KEYWORDS = ["事業番号", "整理番号", "番号", "ID", "コード"]
@@ -10,8 +11,7 @@ ID_KEYWORDS = ["事業番号", "整理番号", "番号", "ID", "コード"]
 # ここに人間の判断で「違う」と確定したキーワードを追加する
 HARD_EXCLUSION_KEYWORDS = ["法人番号"]
 
-# --- サンプル設定 ---
-SAMPLE_ROWS = 500
+# --- サンプル設定 (行数は sample_cache.SAMPLE_ROWS を共有) ---
 SAMPLE_VALUES_COUNT = 5
 
 def diagnose_id_candidates_in_file(csv_path: str) -> list:
@@ -19,7 +19,9 @@ def diagnose_id_candidates_in_file(csv_path: str) -> list:
     単一ファイル内のID候補を、除外ルールを適用して診断する。
     """
     try:
-        header = pd.read_csv(csv_path, nrows=0, dtype=str).columns.tolist()
+        # 共有サンプルキャッシュから先頭SAMPLE_ROWS行を取得 (CSVの解析は初回のみ)
+        df_sample = load_sample(csv_path, SAMPLE_ROWS)
+        header = df_sample.columns.tolist()
         
         # --- ここが改良点 ---
         # 1. まずキーワードにマッチする候補をリストアップ
@@ -34,9 +36,6 @@ def diagnose_id_candidates_in_file(csv_path: str) -> list:
         if not candidate_names:
             return []
 
-        # 候補列のデータだけをサンプルとして読み込む
-        df_sample = pd.read_csv(csv_path, usecols=candidate_names, nrows=SAMPLE_ROWS, dtype=str)
-        
         report_list = []
         for col_name in candidate_names:
             series = df_sample[col_name].dropna()
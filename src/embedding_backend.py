@@ -0,0 +1,96 @@
+import typing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from parallel_runner import default_workers
+
+# CPUでのエンコードの方式
+#   torch: SentenceTransformerそのまま (float32)
+#   int8:  PyTorchの動的量子化 (Linear層の重みをint8にする。モデルの変換は読み込み時に行う)
+#   onnx:  ONNXにエクスポートしたモデルをONNX Runtimeで実行する (sentence-transformers 3.2以降と optimum[onnxruntime] が必要)
+BACKENDS = ("torch", "int8", "onnx")
+# ワーカーに1回で渡すテキスト数 (ワーカー間でおおよそ均等に仕事を分けるため、バッチサイズの数倍にする)
+POOL_CHUNK_TEXTS = 128
+
+def encoder_name(model_name: str, backend: str) -> str:
+    """キャッシュやチェックポイントで使う、モデルと方式を区別する名前 (方式が違えばベクトルも少し違うため)"""
+    return model_name if backend == "torch" else f"{model_name}@{backend}"
+
+def load_model(model_name: str, backend: str = "torch", num_threads: typing.Optional[int] = None):
+    """指定した方式でSentenceTransformerを読み込む。num_threadsを指定した場合は、推論に使うスレッド数を制限する"""
+    from sentence_transformers import SentenceTransformer
+    if backend == "onnx":
+        model_kwargs = {}
+        if num_threads:
+            import onnxruntime
+            session_options = onnxruntime.SessionOptions()
+            session_options.intra_op_num_threads = num_threads
+            model_kwargs["session_options"] = session_options
+        return SentenceTransformer(model_name, device="cpu", backend="onnx", model_kwargs=model_kwargs)
+
+    import torch
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    model = SentenceTransformer(model_name, device="cpu")
+    if backend == "int8":
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+# --- プロセスプール用 (各ワーカーで1回だけモデルを読み込む) ---
+_worker_model = None
+
+def init_worker_model(model_name: str, backend: str, num_threads: int):
+    global _worker_model
+    _worker_model = load_model(model_name, backend, num_threads)
+
+def encode_in_worker(args):
+    texts, batch_size = args
+    return _worker_model.encode(texts, batch_size=batch_size, show_progress_bar=False)
+
+def embedding_dimension_in_worker(_):
+    return _worker_model.get_sentence_embedding_dimension()
+
+class Encoder:
+    """
+    SentenceTransformer.encode と同じ呼び出し方でエンコードする。
+    workers > 1 の場合は、各ワーカーがモデルを1つずつ読み込んだプロセスプールにテキストを分けて渡し、結果を入力と同じ順序で返す。
+    CPUのスレッドを取り合わないよう、ワーカーあたりのスレッド数は (CPUコア数 / ワーカー数) にする。
+    """
+
+    def __init__(self, model_name: str, backend: str = "torch", workers: typing.Optional[int] = 1):
+        self.model_name, self.backend = model_name, backend
+        self.workers = workers or default_workers()
+        self._model, self._executor = None, None
+        if self.workers <= 1:
+            self._model = load_model(model_name, backend)
+        else:
+            num_threads = max(1, default_workers() // self.workers)
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker_model,
+                                                 initargs=(model_name, backend, num_threads))
+
+    @property
+    def name(self) -> str:
+        return encoder_name(self.model_name, self.backend)
+
+    def get_sentence_embedding_dimension(self) -> int:
+        if self._model is not None:
+            return self._model.get_sentence_embedding_dimension()
+        return self._executor.submit(embedding_dimension_in_worker, None).result()
+
+    def encode(self, texts: list, batch_size: int = 32, show_progress_bar: bool = False) -> np.ndarray:
+        if self._model is not None:
+            return self._model.encode(texts, batch_size=batch_size, show_progress_bar=show_progress_bar)
+        chunks = [(texts[i:i + POOL_CHUNK_TEXTS], batch_size) for i in range(0, len(texts), POOL_CHUNK_TEXTS)]
+        if not chunks:
+            return np.zeros((0, self.get_sentence_embedding_dimension()), dtype='float32')
+        return np.concatenate(list(self._executor.map(encode_in_worker, chunks)))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
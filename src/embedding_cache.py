@@ -0,0 +1,84 @@
+import os
+import json
+import numpy as np
+from corpus_manifest import content_hash
+
+# キーのハッシュ (sha1の16進表記) の文字数
+KEY_CHARS = 40
+
+def default_cache_dir(output_dir: str) -> str:
+    return os.path.join(output_dir, "embedding_cache")
+
+class EmbeddingCache:
+    """
+    (モデル名, 本文のハッシュ) をキーにした、エンコード結果の永続キャッシュ。
+    モデルごとのディレクトリに、ベクトルを追記するだけのバイナリファイル (vectors.bin, float32) と、
+    行番号に対応するキーの一覧 (keys.txt) を置く。書き込みは「ベクトル → キー」の順に追記するため、
+    途中で中断されても、両方がそろっている行までは次回から使える。
+    """
+
+    def __init__(self, cache_dir: str, model_name: str, dim: int):
+        self.dir = os.path.join(cache_dir, model_name.replace('/', '__'))
+        self.dim = dim
+        self.row_bytes = dim * np.dtype('float32').itemsize
+        self.vectors_path = os.path.join(self.dir, "vectors.bin")
+        self.keys_path = os.path.join(self.dir, "keys.txt")
+        os.makedirs(self.dir, exist_ok=True)
+
+        meta_path = os.path.join(self.dir, "meta.json")
+        meta = {"model": model_name, "dim": dim, "dtype": "float32"}
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                if json.load(f) != meta:
+                    raise ValueError(f"埋め込みキャッシュの設定が一致しません: {meta_path}")
+        else:
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+
+        self.rows = {}
+        if os.path.exists(self.keys_path):
+            with open(self.keys_path, 'r', encoding='utf-8') as f:
+                keys = [line.rstrip('\n') for line in f]
+            num_vectors = os.path.getsize(self.vectors_path) // self.row_bytes if os.path.exists(self.vectors_path) else 0
+            keys = [key for key in keys[:num_vectors] if len(key) == KEY_CHARS]
+            self.rows = {key: row for row, key in enumerate(keys)}
+        self._truncate(len(self.rows))
+        self._vectors = None
+
+    def _truncate(self, num_rows: int):
+        """書きかけの末尾 (キーの無いベクトル・ベクトルの無いキー) を取り除く"""
+        with open(self.vectors_path, 'ab') as f:
+            f.truncate(num_rows * self.row_bytes)
+        keys = sorted(self.rows, key=self.rows.get)
+        with open(self.keys_path, 'w', encoding='utf-8') as f:
+            f.writelines(f"{key}\n" for key in keys)
+
+    def __len__(self):
+        return len(self.rows)
+
+    @staticmethod
+    def key(text: str) -> str:
+        return content_hash(text)
+
+    def get_many(self, keys: list) -> dict:
+        """キャッシュにあるキーだけについて {キー: ベクトル} を返す"""
+        found = [key for key in keys if key in self.rows]
+        if not found:
+            return {}
+        if self._vectors is None or len(self._vectors) < len(self.rows):
+            self._vectors = np.memmap(self.vectors_path, dtype='float32', mode='r', shape=(len(self.rows), self.dim))
+        return {key: np.array(self._vectors[self.rows[key]]) for key in found}
+
+    def put_many(self, keys: list, vectors: np.ndarray):
+        new = {}
+        for key, vector in zip(keys, vectors):
+            if key not in self.rows:
+                new.setdefault(key, vector)
+        if not new:
+            return
+        with open(self.vectors_path, 'ab') as f:
+            f.write(np.ascontiguousarray(list(new.values()), dtype='float32').tobytes())
+        with open(self.keys_path, 'a', encoding='utf-8') as f:
+            f.writelines(f"{key}\n" for key in new)
+        for key in new:
+            self.rows[key] = len(self.rows)
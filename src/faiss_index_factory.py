@@ -0,0 +1,121 @@
+import math
+import faiss
+import numpy as np
+
+# 構築できるFaissインデックスの種類
+#   flat:     総当たり (厳密な最近傍。ベクトル数に比例して検索が遅くなる)
+#   ivf_flat: ベクトルをnlist個のクラスタに分け、クエリに近いnprobe個のクラスタだけを探す
+#   ivf_pq:   ivf_flatに加えて、ベクトルを直積量子化 (PQ) で圧縮する (メモリが大幅に減るが、再現率も下がる)
+#   hnsw:     グラフ探索 (学習不要。メモリはflatより多いが高速。ベクトルの削除には対応しない)
+#   sq8:      総当たりのまま、各次元を8bitにスカラー量子化する (メモリはflatの1/4。値の範囲を学習する)
+#   sq_fp16:  総当たりのまま、各次元をfloat16で持つ (メモリはflatの1/2。学習不要)
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw", "sq8", "sq_fp16")
+# 学習 (クラスタリング・量子化) が必要な種類
+TRAINED_INDEX_TYPES = ("ivf_flat", "ivf_pq", "sq8")
+# 検索時にnprobeを指定する種類
+IVF_INDEX_TYPES = ("ivf_flat", "ivf_pq")
+
+DEFAULT_PQ_M = 64        # PQのサブベクトル数 (次元数の約数であること)
+DEFAULT_HNSW_M = 32      # HNSWの各ノードの接続数
+DEFAULT_NPROBE = 16      # IVFの検索時に探すクラスタ数
+DEFAULT_EF_SEARCH = 64   # HNSWの検索時の候補数
+DEFAULT_TRAIN_SAMPLE = 100000
+
+# faiss.downcast_index したクラス名 → INDEX_TYPES
+_INDEX_CLASS_TYPES = {"IndexFlatL2": "flat", "IndexFlat": "flat", "IndexIVFFlat": "ivf_flat", "IndexIVFPQ": "ivf_pq",
+                      "IndexHNSWFlat": "hnsw"}
+# ファイル先頭のfourccのうち、IVF (転置リストをIO_FLAG_MMAPでメモリマップできる) のもの
+_IVF_FOURCCS = (b"IwFl", b"IwPQ")
+# IndexScalarQuantizer の量子化の種類 → INDEX_TYPES
+_SQ_QTYPES = {faiss.ScalarQuantizer.QT_8bit: "sq8", faiss.ScalarQuantizer.QT_fp16: "sq_fp16"}
+
+def default_nlist(num_vectors: int) -> int:
+    """クラスタ数の目安 (4√N)。Faissは学習にクラスタ数の39倍以上のベクトルを推奨するため、それを超えないようにする"""
+    return max(1, min(int(4 * math.sqrt(num_vectors)), num_vectors // 39))
+
+def factory_string(index_type: str, nlist: int = None, pq_m: int = DEFAULT_PQ_M, hnsw_m: int = DEFAULT_HNSW_M) -> str:
+    return {
+        "flat": "Flat",
+        "ivf_flat": f"IVF{nlist},Flat",
+        "ivf_pq": f"IVF{nlist},PQ{pq_m}",
+        "hnsw": f"HNSW{hnsw_m}",
+        "sq8": "SQ8",
+        "sq_fp16": "SQfp16",
+    }[index_type]
+
+def sample_training_vectors(vectors, train_sample: int, seed: int = 0) -> np.ndarray:
+    """学習用に最大train_sample件のベクトルを無作為に選び、float32の配列で返す (メモリマップの配列も可)"""
+    if len(vectors) <= train_sample:
+        return np.ascontiguousarray(vectors, dtype='float32')
+    rows = np.sort(np.random.default_rng(seed).choice(len(vectors), train_sample, replace=False))
+    return np.ascontiguousarray(vectors[rows], dtype='float32')
+
+def create_index(index_type: str, dim: int, training_vectors: np.ndarray = None, nlist: int = None,
+                 pq_m: int = DEFAULT_PQ_M, hnsw_m: int = DEFAULT_HNSW_M) -> faiss.Index:
+    """
+    空のインデックスを作り、ドキュメントIDを付けて追加 (add_with_ids) できる形で返す。
+    IVF系は自身がIDを保持するためそのまま返し、それ以外はIndexIDMapで包む
+    (IndexIDMapのremove_idsは内部の連番が詰められることを前提にするため、連番を詰めないIVFを包むとIDがずれる)。
+    IVF系・sq8はtraining_vectorsで学習する (IVFのnlistを省略した場合は学習ベクトル数から決める)。
+    """
+    if index_type in IVF_INDEX_TYPES:
+        nlist = nlist or default_nlist(len(training_vectors))
+    index = faiss.index_factory(dim, factory_string(index_type, nlist, pq_m, hnsw_m))
+    if index_type in TRAINED_INDEX_TYPES:
+        detail = f" (nlist={nlist})" if index_type in IVF_INDEX_TYPES else ""
+        print(f"-> {index_type}{detail} を {len(training_vectors):,}件のベクトルで学習中...")
+        index.train(training_vectors)
+    if index_type in IVF_INDEX_TYPES:
+        return index
+    return faiss.IndexIDMap(index)
+
+def index_type_of(index: faiss.Index) -> str:
+    """インデックス (IndexIDMapで包まれたものも可) の種類 (INDEX_TYPES) を返す。不明な場合はクラス名を返す"""
+    inner = faiss.downcast_index(index.index if hasattr(index, "id_map") else index)
+    name = type(inner).__name__
+    if name == "IndexScalarQuantizer":
+        return _SQ_QTYPES.get(inner.sq.qtype, name)
+    return _INDEX_CLASS_TYPES.get(name, name)
+
+def has_broken_id_map(index: faiss.Index) -> bool:
+    """以前のバージョンで作った、IndexIDMapで包まれたIVFか (削除・追加を繰り返すとIDがずれるため、構築し直す必要がある)"""
+    return hasattr(index, "id_map") and index_type_of(index) in IVF_INDEX_TYPES
+
+def supports_remove(index_type: str) -> bool:
+    """remove_idsでベクトルを削除できるか (HNSWはグラフから削除できない)"""
+    return index_type != "hnsw"
+
+def renumber_ids(index: faiss.Index, remap: np.ndarray) -> bool:
+    """
+    IndexIDMapのID (IDマッピングの位置) を remap[旧ID] に付け替える (欠番を詰めるため)。
+    IDを自身の転置リストに持つIVF系は付け替えられないため、何もせずにFalseを返す。
+    """
+    if not hasattr(index, "id_map"):
+        return False
+    ids = faiss.vector_to_array(index.id_map)
+    faiss.copy_array_to_vector(remap[ids].astype('int64'), index.id_map)
+    return True
+
+def read_index_mmap(path: str) -> faiss.Index:
+    """
+    インデックスのベクトルをメモリに読み込まず、ファイルをメモリマップして開く (検索専用)。
+    IVF系は転置リストをIO_FLAG_MMAPで、flat・sq8・sq_fp16・hnsw (IndexIDMapで包んだもの) は
+    ベクトルの配列をIO_FLAG_MMAP_IFCでマップする (IO_FLAG_MMAPではこれらはメモリに読み込まれてしまう)。
+    """
+    with open(path, 'rb') as f:
+        fourcc = f.read(4)
+    if fourcc in _IVF_FOURCCS:
+        return faiss.read_index(path, faiss.IO_FLAG_MMAP)
+    if not hasattr(faiss, "IO_FLAG_MMAP_IFC"):
+        raise RuntimeError("このバージョンのfaissはIO_FLAG_MMAP_IFCに対応していないため、"
+                           "flat・sq8・sq_fp16・hnswのインデックスをメモリマップできません。faissを更新するか、mmap_indexを無効にしてください。")
+    return faiss.read_index(path, faiss.IO_FLAG_MMAP_IFC)
+
+def apply_search_params(index: faiss.Index, nprobe: int = None, ef_search: int = None):
+    """検索時のパラメータを設定する。インデックスの種類に関係ないパラメータは無視する"""
+    index_type = index_type_of(index)
+    params = faiss.ParameterSpace()
+    if nprobe and index_type in IVF_INDEX_TYPES:
+        params.set_index_parameter(index, "nprobe", nprobe)
+    if ef_search and index_type == "hnsw":
+        params.set_index_parameter(index, "efSearch", ef_search)
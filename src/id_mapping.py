@@ -0,0 +1,63 @@
+import os
+import json
+import numpy as np
+
+# Faissの連番ID → ドキュメント (パッセージ) IDの対応を、メモリマップで読めるバイナリ形式で保存する。
+# レイアウト: マジック (8バイト) | 件数 N (uint64) | 位置のバイト数 W (uint64) | 各IDの先頭位置 (W バイト × (N+1)) | UTF-8のIDを連結したもの
+# 位置は、IDの合計が4GB未満ならuint32、それ以上ならuint64で持つ。
+# 欠番 (削除されたベクトル) は長さ0のIDとして記録し、読み込み時はNoneを返す。
+MAGIC = b"IDMAP\x00\x01\x00"
+HEADER_BYTES = len(MAGIC) + 16
+
+def binary_path(json_path: str) -> str:
+    """faiss_id_mapping.json の隣に置くバイナリ形式のパス"""
+    return os.path.splitext(json_path)[0] + '.bin'
+
+def write_id_mapping(path: str, doc_ids: list):
+    encoded = [(doc_id or "").encode('utf-8') for doc_id in doc_ids]
+    offsets = np.zeros(len(encoded) + 1, dtype='<u8')
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    if offsets[-1] < 2**32:
+        offsets = offsets.astype('<u4')
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(np.array([len(encoded), offsets.itemsize], dtype='<u8').tobytes())
+        f.write(offsets.tobytes())
+        f.writelines(encoded)
+    os.replace(tmp_path, path)
+
+class IdMapping:
+    """
+    write_id_mappingで保存したファイルをメモリマップで開き、リストと同じく mapping[i] でIDを返す。
+    全IDをPythonの文字列として読み込まないため、件数が多くても読み込みが速く、常駐メモリも少ない。
+    """
+
+    def __init__(self, path: str):
+        data = np.memmap(path, dtype='u1', mode='r')
+        if bytes(data[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f"IDマッピングの形式が正しくありません: {path}")
+        count, width = (int(v) for v in np.frombuffer(data[len(MAGIC):HEADER_BYTES], dtype='<u8'))
+        self._offsets = np.frombuffer(data, dtype=f'<u{width}', count=count + 1, offset=HEADER_BYTES)
+        self._blob_start = HEADER_BYTES + (count + 1) * width
+        self._data = data
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        start, end = int(self._offsets[i]), int(self._offsets[i + 1])
+        if start == end:
+            return None
+        return bytes(self._data[self._blob_start + start:self._blob_start + end]).decode('utf-8')
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+def load_id_mapping(json_path: str):
+    """バイナリ形式があればメモリマップで開き、無ければ従来のJSONのリストを読み込む"""
+    path = binary_path(json_path)
+    if os.path.exists(path):
+        return IdMapping(path)
+    with open(json_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
@@ -3,9 +3,13 @@ import glob
 import csv
 import json
 import re
-from tqdm import tqdm
+import functools
 from collections import defaultdict
 import typing
+import argparse
+from parallel_runner import run_parallel
+from cardinality_sketch import create_counter, counter_from_dict, relative_standard_error, DEFAULT_PRECISION
+from sample_cache import load_sample, SAMPLE_ROWS
 
 # --- 磨き込み後のターゲット定義 ---
 METADATA_TARGETS = {
@@ -49,97 +53,188 @@ def calculate_score(column_name: str, target_key: str, all_targets: dict) -> flo
     
     return base_score - penalty
 
-def identify_key_metadata_candidates(csv_path: str) -> typing.Optional[dict]:
-    """主要なメタデータ列の候補を、排他性スコアリングを用いて特定する。"""
+def iter_rows(csv_path: str, sample_rows: typing.Optional[int] = None):
+    """
+    ヘッダーを先頭に、CSVの行を順に返す。
+    sample_rowsを指定した場合はCSVを読まず、sample_cacheに保存された先頭sample_rows行を使う
+    (他のID判定スクリプトと同じサンプル。列名はpandasの形式で、重複列には '.1' などの接尾辞が付く)。
+    """
+    if sample_rows:
+        df_sample = load_sample(csv_path, sample_rows)
+        yield list(df_sample.columns)
+        yield from df_sample.fillna('').itertuples(index=False, name=None)
+        return
+    with open(csv_path, 'r', encoding='utf-8-sig') as f:
+        yield from csv.reader(f)
+
+def identify_key_metadata_candidates(csv_path: str, exact: bool = False, precision: int = DEFAULT_PRECISION,
+                                     keep_sketches: bool = False, sample_rows: typing.Optional[int] = None) -> typing.Optional[dict]:
+    """
+    主要なメタデータ列の候補を、排他性スコアリングを用いて特定する。
+    ユニーク率は既定でHyperLogLogスケッチにより近似する (exact=Trueでsetによる厳密計算)。
+    keep_sketches=Trueの場合、選ばれた列のスケッチを結果に含め、ファイル横断で統合できるようにする。
+    sample_rowsを指定した場合は、全行ではなくsample_cacheの先頭sample_rows行だけから判定する (探索用の高速モード)。
+    """
     try:
         filename = os.path.basename(csv_path)
         file_year = extract_year_from_filename(filename)
 
-        with open(csv_path, 'r', encoding='utf-8-sig') as f:
-            reader = csv.reader(f)
-            header = next(reader, None)
-            if not header: return None
-
-            # --- Pass 1: ヘッダーから全ての列のスコアを計算 ---
-            candidates = defaultdict(list)
-            for i, col_name in enumerate(header):
-                for target_key in METADATA_TARGETS.keys():
-                    score = calculate_score(col_name, target_key, METADATA_TARGETS)
-                    if score > 0: # スコアが0より大きいものだけを候補とする
-                        candidates[target_key].append({"index": i, "name": col_name, "score": score})
-            
-            if not any(candidates.values()):
-                return {"filename": filename, "identified_metadata": {"status": "No candidates found."}}
-
-            # --- Pass 2: データ特性を収集 (候補列のみ) ---
-            candidate_indices = {cand["index"] for c_list in candidates.values() for cand in c_list}
-            stats = {idx: {"unique_values": set(), "non_empty_count": 0, "year_match_count": 0} for idx in candidate_indices}
-            total_rows = 0
-            f.seek(0); next(reader) # Reset pointer and skip header
-
-            for row in reader:
-                total_rows += 1
-                for idx in candidate_indices:
-                    value = row[idx] if idx < len(row) else ""
-                    if value and not value.isspace():
-                        stats[idx]["non_empty_count"] += 1
-                        stats[idx]["unique_values"].add(value)
-                        if file_year and value == str(file_year):
-                            stats[idx]["year_match_count"] += 1
-            
-            # --- Pass 3: 最適な候補を選択 ---
-            final_mapping = {}
-            for target_key, cands_list in candidates.items():
-                best_candidate = None
-                max_final_score = -1
-
-                for cand in cands_list:
-                    idx = cand["index"]
-                    stat = stats[idx]
-                    non_empty_count = stat["non_empty_count"]
-                    if non_empty_count == 0: continue
-
-                    # データ特性を加味した最終スコアを計算
-                    final_score = cand["score"] # 排他性スコアをベースにする
-                    if target_key in ["project_id", "project_name"]:
-                        uniqueness = len(stat["unique_values"]) / non_empty_count
-                        final_score += uniqueness # ユニーク率をスコアに加算
-                    elif target_key == "year":
-                        match_rate = stat["year_match_count"] / non_empty_count if non_empty_count > 0 else 0
-                        final_score += match_rate # 年の一致率をスコアに加算
-
-                    if final_score > max_final_score:
-                        max_final_score = final_score
-                        best_candidate = {
-                            "column_name": cand["name"],
-                            "column_index": idx,
-                            "exclusivity_score": cand["score"], # 排他性スコアも記録
-                            "uniqueness_rate": round(len(stat["unique_values"]) / non_empty_count, 3),
-                            "non_empty_rate": round(non_empty_count / total_rows, 3) if total_rows > 0 else 0
-                        }
-
-                if best_candidate:
-                    final_mapping[target_key] = best_candidate
-
-            return {"filename": filename, "identified_metadata": final_mapping}
+        rows = iter_rows(csv_path, sample_rows)
+        header = next(rows, None)
+        if not header: return None
+
+        # --- Pass 1: ヘッダーから全ての列のスコアを計算 ---
+        candidates = defaultdict(list)
+        for i, col_name in enumerate(header):
+            for target_key in METADATA_TARGETS.keys():
+                score = calculate_score(col_name, target_key, METADATA_TARGETS)
+                if score > 0: # スコアが0より大きいものだけを候補とする
+                    candidates[target_key].append({"index": i, "name": col_name, "score": score})
+        
+        if not any(candidates.values()):
+            return {"filename": filename, "identified_metadata": {"status": "No candidates found."}}
+
+        # --- Pass 2: データ特性を収集 (候補列のみ) ---
+        candidate_indices = {cand["index"] for c_list in candidates.values() for cand in c_list}
+        stats = {idx: {"unique_values": create_counter(exact, precision), "non_empty_count": 0, "year_match_count": 0} for idx in candidate_indices}
+        total_rows = 0
+
+        for row in rows:
+            total_rows += 1
+            for idx in candidate_indices:
+                value = row[idx] if idx < len(row) else ""
+                if value and not value.isspace():
+                    stats[idx]["non_empty_count"] += 1
+                    stats[idx]["unique_values"].add(value)
+                    if file_year and value == str(file_year):
+                        stats[idx]["year_match_count"] += 1
+        
+        # --- Pass 3: 最適な候補を選択 ---
+        final_mapping = {}
+        for target_key, cands_list in candidates.items():
+            best_candidate = None
+            max_final_score = -1
+
+            for cand in cands_list:
+                idx = cand["index"]
+                stat = stats[idx]
+                non_empty_count = stat["non_empty_count"]
+                if non_empty_count == 0: continue
+
+                # データ特性を加味した最終スコアを計算
+                final_score = cand["score"] # 排他性スコアをベースにする
+                # スケッチの推定値が非空件数を超えないように丸める
+                distinct_count = min(stat["unique_values"].count(), non_empty_count)
+                uniqueness = distinct_count / non_empty_count
+                if target_key in ["project_id", "project_name"]:
+                    final_score += uniqueness # ユニーク率をスコアに加算
+                elif target_key == "year":
+                    match_rate = stat["year_match_count"] / non_empty_count if non_empty_count > 0 else 0
+                    final_score += match_rate # 年の一致率をスコアに加算
+
+                if final_score > max_final_score:
+                    max_final_score = final_score
+                    best_candidate = {
+                        "column_name": cand["name"],
+                        "column_index": idx,
+                        "exclusivity_score": cand["score"], # 排他性スコアも記録
+                        "uniqueness_rate": round(uniqueness, 3),
+                        "non_empty_rate": round(non_empty_count / total_rows, 3) if total_rows > 0 else 0,
+                        "distinct_count": distinct_count,
+                        "non_empty_count": non_empty_count
+                    }
+                    if keep_sketches:
+                        best_candidate["distinct_sketch"] = stat["unique_values"].to_dict()
+
+            if best_candidate:
+                final_mapping[target_key] = best_candidate
+
+        result = {
+            "filename": filename,
+            "uniqueness_mode": "exact" if exact else "hll",
+            "identified_metadata": final_mapping
+        }
+        if sample_rows:
+            result["sample_rows"] = total_rows
+        return result
 
     except Exception as e:
         print(f"\nファイル処理中にエラーが発生しました {filename}: {e}")
         return None
 
-# (main関数は前回から変更なし)
-def main(csv_dir: str, output_filepath: str):
+def build_uniqueness_rollup(results: list, exact: bool, precision: int) -> dict:
+    """
+    各ファイルで選ばれた列のスケッチを年度別・コーパス全体で統合し、ユニーク率を再計算する。
+    結果からスケッチ(distinct_sketch)は取り除かれる。
+    """
+    merged = defaultdict(dict) # {group: {target_key: {"counter", "non_empty_count", "file_count"}}}
+    for result in results:
+        file_year = extract_year_from_filename(result["filename"])
+        groups = ["all", str(file_year) if file_year else "unknown"]
+        for target_key, cand in result["identified_metadata"].items():
+            if not isinstance(cand, dict) or "distinct_sketch" not in cand:
+                continue
+            counter = counter_from_dict(cand.pop("distinct_sketch"))
+            for group in groups:
+                entry = merged[group].get(target_key)
+                if entry is None:
+                    entry = merged[group][target_key] = {"counter": create_counter(exact, precision), "non_empty_count": 0, "file_count": 0}
+                entry["counter"].merge(counter)
+                entry["non_empty_count"] += cand["non_empty_count"]
+                entry["file_count"] += 1
+
+    def summarize(group_entries):
+        summary = {}
+        for target_key, entry in sorted(group_entries.items()):
+            distinct_count = min(entry["counter"].count(), entry["non_empty_count"])
+            summary[target_key] = {
+                "distinct_count": distinct_count,
+                "non_empty_count": entry["non_empty_count"],
+                "uniqueness_rate": round(distinct_count / entry["non_empty_count"], 3) if entry["non_empty_count"] > 0 else 0,
+                "file_count": entry["file_count"]
+            }
+        return summary
+
+    return {
+        "uniqueness_mode": "exact" if exact else "hll",
+        "precision": None if exact else precision,
+        "relative_standard_error": 0.0 if exact else round(relative_standard_error(precision), 4),
+        "corpus": summarize(merged.get("all", {})),
+        "by_year": {group: summarize(entries) for group, entries in sorted(merged.items()) if group != "all"}
+    }
+
+def main(csv_dir: str, output_filepath: str, exact: bool = False, precision: int = DEFAULT_PRECISION,
+         rollup_filepath: typing.Optional[str] = None, workers: typing.Optional[int] = None,
+         sample_rows: typing.Optional[int] = None):
+    """
+    rollup_filepathを指定した場合だけ、各ファイルの列のスケッチを集めて年度別・全体のユニーク率を集計する。
+    sample_rowsを指定した場合は、各ファイルのsample_cacheの先頭sample_rows行から判定する (全体のユニーク率集計は行わない)。
+    """
     print(f"--- '{csv_dir}' 内のCSVから主要メタデータの特定を開始 (改良版) ---")
-    csv_files = glob.glob(os.path.join(csv_dir, '*.csv'))
+    if sample_rows:
+        print(f"サンプルモード: 各ファイルの先頭{sample_rows:,}行 (sample_cache) から判定します。")
+        rollup_filepath = None
+    if exact and rollup_filepath:
+        print("[警告] --exact で集計する場合、各ファイルの列の値の集合をすべて親プロセスに集めるため、メモリを大量に使います。")
+    if exact:
+        print("ユニーク率の計算モード: 厳密 (set)")
+    else:
+        print(f"ユニーク率の計算モード: HyperLogLog (precision={precision}, 相対標準誤差 約{relative_standard_error(precision):.1%})")
+    csv_files = sorted(glob.glob(os.path.join(csv_dir, '*.csv')))
     if not csv_files:
         print("分析対象のCSVファイルが見つかりません。")
         return
 
-    all_results = []
-    for csv_path in tqdm(csv_files, desc="Identifying key metadata (advanced)"):
-        result = identify_key_metadata_candidates(csv_path)
-        if result:
-            all_results.append(result)
+    worker_func = functools.partial(identify_key_metadata_candidates, exact=exact, precision=precision,
+                                    keep_sketches=rollup_filepath is not None, sample_rows=sample_rows)
+    results = run_parallel(worker_func, csv_files, workers, desc="Identifying key metadata (advanced)")
+    all_results = [r for r in results if r]
+
+    if rollup_filepath:
+        rollup = build_uniqueness_rollup(all_results, exact, precision)
+        with open(rollup_filepath, 'w', encoding='utf-8') as f:
+            json.dump(rollup, f, ensure_ascii=False, indent=2)
+        print(f"年度別・全体のユニーク率集計が出力されました: {rollup_filepath}")
 
     with open(output_filepath, 'w', encoding='utf-8') as f:
         json.dump(all_results, f, ensure_ascii=False, indent=2)
@@ -147,12 +242,22 @@ def main(csv_dir: str, output_filepath: str):
     print(f"\n特定結果が出力されました: {output_filepath}")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CSVから主要メタデータ列を特定する")
+    parser.add_argument("--exact", action="store_true", help="ユニーク率をsetで厳密に計算する (メモリ消費大)")
+    parser.add_argument("--precision", type=int, default=DEFAULT_PRECISION, help="HyperLogLogの精度 p (レジスタ数 2^p)")
+    parser.add_argument("--workers", type=int, default=None, help="並列ワーカー数 (既定: CPUコア数)")
+    parser.add_argument("--rollup", action="store_true", help="年度別・全体のユニーク率を集計する (key_metadata_uniqueness_rollup.json)")
+    parser.add_argument("--sample", action="store_true", help=f"全行を読まず、ID判定と共通のサンプル (先頭{SAMPLE_ROWS}行, sample_cache) から判定する")
+    args = parser.parse_args()
+
     project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     csv_input_dir = os.path.join(project_root, 'data', 'csv')
     analysis_dir = os.path.join(project_root, 'analysis')
     os.makedirs(analysis_dir, exist_ok=True)
-    output_path = os.path.join(analysis_dir, 'key_metadata_candidates_v2.json')
+    # サンプルから判定した結果は、全行からの結果と取り違えないよう別のファイルに出力する
+    output_path = os.path.join(analysis_dir, 'key_metadata_candidates_v2_sampled.json' if args.sample else 'key_metadata_candidates_v2.json')
+    rollup_path = os.path.join(analysis_dir, 'key_metadata_uniqueness_rollup.json') if args.rollup else None
     
-    main(csv_input_dir, output_path)
+    main(csv_input_dir, output_path, args.exact, args.precision, rollup_path, args.workers, SAMPLE_ROWS if args.sample else None)
     
     print("\n★★★ 主要メタデータの特定が完了しました ★★★")
\ No newline at end of file
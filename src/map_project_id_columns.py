@@ -1,34 +1,33 @@
 import os
 import glob
-import pandas as pd
 import json
 from tqdm import tqdm
+from sample_cache import load_sample, SAMPLE_ROWS
 
 # --- 事業ID特定のヒューリスティック定義 (v5) ---
 ID_KEYWORDS = ["事業番号", "整理番号", "番号", "ID"]
 CONTEXT_BONUS_KEYWORDS = ["事業"]
 CONTEXT_EXCLUSION_KEYWORDS = ["関連", "過去", "点検", "改善", "レビューシート", "法人", "郵便", "支出先"]
-SAMPLE_ROWS = 500
 
 def find_best_id_column_v5(csv_path: str) -> str:
     """
     v5の優先順位付きトランプカードルールに基づき、最適な事業ID列名を特定する。
+    列の値は共有サンプルキャッシュ (先頭SAMPLE_ROWS行) から参照する。
     """
     try:
-        header = pd.read_csv(csv_path, nrows=0, dtype=str).columns.tolist()
+        df_sample = load_sample(csv_path, SAMPLE_ROWS)
+        header = df_sample.columns.tolist()
         
         # --- ここからが優先順位付きトランプカードロジック ---
 
         # 1. 最優先トランプ: "事業番号"
         if "事業番号" in header:
-            df_sample = pd.read_csv(csv_path, usecols=["事業番号"], nrows=SAMPLE_ROWS, dtype=str)
             series = df_sample["事業番号"].dropna()
             if not series.empty and (series.nunique() / len(series) > 0.3):
                 return "事業番号"
 
         # 2. 次世代トランプ: "事業番号-1"
         if "事業番号-1" in header:
-            df_sample = pd.read_csv(csv_path, usecols=["事業番号-1"], nrows=SAMPLE_ROWS, dtype=str)
             series = df_sample["事業番号-1"].dropna()
             if not series.empty and (series.nunique() / len(series) > 0.3):
                 return "事業番号-1"
@@ -53,9 +52,6 @@ def find_best_id_column_v5(csv_path: str) -> str:
         if not candidates: return None
 
         # --- ユニーク率の検証 ---
-        candidate_names = list(set([c["name"] for c in candidates]))
-        df_sample = pd.read_csv(csv_path, usecols=candidate_names, nrows=SAMPLE_ROWS, dtype=str)
-
         max_final_score = -float('inf')
         best_column = None
 
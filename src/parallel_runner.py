@@ -0,0 +1,63 @@
+import os
+import typing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tqdm import tqdm
+
+def default_workers() -> int:
+    """既定のワーカー数 (CPUコア数)"""
+    return os.cpu_count() or 1
+
+def run_parallel(func: typing.Callable, items: list, workers: typing.Optional[int] = None, desc: str = "Processing") -> list:
+    """
+    itemsの各要素にfuncを適用し、結果をitemsと同じ順序のリストで返す。
+    workers > 1 の場合はプロセスプールで並列実行する。funcはpickle可能な
+    モジュールレベルの関数 (またはfunctools.partial) である必要がある。
+    funcが例外を送出した要素の結果はNoneになる。
+    """
+    workers = workers or default_workers()
+    results = [None] * len(items)
+
+    if workers <= 1 or len(items) <= 1:
+        for i, item in enumerate(tqdm(items, desc=desc)):
+            try:
+                results[i] = func(item)
+            except Exception as e:
+                tqdm.write(f"[エラー] '{item}' の処理中にエラー: {e}")
+        return results
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(items))) as executor:
+        futures = {executor.submit(func, item): i for i, item in enumerate(items)}
+        for future in tqdm(as_completed(futures), total=len(futures), desc=desc):
+            i = futures[future]
+            try:
+                results[i] = future.result()
+            except Exception as e:
+                tqdm.write(f"[エラー] '{items[i]}' の処理中にエラー: {e}")
+    return results
+
+def imap_ordered(func: typing.Callable, items: typing.Iterable, workers: typing.Optional[int] = None,
+                 initializer: typing.Optional[typing.Callable] = None, max_pending: typing.Optional[int] = None) -> typing.Iterator:
+    """
+    itemsの各要素にfuncを適用し、結果を入力と同じ順序で逐次yieldする。
+    未完了のタスクはmax_pending (既定: ワーカー数の2倍) 個までに抑えるため、巨大な入力も全件をメモリに載せない。
+    initializerは各ワーカープロセスの起動時に1回呼ばれる (トークナイザーやモデルの生成など)。
+    workers <= 1 の場合は同じプロセスで順に処理する。funcの例外はそのまま呼び出し元に送出される。
+    """
+    workers = workers or default_workers()
+    if workers <= 1:
+        if initializer:
+            initializer()
+        for item in items:
+            yield func(item)
+        return
+
+    max_pending = max_pending or workers * 2
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
@@ -1,7 +1,16 @@
 # src/preprocess_docs.py
 import os, json, argparse # ★★★ argparseをインポート ★★★
+import functools
+import glob
+import time
+from collections import deque, OrderedDict
 from tqdm import tqdm
 from sudachipy import tokenizer, dictionary
+from parallel_runner import imap_ordered, default_workers
+from sample_cache import file_fingerprint
+from chunk_preprocessed_docs import chunk_document
+from char_bigram import bigram_tokens, ANALYZERS
+from corpus_manifest import content_hash, manifest_path, load_manifest, write_manifest, compute_delta, format_delta, index_jsonl_offsets
 
 # ... (tokenize_large_text関数は変更なし) ...
 def tokenize_large_text(tokenizer_obj, text, mode):
@@ -12,30 +21,310 @@ def tokenize_large_text(tokenizer_obj, text, mode):
         start += len(chunk_str.encode('utf-8'))
     return tokens
 
-def main(docs_filepath, output_filepath):
+# ワーカーに一度に渡すドキュメント数 (プロセス間通信の回数と、ワーカー間の負荷の偏りのバランス)
+TOKENIZE_BLOCK_DOCS = 64
+SPLIT_MODE = tokenizer.Tokenizer.SplitMode.C
+
+# build_search_docs.py が本文を組み立てるときの区切り (「詳細: 値」の断片を「。 」でつなぐ)
+FRAGMENT_SEPARATOR = '。 '
+LABEL_SEPARATOR = ': '
+# 断片の分かち書き結果を保持するLRUキャッシュの上限 (ワーカーごと)。件数ではなく、断片と分かち書き結果の合計文字数で決める
+# (長い断片が多くてもメモリが増えすぎないよう、1ワーカーあたり数百MB以内に収まる値にする)
+FRAGMENT_CACHE_MAX_TOTAL_CHARS = 20_000_000
+# これより長い断片は再出現しにくいため、キャッシュせずにそのまま分かち書きする
+FRAGMENT_CACHE_MAX_CHARS = 2000
+
+_worker_tokenizer = None
+_use_fragment_cache = True
+_analyzer = "sudachi"
+_layout = "combined"
+
+# ドキュメントのフィールド構成
+#   combined: ラベル (詳細) と値を1つの contents にまとめる (従来通り)
+#   values:   値だけを contents に入れる (どのドキュメントにも現れるラベルのポスティングを作らない)
+#   fields:   値を contents、重複を除いたラベルを labels の別フィールドに入れる (検索時にラベルの重みを下げられる)
+LAYOUTS = ("combined", "values", "fields")
+
+def init_worker_tokenizer(use_fragment_cache=True, analyzer="sudachi", layout="combined"):
+    """各ワーカープロセスで1回だけSudachiの辞書を読み込む (文字バイグラムの場合は辞書を使わない)"""
+    global _worker_tokenizer, _use_fragment_cache, _analyzer, _layout
+    if analyzer == "sudachi":
+        _worker_tokenizer = dictionary.Dictionary().create()
+    _use_fragment_cache, _analyzer, _layout = use_fragment_cache, analyzer, layout
+
+def tokenize_text(text):
+    """分かち書きした結果を空白区切りの文字列で返す (空白だけのトークンは除く)"""
+    return ' '.join(t for t in tokenize_large_text(_worker_tokenizer, text, SPLIT_MODE) if t.strip())
+
+_fragment_cache = OrderedDict()
+_fragment_cache_chars = 0
+
+def tokenize_text_cached(text):
+    """tokenize_textの結果をLRUキャッシュする。合計文字数がFRAGMENT_CACHE_MAX_TOTAL_CHARSを超えたら古いものから捨てる"""
+    global _fragment_cache_chars
+    tokens = _fragment_cache.get(text)
+    if tokens is not None:
+        _fragment_cache.move_to_end(text)
+        return tokens
+    tokens = tokenize_text(text)
+    _fragment_cache[text] = tokens
+    _fragment_cache_chars += len(text) + len(tokens)
+    while _fragment_cache_chars > FRAGMENT_CACHE_MAX_TOTAL_CHARS:
+        old_text, old_tokens = _fragment_cache.popitem(last=False)
+        _fragment_cache_chars -= len(old_text) + len(old_tokens)
+    return tokens
+
+def tokenize_fragment(text):
+    return tokenize_text_cached(text) if len(text) <= FRAGMENT_CACHE_MAX_CHARS else tokenize_text(text)
+
+def tokenize_document(text):
+    """
+    本文を「詳細: 値」の断片ごとに分け、ラベル (詳細) と値を別々にキャッシュ経由で分かち書きする。
+    どの事業にも現れる長い列名や、繰り返し現れる値は、ワーカーごとに1回だけ解析すれば済む。
+    """
+    parts = []
+    for fragment in text.split(FRAGMENT_SEPARATOR):
+        label, separator, value = fragment.partition(LABEL_SEPARATOR)
+        if separator:
+            parts.append(f"{tokenize_fragment(label)} : {tokenize_fragment(value)}".strip())
+        elif fragment.strip():
+            parts.append(tokenize_fragment(fragment))
+    return ' 。 '.join(parts)
+
+def analyze_fragment(text):
+    if _analyzer == "bigram":
+        return ' '.join(bigram_tokens(text))
+    return tokenize_fragment(text) if _use_fragment_cache else tokenize_text(text)
+
+def tokenize_fields(text):
+    """レイアウトに応じて、分かち書き済みのフィールド {"contents": ..., ("labels": ...)} を返す"""
+    if _layout == "combined":
+        if _analyzer == "bigram":
+            return {"contents": ' '.join(bigram_tokens(text))}
+        if _use_fragment_cache:
+            return {"contents": tokenize_document(text)}
+        return {"contents": ' '.join(tokenize_large_text(_worker_tokenizer, text, SPLIT_MODE))}
+
+    labels, values = [], []
+    for fragment in text.split(FRAGMENT_SEPARATOR):
+        label, separator, value = fragment.partition(LABEL_SEPARATOR)
+        if not separator:
+            label, value = '', fragment
+        if label.strip() and label not in labels:
+            labels.append(label)
+        if value.strip():
+            values.append(analyze_fragment(value))
+    # 区切りの「。」も全ドキュメントに現れるトークンなので、値・ラベルの間は空白だけで区切る
+    fields = {"contents": ' '.join(values)}
+    if _layout == "fields":
+        fields["labels"] = ' '.join(analyze_fragment(label) for label in labels)
+    return fields
+
+def tokenize_block(block):
+    """[(id, 本文 or None)] を受け取り、[(id, 分かち書き済みのフィールド or None)] を返す (Noneは前回の結果を再利用するドキュメント)"""
+    return [(doc_id, None if text is None else tokenize_fields(text)) for doc_id, text in block]
+
+# アナライザーごとの既定の出力先 (前処理済みJSONL, Pyseriniのシャードディレクトリ)。結果が混ざらないよう分ける
+DEFAULT_OUTPUTS = {
+    "sudachi": ("analysis/preprocessed_for_pyserini.jsonl", "analysis/pyserini_corpus"),
+    "bigram": ("analysis/preprocessed_bigram.jsonl", "analysis/pyserini_corpus_bigram"),
+}
+
+def default_outputs(analyzer, layout):
+    """combined以外のレイアウトでは、出力先の名前にレイアウト名を付ける"""
+    output, shard_dir = DEFAULT_OUTPUTS[analyzer]
+    if layout == "combined":
+        return output, shard_dir
+    return output.replace('.jsonl', f'_{layout}.jsonl'), f"{shard_dir}_{layout}"
+
+# チェックポイントを記録する間隔 (秒)
+CHECKPOINT_INTERVAL_SEC = 60
+
+def preprocess_hash(contents, settings):
+    """
+    本文と前処理の設定 (アナライザー, レイアウト, 断片キャッシュの有無) から計算するハッシュ (ハッシュ一覧に記録する)。
+    出力の形式が変わる設定を変えると全件が「変更」として扱われ、前回の出力の行を再利用しない。
+    """
+    analyzer, layout, use_fragment_cache = settings
+    return content_hash(f"{analyzer}\t{layout}\t{int(use_fragment_cache)}\n{contents}")
+
+def iter_blocks(f_in, previous, offsets, hashes, block_ends, settings):
+    """
+    入力をTOKENIZE_BLOCK_DOCS件ずつのブロックにまとめる。本文と設定が前回から変わっていないドキュメントは本文を渡さない。
+    各ブロックの末尾の入力バイト位置と最後のドキュメントIDを、block_endsに順に追加する (チェックポイント用)。
+    """
+    block, offset = [], f_in.tell()
+    for line in f_in:
+        offset += len(line)
+        original_doc = json.loads(line); doc_hash = preprocess_hash(original_doc['contents'], settings)
+        hashes[original_doc['id']] = doc_hash
+        reuse = previous.get(original_doc['id']) == doc_hash and original_doc['id'] in offsets
+        block.append((original_doc['id'], None if reuse else original_doc['contents']))
+        if len(block) >= TOKENIZE_BLOCK_DOCS: block_ends.append((offset, original_doc['id'])); yield block; block = []
+    if block: block_ends.append((offset, block[-1][0])); yield block
+
+def checkpoint_path(output_filepath):
+    return f"{output_filepath}.checkpoint.json"
+
+def write_checkpoint(path, state):
+    with open(f"{path}.tmp", 'w', encoding='utf-8') as f: json.dump(state, f, ensure_ascii=False)
+    os.replace(f"{path}.tmp", path)
+
+def verify_output_tail(tmp_path, output_offset, last_doc_id):
+    """書きかけの出力の、チェックポイント位置の直前の行が記録されたドキュメントで終わっているか確認する"""
+    if not os.path.exists(tmp_path) or os.path.getsize(tmp_path) < output_offset: return False
+    if output_offset == 0: return last_doc_id is None
+    with open(tmp_path, 'rb') as f:
+        # 末尾の行の先頭を後ろ向きに探す (1行が数MBになることもあるため、ブロック単位で読む)
+        start, tail = output_offset, b''
+        while start > 0:
+            step = min(start, 1024 * 1024); start -= step
+            f.seek(start); tail = f.read(step) + tail
+            if tail.rfind(b'\n', 0, len(tail) - 1) != -1: break
+        if not tail.endswith(b'\n'): return False
+        last_line = tail[tail.rfind(b'\n', 0, len(tail) - 1) + 1:]
+        try: return json.loads(last_line)["id"] == last_doc_id
+        except ValueError: return False
+
+class ShardWriter:
+    """
+    チャンク化したドキュメントを、Pyseriniの入力ディレクトリ内のN個のシャードファイルに振り分ける。
+    常に現在のサイズが最も小さいシャードに書くため、各シャードのバイト数はほぼ均等になる (-threadsで並列に索引付けできる)。
+    書き込み中は *.jsonl.tmp に書き、commit()で *.jsonl に置き換える。
+    """
+    def __init__(self, shard_dir, num_shards, offsets=None):
+        os.makedirs(shard_dir, exist_ok=True)
+        self.shard_dir = shard_dir
+        self.paths = [os.path.join(shard_dir, f"part-{i:05d}.jsonl") for i in range(num_shards)]
+        self.sizes = list(offsets) if offsets else [0] * num_shards
+        self.files = [open(f"{path}.tmp", 'r+b' if offsets else 'wb') for path in self.paths]
+        for f, size in zip(self.files, self.sizes): f.seek(size); f.truncate()
+
+    def write(self, doc):
+        for chunk_doc in chunk_document(doc):
+            data = (json.dumps(chunk_doc, ensure_ascii=False) + '\n').encode('utf-8')
+            i = self.sizes.index(min(self.sizes)); self.files[i].write(data); self.sizes[i] += len(data)
+
+    def sync(self):
+        """バッファをディスクに書き出し、チェックポイントに記録する各シャードのサイズを返す"""
+        for f in self.files: f.flush(); os.fsync(f.fileno())
+        return list(self.sizes)
+
+    def close(self):
+        for f in self.files: f.close()
+
+    def commit(self):
+        self.close()
+        for path in self.paths: os.replace(f"{path}.tmp", path)
+        # シャード数が変わった場合などに、前回の古いシャードが索引付けされないようにする
+        # (置き換えが終わってから消すため、途中で中断しても前回のシャードは残る)
+        for stale in glob.glob(os.path.join(self.shard_dir, 'part-*.jsonl*')):
+            if stale not in self.paths: os.remove(stale)
+
+def shard_tmp_files_valid(shard_dir, shard_offsets):
+    paths = [os.path.join(shard_dir, f"part-{i:05d}.jsonl.tmp") for i in range(len(shard_offsets))]
+    return all(os.path.exists(path) and os.path.getsize(path) >= size for path, size in zip(paths, shard_offsets))
+
+def load_resume_state(docs_filepath, output_filepath, use_fragment_cache, shard_dir=None, num_shards=0, analyzer="sudachi", layout="combined"):
+    """有効なチェックポイントがあればその内容を返す。入力や設定が変わっていれば破棄してNoneを返す"""
+    path = checkpoint_path(output_filepath)
+    if not os.path.exists(path): return None
+    with open(path, 'r', encoding='utf-8') as f: state = json.load(f)
+    if state.get("input_fingerprint") != file_fingerprint(docs_filepath) or state.get("use_fragment_cache") != use_fragment_cache \
+            or state.get("num_shards", 0) != num_shards or state.get("analyzer", "sudachi") != analyzer \
+            or state.get("layout", "combined") != layout:
+        print("-> 入力または設定が変わったため、チェックポイントを破棄して最初から処理します。"); return None
+    if not verify_output_tail(f"{output_filepath}.tmp", state["output_offset"], state["last_doc_id"]):
+        print("-> 書きかけの出力がチェックポイントと一致しないため、最初から処理します。"); return None
+    if num_shards and not shard_tmp_files_valid(shard_dir, state["shard_offsets"]):
+        print("-> 書きかけのシャードがチェックポイントと一致しないため、最初から処理します。"); return None
+    return state
+
+def main(docs_filepath, output_filepath, workers=None, use_fragment_cache=True, shard_dir=None, num_shards=0, analyzer="sudachi",
+         layout="combined"):
+    """
+    layoutでフィールド構成 (combined / values / fields) を選ぶ (LAYOUTSを参照)。
+    analyzer="bigram" の場合は、Sudachiを使わずに文字バイグラムのトークン列を出力する (char_bigram.py)。
+    num_shards > 0 の場合は、分かち書きと同じパスでMAX_CONTENTS_BYTES以下にチャンク化し、
+    shard_dir (Pyseriniの入力ディレクトリ) にnum_shards個のシャードとして直接書き出す。
+    """
     print(f"--- SudachiPyによる前処理を開始 ---")
     print(f"入力: {docs_filepath}")
     print(f"出力: {output_filepath}")
-    # ... (以降の処理は変更なし) ...
-    # (ファイルが存在したら中断するロジックもそのまま)
-    if os.path.exists(output_filepath): print("-> 出力ファイルが既に存在するため中断。"); return
-    tokenizer_obj = dictionary.Dictionary().create(); mode = tokenizer.Tokenizer.SplitMode.C
-    with open(docs_filepath, 'r', encoding='utf-8') as f_in, open(output_filepath, 'w', encoding='utf-8') as f_out:
-        for line in tqdm(f_in, desc="Preprocessing"):
-            original_doc = json.loads(line); tokens = tokenize_large_text(tokenizer_obj, original_doc['contents'], mode)
-            preprocessed_doc = { "id": original_doc['id'], "contents": ' '.join(tokens) }
-            f_out.write(json.dumps(preprocessed_doc, ensure_ascii=False) + '\n')
+    # 前回の出力とハッシュ一覧があれば、本文と設定が変わっていないドキュメントは前回の分かち書き結果を再利用する
+    settings = (analyzer, layout, use_fragment_cache)
+    hashes_path = manifest_path(output_filepath)
+    previous, offsets = {}, {}
+    if os.path.exists(output_filepath):
+        if os.path.exists(hashes_path): previous = load_manifest(hashes_path); offsets = index_jsonl_offsets(output_filepath)
+        else: print("-> ハッシュ一覧の無い既存の出力は再利用できないため、全件を処理して置き換えます。")
+
+    # 中断された実行があれば、書きかけの出力の検証済みの末尾から再開する
+    tmp_path, ckpt_path = f"{output_filepath}.tmp", checkpoint_path(output_filepath)
+    state = load_resume_state(docs_filepath, output_filepath, use_fragment_cache, shard_dir, num_shards, analyzer, layout)
+    hashes, reused = {}, 0
+    if state:
+        print(f"-> チェックポイントから再開します (ドキュメントID: {state['last_doc_id']} の次から)")
+        reused = state["reused"]
+        with open(docs_filepath, 'rb') as f_in:  # 処理済み部分のハッシュは入力を読み直して復元する (分かち書きより十分速い)
+            while f_in.tell() < state["input_offset"]:
+                original_doc = json.loads(f_in.readline()); hashes[original_doc['id']] = preprocess_hash(original_doc['contents'], settings)
+    else:
+        state = {"input_fingerprint": file_fingerprint(docs_filepath), "use_fragment_cache": use_fragment_cache,
+                 "input_offset": 0, "output_offset": 0, "last_doc_id": None, "reused": 0,
+                 "num_shards": num_shards, "shard_offsets": None, "analyzer": analyzer, "layout": layout}
+    shards = ShardWriter(shard_dir, num_shards, state["shard_offsets"]) if num_shards else None
+    if shards: print(f"シャード出力: {shard_dir} ({num_shards}ファイル)")
+
+    # 各ワーカーが自分のトークナイザーでブロック単位に分かち書きし、結果は入力と同じ順序で書き出す
+    workers = workers or default_workers()
+    print(f"ワーカー数: {workers} / アナライザー: {analyzer} / レイアウト: {layout} / 断片キャッシュ: {'有効' if use_fragment_cache else '無効'}")
+    block_ends = deque()
+    with open(docs_filepath, 'rb') as f_in, open(tmp_path, 'r+b' if state["output_offset"] else 'wb') as f_out, \
+         open(output_filepath if offsets else os.devnull, 'rb') as f_prev, tqdm(desc="Preprocessing", initial=len(hashes)) as pbar:
+        f_in.seek(state["input_offset"]); f_out.seek(state["output_offset"]); f_out.truncate()
+        blocks = iter_blocks(f_in, previous, offsets, hashes, block_ends, settings)
+        last_checkpoint = time.monotonic()
+        for results in imap_ordered(tokenize_block, blocks, workers, initializer=functools.partial(init_worker_tokenizer, use_fragment_cache, analyzer, layout)):
+            for doc_id, fields in results:
+                if fields is None:
+                    f_prev.seek(offsets[doc_id]); line = f_prev.readline(); f_out.write(line); reused += 1
+                    if shards: shards.write(json.loads(line))
+                    continue
+                preprocessed_doc = { "id": doc_id, **fields }
+                f_out.write((json.dumps(preprocessed_doc, ensure_ascii=False) + '\n').encode('utf-8'))
+                if shards: shards.write(preprocessed_doc)
+            pbar.update(len(results))
+            state["input_offset"], state["last_doc_id"] = block_ends.popleft()
+            if time.monotonic() - last_checkpoint >= CHECKPOINT_INTERVAL_SEC:
+                f_out.flush(); os.fsync(f_out.fileno())
+                state["output_offset"], state["reused"] = f_out.tell(), reused
+                if shards: state["shard_offsets"] = shards.sync()
+                write_checkpoint(ckpt_path, state); last_checkpoint = time.monotonic()
+    if shards: shards.commit()
+    os.replace(tmp_path, output_filepath); write_manifest(hashes_path, hashes)
+    if os.path.exists(ckpt_path): os.remove(ckpt_path)
+    print(f"-> 前回からの差分: {format_delta(compute_delta(hashes, previous))} (再利用 {reused:,}件)")
     print("-> 前処理完了。")
 
 if __name__ == "__main__":
     # ★★★ コマンドライン引数を解釈する部分を追加 ★★★
     parser = argparse.ArgumentParser(description="SudachiPyでドキュメントを前処理する")
     parser.add_argument("--input", default="analysis/search_documents.jsonl", help="入力JSONLファイルパス")
-    parser.add_argument("--output", default="analysis/preprocessed_for_pyserini.jsonl", help="出力JSONLファイルパス")
+    parser.add_argument("--output", default=None, help="出力JSONLファイルパス (既定: analysis/preprocessed_for_pyserini.jsonl, bigramでは analysis/preprocessed_bigram.jsonl)")
+    parser.add_argument("--workers", type=int, default=None, help="並列ワーカー数 (既定: CPUコア数)")
+    parser.add_argument("--shards", type=int, default=0, help="Pyserini用のシャード数 (0: シャードを書き出さない)。-threadsと同じ数を推奨")
+    parser.add_argument("--shard-dir", default=None, help="シャードの出力先 (Pyseriniの -input に指定するディレクトリ。既定: analysis/pyserini_corpus, bigramでは analysis/pyserini_corpus_bigram)")
+    parser.add_argument("--analyzer", choices=ANALYZERS, default="sudachi", help="sudachi: 形態素解析 / bigram: 形態素解析を使わない文字バイグラム")
+    parser.add_argument("--layout", choices=LAYOUTS, default="combined", help="combined: ラベルと値をまとめる / values: 値だけ / fields: 値とラベルを別フィールドにする")
+    parser.add_argument("--no-fragment-cache", action="store_true", help="断片ごとのキャッシュを使わず、本文全体をそのまま分かち書きする")
     args = parser.parse_args()
 
     project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    default_output, default_shard_dir = default_outputs(args.analyzer, args.layout)
     input_path = os.path.join(project_root, args.input)
-    output_path = os.path.join(project_root, args.output)
+    output_path = os.path.join(project_root, args.output or default_output)
+    
+    shard_dir = os.path.join(project_root, args.shard_dir or default_shard_dir)
     
-    main(input_path, output_path)
\ No newline at end of file
+    main(input_path, output_path, args.workers, not args.no_fragment_cache, shard_dir, args.shards, args.analyzer, args.layout)
\ No newline at end of file
@@ -2,9 +2,11 @@ import os
 import glob
 import csv
 import json
-from tqdm import tqdm
 from collections import defaultdict
 import re
+import typing
+import argparse
+from parallel_runner import run_parallel
 
 # --- プロファイリングルールの定義 ---
 
@@ -23,71 +25,89 @@ INCLUSION_KEYWORDS_PRIORITY = {
 # ルール3: 質問文のパターン (正規表現)
 QUESTION_PATTERN = re.compile(r'か。?$')
 
-def profile_and_rank_headers(csv_dir: str) -> dict:
+def score_header(col_name: str) -> typing.Optional[float]:
+    """単一の列名をプロファイリングルールで採点する。候補でなければNoneを返す。"""
+    # 初期スコア
+    score = 0.0
+    is_candidate = False
+
+    # --- Inclusionルール (加点) ---
+    # 最優先キーワードにマッチすれば高得点
+    for keywords in INCLUSION_KEYWORDS_PRIORITY.values():
+        for keyword in keywords:
+            if keyword in col_name:
+                score += 2.0
+                is_candidate = True
+                break
+    
+    # スコアが低くても「支出」が含まれていれば最低点を与える
+    if "支出" in col_name and not is_candidate:
+        score += 0.1
+        is_candidate = True
+
+    # 候補でなければここで処理終了
+    if not is_candidate:
+        return None
+    
+    # --- Exclusionルール (減点) ---
+    # 除外キーワードが含まれていたら大幅減点
+    for keyword in EXCLUSION_KEYWORDS:
+        if keyword in col_name:
+            score -= 1.5
+    
+    # 質問文形式なら減点
+    if QUESTION_PATTERN.search(col_name):
+        score -= 1.5
+
+    # --- 構造ルール (加点) ---
+    # キーワードが列名の末尾部分にあると、より重要度が高い
+    parts = col_name.split('-')
+    if len(parts) > 1:
+        last_part = parts[-1]
+        if "支出額" in last_part or "支出済額" in last_part or "執行額" in last_part:
+            score += 0.5
+
+    return score
+
+def profile_file_headers(csv_path: str) -> typing.Optional[dict]:
+    """
+    単一CSVのヘッダーを採点し、{列名: スコア合計} を返す (ワーカー用の部分集計)。
+    """
+    filename = os.path.basename(csv_path)
+    try:
+        with open(csv_path, 'r', encoding='utf-8-sig') as f:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if not header: return None
+
+            file_scores = defaultdict(float)
+            for col_name in header:
+                score = score_header(col_name)
+                if score is not None:
+                    file_scores[col_name] += score
+            return {"filename": filename, "scores": dict(file_scores)}
+
+    except Exception as e:
+        print(f"\nファイル処理中にエラーが発生しました {filename}: {e}")
+        return None
+
+def profile_and_rank_headers(csv_dir: str, workers: typing.Optional[int] = None) -> dict:
     """
     プロファイリングルールに基づき、全CSVのヘッダーを分析・ランク付けする。
+    ファイルごとの採点は並列に行い、結果をファイル名順に統合する。
     """
-    csv_files = glob.glob(os.path.join(csv_dir, '*.csv'))
+    csv_files = sorted(glob.glob(os.path.join(csv_dir, '*.csv')))
     if not csv_files: return {}
 
     # { header_name: { "score": float, "found_in_files": set() } }
     header_profiles = defaultdict(lambda: {"score": 0.0, "found_in_files": set()})
 
-    for csv_path in tqdm(csv_files, desc="Profiling all headers"):
-        filename = os.path.basename(csv_path)
-        try:
-            with open(csv_path, 'r', encoding='utf-8-sig') as f:
-                reader = csv.reader(f)
-                header = next(reader, None)
-                if not header: continue
-
-                for col_name in header:
-                    # 初期スコア
-                    score = 0.0
-                    is_candidate = False
-
-                    # --- Inclusionルール (加点) ---
-                    # 最優先キーワードにマッチすれば高得点
-                    for keywords in INCLUSION_KEYWORDS_PRIORITY.values():
-                        for keyword in keywords:
-                            if keyword in col_name:
-                                score += 2.0
-                                is_candidate = True
-                                break
-                    
-                    # スコアが低くても「支出」が含まれていれば最低点を与える
-                    if "支出" in col_name and not is_candidate:
-                        score += 0.1
-                        is_candidate = True
-
-                    # 候補でなければここで処理終了
-                    if not is_candidate:
-                        continue
-                    
-                    # --- Exclusionルール (減点) ---
-                    # 除外キーワードが含まれていたら大幅減点
-                    for keyword in EXCLUSION_KEYWORDS:
-                        if keyword in col_name:
-                            score -= 1.5
-                    
-                    # 質問文形式なら減点
-                    if QUESTION_PATTERN.search(col_name):
-                        score -= 1.5
-
-                    # --- 構造ルール (加点) ---
-                    # キーワードが列名の末尾部分にあると、より重要度が高い
-                    parts = col_name.split('-')
-                    if len(parts) > 1:
-                        last_part = parts[-1]
-                        if "支出額" in last_part or "支出済額" in last_part or "執行額" in last_part:
-                            score += 0.5
-                    
-                    # 最終スコアを更新
-                    header_profiles[col_name]["score"] += score
-                    header_profiles[col_name]["found_in_files"].add(filename)
-
-        except Exception as e:
-            print(f"\nファイル処理中にエラーが発生しました {filename}: {e}")
+    partials = run_parallel(profile_file_headers, csv_files, workers, desc="Profiling all headers")
+    for partial in partials:
+        if not partial: continue
+        for col_name, score in partial["scores"].items():
+            header_profiles[col_name]["score"] += score
+            header_profiles[col_name]["found_in_files"].add(partial["filename"])
     
     # スコアが0より大きいものだけをフィルタリングし、ランキング付け
     ranked_results = []
@@ -104,7 +124,7 @@ def profile_and_rank_headers(csv_dir: str) -> dict:
     
     return {"ranked_candidates": ranked_results}
 
-def main():
+def main(workers: typing.Optional[int] = None):
     print("--- 高度なプロファイリングによるヘッダー候補の探索を開始 ---")
     project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     csv_input_dir = os.path.join(project_root, 'data', 'csv')
@@ -112,7 +132,7 @@ def main():
     os.makedirs(analysis_dir, exist_ok=True)
     output_path = os.path.join(analysis_dir, 'header_profiling_results.json')
     
-    results = profile_and_rank_headers(csv_input_dir)
+    results = profile_and_rank_headers(csv_input_dir, workers)
     
     if not results.get("ranked_candidates"):
         print("有効な候補が見つかりませんでした。")
@@ -130,4 +150,7 @@ def main():
         print(f"Score: {item['score']:.2f}, Header: {item['header_name']}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="全CSVのヘッダーをプロファイリングし、支出額の候補を探す")
+    parser.add_argument("--workers", type=int, default=None, help="並列ワーカー数 (既定: CPUコア数)")
+    args = parser.parse_args()
+    main(args.workers)
\ No newline at end of file
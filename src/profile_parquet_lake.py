@@ -0,0 +1,188 @@
+import os
+import glob
+import json
+import argparse
+import typing
+from collections import defaultdict
+import duckdb
+from tqdm import tqdm
+from summarize_data_types import summarize_column_details
+from analyze_data_distribution import LENGTH_BINS, calculate_bins
+
+# 縦長Parquetの、固定列以外の列名
+# (source_rowは元のCSVでの行番号。これが無い古い縦長データでは、固定列の組み合わせで行を数える)
+SOURCE_ROW_COLUMN = "source_row"
+LONG_FORMAT_COLUMNS = (SOURCE_ROW_COLUMN, "original_column_name", "value")
+
+def build_length_bin_sql(length_expr: str) -> str:
+    """LENGTH_BINSと同じ区切りでセル長をバケツ名に変換するCASE式を作る"""
+    cases = [f"WHEN {length_expr} <= {b} THEN '{b}'" for b in LENGTH_BINS]
+    return f"CASE {' '.join(cases)} ELSE '{LENGTH_BINS[-1]}+' END"
+
+def quote_ident(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+def profile_parquet_file(con, parquet_path: str) -> typing.Optional[dict]:
+    """
+    縦長Parquet 1ファイルを1回のSQL集計でプロファイリングし、
+    summarize_data_types.py と analyze_data_distribution.py と同じ構造の結果を返す。
+
+    縦長データには空セルが含まれない (unpivot時に除外) ため、以下の点で横長CSVの結果と異なりうる。
+      - 空セル数は「総行数 × 列数 − 非空セル数」として算出する
+      - 全行が空の列は列として現れないため、column_countに含まれない (固定列を除く)
+      - 固定列以外が全て空の行は縦長データに残らないため、total_data_rowsに含まれない
+      - 型判定はTRY_CASTに基づくため、全角数字などPythonのint()/float()と判定が異なる値がある
+      - Parquet変換 (read_csv_auto) で数値型になった固定列は、先頭の0が失われた値で集計される
+    このため結果はCSV版の出力を置き換えず、*_parquet.json として別に出力する。
+    """
+    path_sql = parquet_path.replace(os.sep, '/').replace("'", "''")
+    schema = [row[0] for row in con.execute(f"DESCRIBE SELECT * FROM read_parquet('{path_sql}')").fetchall()]
+    fixed_cols = [c for c in schema if c not in LONG_FORMAT_COLUMNS]
+    fixed_tuple = ', '.join(quote_ident(c) for c in fixed_cols) or "NULL"
+    # 元の1行につき1行になるよう、行番号と固定列の組で重複を除く (固定列の値が同じ行も別の行として数える)
+    if SOURCE_ROW_COLUMN in schema:
+        row_key = ', '.join([quote_ident(SOURCE_ROW_COLUMN)] + [quote_ident(c) for c in fixed_cols])
+    else:
+        print(f"[警告] {os.path.basename(parquet_path)} に {SOURCE_ROW_COLUMN} 列がありません。固定列が同じ行は1行として数えます "
+              f"(unpivot_csv_to_long_csv.py から作り直すと正確に数えます)。")
+        row_key = fixed_tuple
+
+    # 固定列 (事業番号など) も1行1セルとして扱うため、行単位で縦持ちに展開して合流させる
+    fixed_cells_sql = ''.join(
+        f"UNION ALL SELECT '{c.replace(chr(39), chr(39) * 2)}' AS col, CAST({quote_ident(c)} AS VARCHAR) AS v FROM data_rows\n"
+        for c in fixed_cols
+    )
+
+    query = f"""
+    WITH src AS (
+        SELECT * FROM read_parquet('{path_sql}')
+    ),
+    data_rows AS (
+        SELECT DISTINCT {row_key} FROM src
+    ),
+    cells AS (
+        SELECT original_column_name AS col, CAST(value AS VARCHAR) AS v FROM src
+        {fixed_cells_sql}
+    ),
+    typed AS (
+        SELECT
+            col, v, length(v) AS len,
+            CASE
+                WHEN lower(v) IN ('true', 'false') THEN 'bool'
+                -- DuckDBは '1.5' などもHUGEINTに丸めてキャストするため、整数の書式も確認する
+                WHEN TRY_CAST(v AS HUGEINT) IS NOT NULL AND regexp_full_match(trim(v), '[+-]?[0-9_]+') THEN 'int'
+                WHEN TRY_CAST(v AS DOUBLE) IS NOT NULL THEN 'float'
+                ELSE 'text'
+            END AS vtype
+        FROM cells
+        WHERE v IS NOT NULL AND trim(v) != ''
+    )
+    SELECT
+        col,
+        {build_length_bin_sql('len')} AS len_bin,
+        vtype,
+        COUNT(*) AS cell_count,
+        SUM(len) AS len_sum,
+        MAX(len) AS max_len
+    FROM typed
+    GROUP BY ALL
+    """
+    total_rows = con.execute(f"SELECT COUNT(*) FROM (SELECT DISTINCT {row_key} FROM read_parquet('{path_sql}'))").fetchone()[0]
+    rows = con.execute(query).fetchall()
+
+    # --- 列ごとのメトリクスに再構成 (固定列は全行が空でも列として数える) ---
+    def empty_details():
+        return {"type_counts": defaultdict(int), "max_len": 0, "total_len": 0, "non_empty_len": 0, "non_empty_count": 0}
+    columns = {c: empty_details() for c in fixed_cols}
+    cell_dist = defaultdict(int)
+    for col, len_bin, vtype, cell_count, len_sum, max_len in rows:
+        details = columns.setdefault(col, empty_details())
+        details["type_counts"][vtype] += cell_count
+        details["max_len"] = max(details["max_len"], max_len)
+        details["total_len"] += len_sum
+        details["non_empty_len"] += len_sum
+        details["non_empty_count"] += cell_count
+        cell_dist[len_bin] += cell_count
+
+    for details in columns.values():
+        details["type_counts"]["empty"] = total_rows - details["non_empty_count"]
+
+    header = fixed_cols + sorted(c for c in columns if c not in fixed_cols)
+    header_lengths = [len(h) for h in header]
+
+    total_cells = total_rows * len(header)
+    non_empty_cells = sum(d["non_empty_count"] for d in columns.values())
+    if total_cells > non_empty_cells:
+        cell_dist['0'] += total_cells - non_empty_cells
+    total_len = sum(d["total_len"] for d in columns.values())
+    bin_order = [str(b) for b in LENGTH_BINS] + [f"{LENGTH_BINS[-1]}+"]
+
+    # 横長CSVのツールと同じファイル名で出力し、結果を突き合わせられるようにする
+    filename = os.path.splitext(os.path.basename(parquet_path))[0] + '.csv'
+    column_properties = {
+        "filename": filename,
+        "total_data_rows": total_rows,
+        "column_count": len(header),
+        "column_property_summary": summarize_column_details(list(columns.values()), total_rows) if total_rows > 0 else {}
+    }
+    distribution = {
+        "filename": filename,
+        "column_count": len(header),
+        "cell_count": total_cells,
+        "max_header_len": max(header_lengths) if header_lengths else 0,
+        "avg_header_len": round(sum(header_lengths) / len(header_lengths), 1) if header_lengths else 0,
+        "max_cell_len": max((d["max_len"] for d in columns.values()), default=0),
+        "avg_cell_len": round(total_len / total_cells, 1) if total_cells > 0 else 0,
+        "header_len_distribution": calculate_bins(header_lengths),
+        "cell_len_distribution": {k: cell_dist[k] for k in bin_order if cell_dist.get(k)}
+    }
+    return {"column_properties": column_properties, "distribution": distribution}
+
+def main(parquet_dir: str, analysis_dir: str, threads: typing.Optional[int] = None):
+    print(f"--- '{parquet_dir}' 内のParquetをDuckDBでプロファイリング ---")
+    parquet_files = sorted(glob.glob(os.path.join(parquet_dir, '*.parquet')))
+    if not parquet_files:
+        print("分析対象のParquetファイルが見つかりません。")
+        return
+
+    con = duckdb.connect()
+    if threads:
+        con.execute(f"SET threads TO {int(threads)}")
+
+    all_properties, all_distributions = [], []
+    try:
+        for parquet_path in tqdm(parquet_files, desc="Profiling Parquet (DuckDB)"):
+            try:
+                result = profile_parquet_file(con, parquet_path)
+            except Exception as e:
+                tqdm.write(f"[エラー] ファイル '{os.path.basename(parquet_path)}' の処理中にエラー: {e}")
+                continue
+            if result:
+                all_properties.append(result["column_properties"])
+                all_distributions.append(result["distribution"])
+    finally:
+        con.close()
+
+    # CSV版 (summarize_data_types.py / analyze_data_distribution.py) の出力と取り違えないよう、別のファイルに出力する
+    properties_path = os.path.join(analysis_dir, 'column_property_summary_parquet.json')
+    distribution_path = os.path.join(analysis_dir, 'data_distribution_summary_parquet.json')
+    with open(properties_path, 'w', encoding='utf-8') as f:
+        json.dump(all_properties, f, ensure_ascii=False, indent=2)
+    with open(distribution_path, 'w', encoding='utf-8') as f:
+        json.dump(all_distributions, f, ensure_ascii=False, indent=2)
+
+    print(f"\n列プロパティの分析結果が出力されました: {properties_path}")
+    print(f"データ分布の分析結果が出力されました: {distribution_path}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ParquetデータレイクをDuckDBのSQL集計でプロファイリングする")
+    parser.add_argument("--threads", type=int, default=None, help="DuckDBのスレッド数 (既定: DuckDBの自動設定)")
+    args = parser.parse_args()
+
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    parquet_input_dir = os.path.join(project_root, 'data', 'parquet')
+    analysis_dir = os.path.join(project_root, 'analysis')
+    os.makedirs(analysis_dir, exist_ok=True)
+
+    main(parquet_input_dir, analysis_dir, args.threads)
+    print("\n★★★ Parquetのプロファイリングが完了しました ★★★")
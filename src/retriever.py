@@ -2,12 +2,45 @@ import os
 import json
 import faiss
 import numpy as np
-from pyserini.search.lucene import LuceneSearcher
-from sentence_transformers import SentenceTransformer
 from sudachipy import tokenizer, dictionary
+from char_bigram import bigram_tokens
+from build_bm25_index import open_searcher, load_config
+from corpus_manifest import parent_doc_id
+from faiss_index_factory import apply_search_params, read_index_mmap, DEFAULT_NPROBE, DEFAULT_EF_SEARCH
+from embedding_backend import load_model
+from id_mapping import load_id_mapping
+
+# ベクトル検索はパッセージ単位のため、親ドキュメントがk件そろうよう k × FAISS_OVERFETCH 件を取得してまとめる
+FAISS_OVERFETCH = 10
+# BM25はセクション単位のため、同じ事業の複数セクションで上位が埋まらないよう k × BM25_OVERFETCH 件を取得してまとめる
+BM25_OVERFETCH = 10
+# パッセージのスコアを親ドキュメントにまとめる方法 (max: 最も近いパッセージ / sum: 近いパッセージが多いほど高い)
+PASSAGE_POOLINGS = ("max", "sum")
+
+def pool_passage_hits(hits, pooling="max"):
+    """パッセージの検索結果 [(ID, 距離)] を親ドキュメントごとにまとめ、スコアの高い順の [(親ID, スコア)] を返す"""
+    scores = {}
+    for doc_id, dist in hits:
+        similarity = 1.0 / (1.0 + float(dist))  # L2距離を、近いほど大きい (0, 1] の値にする
+        parent_id = parent_doc_id(doc_id)
+        if pooling == "sum":
+            scores[parent_id] = scores.get(parent_id, 0.0) + similarity
+        else:
+            scores[parent_id] = max(scores.get(parent_id, 0.0), similarity)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+def pool_section_hits(hits):
+    """BM25の検索結果 (セクション単位) を親ドキュメントごとにまとめ、最も高いセクションのスコア順の [(親ID, スコア)] を返す"""
+    scores = {}
+    for hit in hits:
+        parent_id = parent_doc_id(hit.docid)
+        scores[parent_id] = max(scores.get(parent_id, float('-inf')), hit.score)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
 
 class HybridRetriever:
-    def __init__(self, analysis_dir, pyserini_index_name="pyserini_index"):
+    def __init__(self, analysis_dir, pyserini_index_name="pyserini_index", analyzer="sudachi", label_weight=None,
+                 nprobe=DEFAULT_NPROBE, ef_search=DEFAULT_EF_SEARCH, passage_pooling="max",
+                 encoder_backend=None, mmap_index=False):
         # ... (__init__メソッドは変更なし) ...
         print("ハイブリッド検索システムを初期化中...")
         pyserini_index_path = os.path.join(analysis_dir, pyserini_index_name)
@@ -18,72 +51,92 @@ class HybridRetriever:
         print(f" -> Pyseriniインデックス '{pyserini_index_name}' をロード中...")
         if not os.path.exists(pyserini_index_path):
             raise FileNotFoundError(f"Pyseriniインデックスが見つかりません: {pyserini_index_path}")
-        self.searcher = LuceneSearcher(pyserini_index_path)
+        # 分かち書き済みのインデックスのため、クエリも空白区切りのまま検索する (analyze_queryを参照)
+        self.searcher = open_searcher(pyserini_index_path)
         
         print(" -> Faissインデックスをロード中...")
         if not os.path.exists(faiss_index_path):
             raise FileNotFoundError(f"Faissインデックスが見つかりません: {faiss_index_path}")
-        self.faiss_index = faiss.read_index(faiss_index_path)
+        # mmap_indexが真の場合は、ベクトルをメモリに読み込まずにファイルをメモリマップして検索する (read_index_mmapを参照)
+        self.faiss_index = read_index_mmap(faiss_index_path) if mmap_index else faiss.read_index(faiss_index_path)
+        # IVF・HNSWで構築したインデックスの検索パラメータ (flatの場合は何もしない)
+        apply_search_params(self.faiss_index, nprobe=nprobe, ef_search=ef_search)
+        self.passage_pooling = passage_pooling
         
-        print(" -> SentenceTransformerモデルをロード中...")
-        self.st_model = SentenceTransformer('sonoisa/sentence-luke-japanese-base-lite')
+        # クエリはインデックスの構築 (build_faiss_index.py --backend) と同じ方式でエンコードする
+        # (省略した場合は、構築時の既定と同じ config.json の faiss.encoder_backend を使う)
+        if encoder_backend is None:
+            project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            encoder_backend = load_config(project_root).get("faiss", {}).get("encoder_backend", "torch")
+        print(f" -> SentenceTransformerモデルをロード中... (方式: {encoder_backend})")
+        self.st_model = load_model('sonoisa/sentence-luke-japanese-base-lite', encoder_backend)
         
         print(" -> ドキュメントストアとIDマッピングをロード中...")
-        with open(id_mapping_path, 'r', encoding='utf-8') as f:
-            self.faiss_id_mapping = json.load(f)
+        # faiss_id_mapping.bin があればメモリマップで開く (無ければ faiss_id_mapping.json を読み込む)
+        self.faiss_id_mapping = load_id_mapping(id_mapping_path)
         
-        self.doc_store = {}
+        # セクション単位のドキュメントは、親 (事業) ごとにまとめて1つの本文にする
+        sections = {}
         with open(docs_path, 'r', encoding='utf-8') as f:
             for line in f:
                 doc = json.loads(line)
-                self.doc_store[doc['id']] = doc['contents']
+                sections.setdefault(doc.get('parent_id', doc['id']), []).append(doc['contents'])
+        self.doc_store = {doc_id: '。 '.join(parts) for doc_id, parts in sections.items()}
+        del sections
 
-        print(" -> SudachiPyトークナイザーを初期化中...")
-        self.tokenizer_obj = dictionary.Dictionary().create()
-        self.tokenizer_mode = tokenizer.Tokenizer.SplitMode.C
+        # BM25インデックスと同じアナライザーでクエリを解析する (文字バイグラムの場合はSudachiを使わない)
+        self.analyzer = analyzer
+        if analyzer == "sudachi":
+            print(" -> SudachiPyトークナイザーを初期化中...")
+            self.tokenizer_obj = dictionary.Dictionary().create()
+            self.tokenizer_mode = tokenizer.Tokenizer.SplitMode.C
+
+        # ラベルを別フィールド (labels) に分けたインデックス (preprocess_docs.py --layout fields) では、
+        # 値 (contents) に対するラベルの重みを指定して両方を検索する。Noneなら contents だけを検索する
+        self.search_fields = {"contents": 1.0, "labels": label_weight} if label_weight else None
         
         print("--- 初期化が完了しました ---")
 
 
+    def analyze_query(self, query):
+        """クエリをBM25インデックスと同じ形式の、空白区切りのトークン列にする"""
+        if self.analyzer == "bigram":
+            return ' '.join(bigram_tokens(query))
+        return ' '.join([m.surface() for m in self.tokenizer_obj.tokenize(query, self.tokenizer_mode)])
+
     def search(self, query, k=5):
         print(f"\nクエリ「{query}」でハイブリッド検索を実行...")
 
         # --- a. キーワード検索 (BM25) ---
-        tokenized_query = ' '.join([m.surface() for m in self.tokenizer_obj.tokenize(query, self.tokenizer_mode)])
-        bm25_hits = self.searcher.search(tokenized_query, k=k)
+        # セクション単位で多めに取得し、親ドキュメント (事業) ごとに最も高いスコアでまとめる
+        tokenized_query = self.analyze_query(query)
+        if self.search_fields:
+            bm25_hits = self.searcher.search(tokenized_query, k=k * BM25_OVERFETCH, fields=self.search_fields)
+        else:
+            bm25_hits = self.searcher.search(tokenized_query, k=k * BM25_OVERFETCH)
         
         bm25_results = []
-        for hit in bm25_hits:
-            hit_id = hit.docid
-            
-            # ★★★ 変更点: チャンク化されたIDを正規化 ★★★
-            # もしIDに "_chunk_" が含まれていたら、それより前の部分を親IDとして使う
-            if "_chunk_" in hit_id:
-                parent_id = hit_id.split("_chunk_")[0]
-            else:
-                parent_id = hit_id
-            
+        for parent_id, score in pool_section_hits(bm25_hits)[:k]:
             bm25_results.append({
                 "id": parent_id, # ここでは親IDを結果として保持
-                "score": hit.score,
+                "score": score,
                 "contents": self.doc_store.get(parent_id, "") # 親IDでdoc_storeを検索
             })
         print(f" -> BM25検索結果 (正規化後ID): {[res['id'] for res in bm25_results]}")
 
         # --- b. ベクトル検索 (Faiss) ---
-        # (この部分は変更なし)
+        # パッセージ単位で多めに取得し、親ドキュメントごとにスコアをまとめる
         query_embedding = self.st_model.encode([query], show_progress_bar=False)
-        distances, indices = self.faiss_index.search(query_embedding.astype('float32'), k)
-        
+        distances, indices = self.faiss_index.search(query_embedding.astype('float32'), k * FAISS_OVERFETCH)
+
+        hits = [(self.faiss_id_mapping[i], dist) for i, dist in zip(indices[0], distances[0]) if i != -1]
         faiss_results = []
-        for i, dist in zip(indices[0], distances[0]):
-            if i != -1:
-                doc_id = self.faiss_id_mapping[i]
-                faiss_results.append({
-                    "id": doc_id,
-                    "score": float(dist),
-                    "contents": self.doc_store.get(doc_id, "")
-                })
+        for doc_id, score in pool_passage_hits(hits, self.passage_pooling)[:k]:
+            faiss_results.append({
+                "id": doc_id,
+                "score": score,
+                "contents": self.doc_store.get(doc_id, "")
+            })
         print(f" -> Faiss検索結果: {[res['id'] for res in faiss_results]}")
 
         # --- c. 結果の統合 ---
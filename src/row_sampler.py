@@ -0,0 +1,137 @@
+import os
+import io
+import csv
+import math
+import random
+import itertools
+import typing
+
+# 信頼区間の計算に用いる正規分布の分位点 (95%)
+CONFIDENCE_LEVEL = 0.95
+Z_SCORE = 1.96
+
+SAMPLE_METHODS = ("reservoir", "offset")
+
+def make_rng(seed: int, key: str) -> random.Random:
+    """シードとファイル名から、並列実行でも再現可能な乱数生成器を作る"""
+    return random.Random(f"{seed}:{key}")
+
+def _open_uniform(rng: random.Random) -> float:
+    """(0, 1) の一様乱数 (log(0) を避けるため0を除外)"""
+    u = rng.random()
+    while u == 0.0:
+        u = rng.random()
+    return u
+
+def reservoir_sample(iterable: typing.Iterable, k: int, rng: random.Random) -> typing.Tuple[list, int]:
+    """
+    iterableから一様にk件を非復元抽出する (Vitterのリザーバサンプリング Algorithm L)。
+    置換対象にならない要素は数えるだけで読み飛ばす。(サンプル, 総件数) を返す。
+    """
+    it = iter(iterable)
+    reservoir = list(itertools.islice(it, k))
+    total = len(reservoir)
+    if total < k:
+        return reservoir, total
+
+    w = math.exp(math.log(_open_uniform(rng)) / k)
+    while True:
+        skip = int(math.log(_open_uniform(rng)) / math.log(1 - w))
+        skipped = sum(1 for _ in itertools.islice(it, skip))
+        total += skipped
+        if skipped < skip:
+            return reservoir, total
+        item = next(it, None)
+        if item is None:
+            return reservoir, total
+        total += 1
+        reservoir[rng.randrange(k)] = item
+        w *= math.exp(math.log(_open_uniform(rng)) / k)
+
+def sample_csv_rows(csv_path: str, k: int, rng: random.Random, method: str = "reservoir") -> typing.Optional[dict]:
+    """
+    CSVのヘッダーと、データ行のサンプルを返す。
+      - reservoir: 全行を走査して一様にk行を抽出する。総行数は正確。
+      - offset:    ランダムなバイト位置にシークして次の行を読む。ファイルを最後まで
+                   読まないため巨大ファイルでも一瞬で終わるが、直前の行が長い行ほど
+                   選ばれやすい近似的な抽出であり、総行数も推定値になる。
+                   split_excel_to_csv.py はセル内の改行を除去しているため、1行=1レコードを前提とする。
+    戻り値: {"header", "rows", "total_rows", "total_rows_is_estimate", "method"}
+    """
+    if method not in SAMPLE_METHODS:
+        raise ValueError(f"未知のサンプリング方式です: {method}")
+
+    if method == "reservoir":
+        with open(csv_path, 'r', encoding='utf-8-sig') as f:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if not header:
+                return None
+            rows, total_rows = reservoir_sample(reader, k, rng)
+        return {"header": header, "rows": rows, "total_rows": total_rows,
+                "total_rows_is_estimate": False, "method": method}
+
+    file_size = os.path.getsize(csv_path)
+    with open(csv_path, 'rb') as f:
+        header_line = f.readline()
+        header = next(csv.reader([header_line.decode('utf-8-sig')]), None)
+        if not header:
+            return None
+        data_start = f.tell()
+        data_bytes = file_size - data_start
+        if data_bytes <= 0:
+            return {"header": header, "rows": [], "total_rows": 0,
+                    "total_rows_is_estimate": False, "method": method}
+
+        lines = []
+        for _ in range(k):
+            f.seek(data_start + rng.randrange(data_bytes))
+            f.readline() # 途中から読んだ行の残りを捨てる
+            line = f.readline()
+            if not line: # 末尾に当たったら先頭のデータ行を使う
+                f.seek(data_start)
+                line = f.readline()
+            lines.append(line.decode('utf-8', errors='ignore'))
+
+    rows = list(csv.reader(io.StringIO(''.join(l if l.endswith('\n') else l + '\n' for l in lines))))
+    avg_line_bytes = sum(len(l.encode('utf-8')) for l in lines) / len(lines)
+    total_rows = int(round(data_bytes / avg_line_bytes)) if avg_line_bytes > 0 else 0
+    return {"header": header, "rows": rows, "total_rows": total_rows,
+            "total_rows_is_estimate": True, "method": method}
+
+def ratio_estimate(ys: list, xs: list, population_size: typing.Optional[int] = None,
+                   upper: typing.Optional[float] = None) -> typing.Tuple[float, list]:
+    """
+    行単位のサンプル (y_i, x_i) から比 R = Σy / Σx を推定し、デルタ法による95%信頼区間を返す。
+    平均値は xs を全て1にした特別な場合。population_sizeを与えると有限母集団修正を行う。
+    """
+    n = len(ys)
+    sum_x = sum(xs)
+    if n == 0 or sum_x == 0:
+        return 0.0, [0.0, 0.0]
+    r = sum(ys) / sum_x
+    if n < 2:
+        return r, [r, r]
+
+    x_bar = sum_x / n
+    s2 = sum((y - r * x) ** 2 for y, x in zip(ys, xs)) / (n - 1)
+    variance = s2 / (n * x_bar * x_bar)
+    if population_size and population_size > 1:
+        variance *= max(0.0, (population_size - n) / (population_size - 1))
+    half_width = Z_SCORE * math.sqrt(variance)
+
+    low = max(0.0, r - half_width)
+    high = r + half_width
+    if upper is not None:
+        high = min(upper, high)
+    return r, [low, high]
+
+def sampling_info(sample: dict, seed: int) -> dict:
+    """出力JSONに付与する、サンプリング結果であることを示すメタ情報"""
+    return {
+        "method": sample["method"],
+        "sample_rows": len(sample["rows"]),
+        "total_rows_is_estimate": sample["total_rows_is_estimate"],
+        "confidence_level": CONFIDENCE_LEVEL,
+        "seed": seed,
+    }
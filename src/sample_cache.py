@@ -0,0 +1,49 @@
+import os
+import hashlib
+import typing
+import pandas as pd
+
+# ID・メタデータ判定のヒューリスティックが参照する、ファイル先頭からの行数
+SAMPLE_ROWS = 500
+
+# フィンガープリントに使う、ファイル先頭・末尾の読み取りバイト数
+FINGERPRINT_BLOCK_BYTES = 1024 * 1024
+
+def default_cache_dir() -> str:
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(project_root, 'data', 'sample_cache')
+
+def file_fingerprint(csv_path: str) -> str:
+    """
+    ファイルの内容を識別するハッシュ値を返す。
+    巨大CSV全体を読むと本末転倒なため、サイズ・更新時刻と先頭/末尾1MBの内容から計算する。
+    """
+    stat = os.stat(csv_path)
+    h = hashlib.sha1()
+    h.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode('utf-8'))
+    with open(csv_path, 'rb') as f:
+        h.update(f.read(FINGERPRINT_BLOCK_BYTES))
+        if stat.st_size > FINGERPRINT_BLOCK_BYTES:
+            f.seek(max(FINGERPRINT_BLOCK_BYTES, stat.st_size - FINGERPRINT_BLOCK_BYTES))
+            h.update(f.read())
+    return h.hexdigest()
+
+def load_sample(csv_path: str, sample_rows: int = SAMPLE_ROWS, cache_dir: typing.Optional[str] = None) -> pd.DataFrame:
+    """
+    CSVの先頭sample_rows行 (全列, 文字列型) を返す。
+    初回はCSVを1回だけ読み、列指向のParquetとしてキャッシュに保存する。
+    2回目以降 (別のスクリプトからの呼び出しを含む) はCSVを解析せずキャッシュから読む。
+    列名はpandasのread_csvと同じ (重複列には '.1' などの接尾辞が付く)。
+    """
+    cache_dir = cache_dir or default_cache_dir()
+    cache_path = os.path.join(cache_dir, f"{file_fingerprint(csv_path)}_{sample_rows}.parquet")
+    if os.path.exists(cache_path):
+        return pd.read_parquet(cache_path)
+
+    df_sample = pd.read_csv(csv_path, nrows=sample_rows, dtype=str, low_memory=False)
+    os.makedirs(cache_dir, exist_ok=True)
+    # 並列実行中に書きかけのファイルを読まれないよう、一時ファイルから置き換える
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    df_sample.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, cache_path)
+    return df_sample
@@ -3,8 +3,13 @@ import glob
 import pandas as pd
 from tqdm import tqdm
 import re
-from collections import defaultdict
 import json # <<<--- JSONをインポート
+import typing
+import argparse
+import functools
+import pyarrow as pa
+import pyarrow.parquet as pq
+from parallel_runner import run_parallel, default_workers
 
 # (正規表現や定数の定義は変更なし)
 EXPENDITURE_PATTERN = re.compile(r'支出先上位.*?リスト-([A-Z\d]+)\..*?-(\d+)-(.+)')
@@ -15,8 +20,120 @@ ATTRIBUTE_MAP = {
     "業務概要": "contract_summary"
 }
 
-# <<<--- process_csv_separation関数を修正 ---
-def process_csv_separation(csv_path: str, output_dir: str, id_map: dict): # id_mapを引数に追加
+# 1チャンクあたりの行数 (列数が非常に多いため、メモリと速度のバランスを取った値)
+CHUNK_ROWS = 2000
+EXPENDITURE_OUTPUT_COLUMNS = ["project_id", "expenditure_index"] + list(ATTRIBUTE_MAP.values())
+# Parquet出力の1行グループあたりの行数
+PARQUET_ROW_GROUP_ROWS = 50000
+
+def parse_expenditure_columns(columns: list) -> tuple:
+    """
+    列名を一度だけ解析し、(支出先列の全リスト, {列名: (item_index, 属性名)}) を返す。
+    前者は本体データから除外する列、後者は支出先テーブルに取り込む列。
+    """
+    expenditure_columns = []
+    column_specs = {}
+    for col in columns:
+        match = EXPENDITURE_PATTERN.match(col)
+        if not match:
+            continue
+        expenditure_columns.append(col)
+        item_index, attribute_raw = match.group(2), match.group(3)
+        if attribute_raw in ATTRIBUTE_MAP:
+            column_specs[col] = (int(item_index), ATTRIBUTE_MAP[attribute_raw])
+    return expenditure_columns, column_specs
+
+def extract_expenditures(chunk: pd.DataFrame, project_id_col: str, column_specs: dict) -> pd.DataFrame:
+    """
+    チャンク内の支出先列を縦持ちに展開 (melt) し、(行, item_index) ごとに属性を横に並べる (pivot)。
+    同じ (行, item_index, 属性) に複数の列が対応する場合は、後ろの列の値を採用する。
+    """
+    spec_cols = list(column_specs.keys())
+    if not spec_cols:
+        return pd.DataFrame(columns=EXPENDITURE_OUTPUT_COLUMNS)
+    project_ids = chunk[project_id_col]
+    has_id = project_ids.notna() & (project_ids.astype(str).str.strip() != "")
+    exp = chunk.loc[has_id, spec_cols]
+    if exp.empty:
+        return pd.DataFrame(columns=EXPENDITURE_OUTPUT_COLUMNS)
+
+    exp = exp.assign(_row=range(len(exp)), project_id=project_ids[has_id].values)
+    long_df = exp.melt(id_vars=["_row", "project_id"], value_vars=spec_cols, var_name="column", value_name="value")
+    long_df = long_df[long_df["value"].notna() & (long_df["value"].str.strip() != "")]
+    if long_df.empty:
+        return pd.DataFrame(columns=EXPENDITURE_OUTPUT_COLUMNS)
+
+    long_df["expenditure_index"] = long_df["column"].map(lambda c: column_specs[c][0])
+    long_df["attribute"] = long_df["column"].map(lambda c: column_specs[c][1])
+    long_df = long_df.drop_duplicates(subset=["_row", "expenditure_index", "attribute"], keep="last")
+
+    wide = long_df.pivot(index=["_row", "project_id", "expenditure_index"], columns="attribute", values="value")
+    wide = wide.reset_index().sort_values(["_row", "expenditure_index"], kind="stable")
+    return wide.reindex(columns=EXPENDITURE_OUTPUT_COLUMNS)
+
+class CsvSink:
+    """チャンクを一時ファイルに追記し、commit()で本来のパスへ原子的に置き換えるCSV出力"""
+    def __init__(self, path: str):
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        self.f = None
+
+    def write(self, df: pd.DataFrame):
+        if self.f is None:
+            self.f = open(self.tmp_path, 'w', newline='', encoding='utf-8-sig')
+            df.to_csv(self.f, header=True, index=False)
+        else:
+            df.to_csv(self.f, header=False, index=False)
+
+    def commit(self):
+        if self.f is None:
+            # 出力が無かった場合、前回の実行結果が残らないようにする
+            if os.path.exists(self.path): os.remove(self.path)
+            return
+        self.f.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        if self.f is not None:
+            self.f.close()
+        if os.path.exists(self.tmp_path): os.remove(self.tmp_path)
+
+class ParquetSink(CsvSink):
+    """チャンクをバッファし、大きな行グループ単位でストリーミング書き込みするParquet出力"""
+    def __init__(self, path: str, schema: pa.Schema, row_group_rows: int = PARQUET_ROW_GROUP_ROWS):
+        super().__init__(path)
+        self.schema = schema
+        self.row_group_rows = row_group_rows
+        self.buffer = []
+        self.buffered_rows = 0
+
+    def write(self, df: pd.DataFrame):
+        self.buffer.append(df)
+        self.buffered_rows += len(df)
+        if self.buffered_rows >= self.row_group_rows:
+            self._flush()
+
+    def _flush(self):
+        if not self.buffer:
+            return
+        table = pa.Table.from_pandas(pd.concat(self.buffer, ignore_index=True), schema=self.schema, preserve_index=False)
+        if self.f is None:
+            self.f = pq.ParquetWriter(self.tmp_path, self.schema, compression='zstd')
+        self.f.write_table(table, row_group_size=self.row_group_rows)
+        self.buffer, self.buffered_rows = [], 0
+
+    def commit(self):
+        self._flush()
+        super().commit()
+
+def create_sink(path: str, output_format: str, columns: list, int_columns: tuple = ()):
+    if output_format == "parquet":
+        schema = pa.schema([(c, pa.int64() if c in int_columns else pa.string()) for c in columns])
+        return ParquetSink(path, schema)
+    return CsvSink(path)
+
+def process_csv_separation(csv_path: str, output_dir: str, id_map: dict, output_format: str = "csv",
+                           show_progress: bool = True): # id_mapを引数に追加
     filename = os.path.basename(csv_path)
     
     # マップから事業ID列名を取得
@@ -25,55 +142,43 @@ def process_csv_separation(csv_path: str, output_dir: str, id_map: dict): # id_m
         tqdm.write(f"警告: IDマップに '{filename}' の事業ID列が定義されていません。スキップします。")
         return
 
-    # (以降の処理はほぼ同じだが、ID特定ロジックは不要になる)
-    # ... (前回のスクリプトの main_output_path, exp_output_path, chunk_iter, is_first_chunk, ファイル削除部分などをそのまま流用)
-    main_output_path = os.path.join(output_dir, filename.replace('.csv', '_main.csv'))
-    exp_output_path = os.path.join(output_dir, filename.replace('.csv', '_expenditures.csv'))
+    ext = '.parquet' if output_format == "parquet" else '.csv'
+    main_output_path = os.path.join(output_dir, filename.replace('.csv', f'_main{ext}'))
+    exp_output_path = os.path.join(output_dir, filename.replace('.csv', f'_expenditures{ext}'))
     
     try:
-        chunk_iter = pd.read_csv(csv_path, chunksize=100, low_memory=False, dtype=str)
+        header = pd.read_csv(csv_path, nrows=0, dtype=str).columns.tolist()
+        chunk_iter = pd.read_csv(csv_path, chunksize=CHUNK_ROWS, low_memory=False, dtype=str)
     except Exception as e:
         tqdm.write(f"エラー: ファイルの読み込みに失敗しました {filename}: {e}")
         return
-        
-    is_first_chunk = True
-    if os.path.exists(main_output_path): os.remove(main_output_path)
-    if os.path.exists(exp_output_path): os.remove(exp_output_path)
-        
-    for chunk in tqdm(chunk_iter, desc=f"Processing {filename}", unit=" chunks", leave=False):
-        if project_id_col not in chunk.columns:
-            tqdm.write(f"エラー: '{filename}' 内に指定されたID列 '{project_id_col}' が見つかりません。")
-            return # チャンク内にID列がなければ処理を中断
-            
-        # (支出データの抽出と分離ロジックは前回と同じ)
-        expenditure_columns = [col for col in chunk.columns if EXPENDITURE_PATTERN.match(col)]
-        expenditures_data = []
-        for index, row in chunk.iterrows():
-            project_id = row[project_id_col]
-            if pd.isna(project_id) or str(project_id).strip() == "": continue
-            parsed_items = defaultdict(dict)
-            for col in expenditure_columns:
-                match = EXPENDITURE_PATTERN.match(col)
-                if match:
-                    item_index, attribute_raw = match.group(2), match.group(3)
-                    if attribute_raw in ATTRIBUTE_MAP:
-                        new_attribute_name = ATTRIBUTE_MAP[attribute_raw]
-                        value = row[col]
-                        if pd.notna(value) and str(value).strip():
-                            parsed_items[item_index][new_attribute_name] = value
-            for item_index, attributes in parsed_items.items():
-                if attributes:
-                    exp_record = {"project_id": project_id, "expenditure_index": int(item_index), **attributes}
-                    expenditures_data.append(exp_record)
-        if expenditures_data:
-            exp_df = pd.DataFrame(expenditures_data)
-            exp_df.to_csv(exp_output_path, mode='a', header=is_first_chunk, index=False, encoding='utf-8-sig')
-        main_df = chunk.drop(columns=expenditure_columns, errors='ignore')
-        main_df.to_csv(main_output_path, mode='a', header=is_first_chunk, index=False, encoding='utf-8-sig')
-        is_first_chunk = False
+
+    if project_id_col not in header:
+        tqdm.write(f"エラー: '{filename}' 内に指定されたID列 '{project_id_col}' が見つかりません。")
+        return
+
+    # 支出先列の解析はファイルごとに一度だけ行う
+    expenditure_columns, column_specs = parse_expenditure_columns(header)
+    main_columns = [c for c in header if c not in set(expenditure_columns)]
+
+    # 出力は一時ファイルに書き、全チャンクの処理が成功した時点で置き換える (途中のファイルを残さない)
+    main_sink = create_sink(main_output_path, output_format, main_columns)
+    exp_sink = create_sink(exp_output_path, output_format, EXPENDITURE_OUTPUT_COLUMNS, int_columns=("expenditure_index",))
+    try:
+        for chunk in tqdm(chunk_iter, desc=f"Processing {filename}", unit=" chunks", leave=False, disable=not show_progress):
+            exp_df = extract_expenditures(chunk, project_id_col, column_specs)
+            if not exp_df.empty:
+                exp_sink.write(exp_df)
+            main_sink.write(chunk.drop(columns=expenditure_columns, errors='ignore'))
+        main_sink.commit()
+        exp_sink.commit()
+    except Exception as e:
+        main_sink.abort()
+        exp_sink.abort()
+        tqdm.write(f"エラー: '{filename}' の分離処理に失敗しました: {e}")
 
 # <<<--- main関数を修正 ---
-def main():
+def main(output_format: str = "csv", workers: typing.Optional[int] = None):
     print("--- 事業データと支出先データの分離ETL処理を開始 ---")
     project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     csv_input_dir = os.path.join(project_root, 'data', 'csv')
@@ -90,10 +195,16 @@ def main():
     with open(id_map_path, 'r', encoding='utf-8') as f:
         id_map = json.load(f)
     
-    csv_files = glob.glob(os.path.join(csv_input_dir, '*.csv'))
-    for csv_path in tqdm(csv_files, desc="All Files"):
-        process_csv_separation(csv_path, separated_dir, id_map)
+    csv_files = sorted(glob.glob(os.path.join(csv_input_dir, '*.csv')))
+    workers = workers or default_workers()
+    worker_func = functools.partial(process_csv_separation, output_dir=separated_dir, id_map=id_map,
+                                    output_format=output_format, show_progress=workers <= 1)
+    run_parallel(worker_func, csv_files, workers, desc="All Files")
 
 if __name__ == "__main__":
-    main()
-    print("\n★★★ データ分離処理が完了しました ★★★")
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="事業データと支出先データを分離する")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv", help="出力形式")
+    parser.add_argument("--workers", type=int, default=None, help="並列ワーカー数 (既定: CPUコア数)")
+    args = parser.parse_args()
+    main(args.format, args.workers)
+    print("\n★★★ データ分離処理が完了しました ★★★")
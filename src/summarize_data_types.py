@@ -2,7 +2,10 @@ import os
 import glob
 import csv
 import json
-from tqdm import tqdm
+import argparse
+import functools
+from parallel_runner import run_parallel
+from row_sampler import sample_csv_rows, make_rng, ratio_estimate, sampling_info, SAMPLE_METHODS
 from collections import defaultdict
 import typing
 
@@ -50,6 +53,43 @@ def classify_column(type_counts: dict, total_rows: int) -> str:
         return "mostly_text"
     return "mixed"
 
+def summarize_column_details(column_details: list, total_rows: int) -> dict:
+    """
+    列ごとのメトリクス (type_counts, max_len, total_len, non_empty_len, non_empty_count) を
+    支配的な型のカテゴリ別に集計し、column_property_summaryを作る。
+    """
+    # 収集したメトリクスをカテゴリ別に集計
+    summary_agg = defaultdict(lambda: {
+        "column_count": 0, "total_empty_cells": 0, "total_max_cell_len": 0,
+        "total_len_sum": 0, "total_non_empty_len_sum": 0, "total_non_empty_count_sum": 0
+    })
+
+    for details in column_details:
+        dominant_type = classify_column(details["type_counts"], total_rows)
+        agg = summary_agg[dominant_type]
+        agg["column_count"] += 1
+        agg["total_empty_cells"] += details["type_counts"]["empty"]
+        agg["total_max_cell_len"] = max(agg["total_max_cell_len"], details["max_len"])
+        agg["total_len_sum"] += details["total_len"]
+        agg["total_non_empty_len_sum"] += details["non_empty_len"]
+        agg["total_non_empty_count_sum"] += details["non_empty_count"]
+
+    # 集計結果から最終的なサマリーを計算
+    final_summary = {}
+    for dtype, agg in summary_agg.items():
+        count = agg["column_count"]
+        total_cells = count * total_rows
+
+        final_summary[dtype] = {
+            "column_count": count,
+            "avg_empty_rate": round(agg["total_empty_cells"] / total_cells, 3) if total_cells > 0 else 0,
+            "overall_max_cell_len": agg["total_max_cell_len"],
+            "avg_cell_len": round(agg["total_len_sum"] / total_cells, 2) if total_cells > 0 else 0,
+            "avg_non_empty_cell_len": round(agg["total_non_empty_len_sum"] / agg["total_non_empty_count_sum"], 2) if agg["total_non_empty_count_sum"] > 0 else 0,
+        }
+
+    return final_summary
+
 def analyze_column_properties(csv_path: str) -> typing.Optional[dict]:
     """
     単一CSVをストリーミング処理し、列のプロパティを集計・分析する。
@@ -98,35 +138,8 @@ def analyze_column_properties(csv_path: str) -> typing.Optional[dict]:
                     "column_property_summary": {}
                 }
 
-            # Pass 2: 収集したメトリクスをカテゴリ別に集計
-            summary_agg = defaultdict(lambda: {
-                "column_count": 0, "total_empty_cells": 0, "total_max_cell_len": 0,
-                "total_len_sum": 0, "total_non_empty_len_sum": 0, "total_non_empty_count_sum": 0
-            })
-
-            for details in column_details:
-                dominant_type = classify_column(details["type_counts"], total_rows)
-                agg = summary_agg[dominant_type]
-                agg["column_count"] += 1
-                agg["total_empty_cells"] += details["type_counts"]["empty"]
-                agg["total_max_cell_len"] = max(agg["total_max_cell_len"], details["max_len"])
-                agg["total_len_sum"] += details["total_len"]
-                agg["total_non_empty_len_sum"] += details["non_empty_len"]
-                agg["total_non_empty_count_sum"] += details["non_empty_count"]
-
-            # Pass 3: 集計結果から最終的なサマリーを計算
-            final_summary = {}
-            for dtype, agg in summary_agg.items():
-                count = agg["column_count"]
-                total_cells = count * total_rows
-                
-                final_summary[dtype] = {
-                    "column_count": count,
-                    "avg_empty_rate": round(agg["total_empty_cells"] / total_cells, 3) if total_cells > 0 else 0,
-                    "overall_max_cell_len": agg["total_max_cell_len"],
-                    "avg_cell_len": round(agg["total_len_sum"] / total_cells, 2) if total_cells > 0 else 0,
-                    "avg_non_empty_cell_len": round(agg["total_non_empty_len_sum"] / agg["total_non_empty_count_sum"], 2) if agg["total_non_empty_count_sum"] > 0 else 0,
-                }
+            # Pass 2 & 3: 収集したメトリクスを型カテゴリ別に集計
+            final_summary = summarize_column_details(column_details, total_rows)
 
             return {
                 "filename": os.path.basename(csv_path),
@@ -138,19 +151,109 @@ def analyze_column_properties(csv_path: str) -> typing.Optional[dict]:
         print(f"\nファイル処理中にエラーが発生しました {os.path.basename(csv_path)}: {e}")
         return None
 
-def main(csv_dir: str, output_filepath: str):
-    """メインの実行関数"""
+def analyze_column_properties_sampled(csv_path: str, sample_rows: int, seed: int = 0,
+                                      method: str = "reservoir") -> typing.Optional[dict]:
+    """
+    行のサンプルから列のプロパティを推定する (探索用の高速モード)。
+    出力はanalyze_column_propertiesと同じ構造で、各平均値に95%信頼区間 (*_ci95) と
+    サンプリング情報 (sampling) が付く。列の型分類とoverall_max_cell_lenはサンプル内の値。
+    """
+    filename = os.path.basename(csv_path)
+    try:
+        sample = sample_csv_rows(csv_path, sample_rows, make_rng(seed, filename), method)
+        if not sample:
+            return None
+        header, rows = sample["header"], sample["rows"]
+        num_columns = len(header)
+
+        if not rows:
+            return {
+                "filename": filename,
+                "total_data_rows": 0,
+                "column_count": num_columns,
+                "column_property_summary": {},
+                "sampling": sampling_info(sample, seed)
+            }
+
+        # Pass 1: サンプルから各列の支配的な型を判定
+        type_counts = [defaultdict(int) for _ in range(num_columns)]
+        for row in rows:
+            for i in range(num_columns):
+                type_counts[i][get_value_type(row[i] if i < len(row) else "")] += 1
+        column_types = [classify_column(counts, len(rows)) for counts in type_counts]
+
+        columns_by_type = defaultdict(list)
+        for i, dtype in enumerate(column_types):
+            columns_by_type[dtype].append(i)
+
+        # Pass 2: 型カテゴリごとに、行単位の集計値を収集 (信頼区間の計算単位は行)
+        final_summary = {}
+        for dtype, indices in columns_by_type.items():
+            count = len(indices)
+            empty_per_row, len_per_row, non_empty_len_per_row, non_empty_count_per_row = [], [], [], []
+            max_len = 0
+            for row in rows:
+                empty = total_len = non_empty_len = non_empty_count = 0
+                for i in indices:
+                    cell_value = row[i] if i < len(row) else ""
+                    cell_len = len(cell_value)
+                    max_len = max(max_len, cell_len)
+                    total_len += cell_len
+                    if get_value_type(cell_value) == "empty":
+                        empty += 1
+                    else:
+                        non_empty_len += cell_len
+                        non_empty_count += 1
+                empty_per_row.append(empty)
+                len_per_row.append(total_len)
+                non_empty_len_per_row.append(non_empty_len)
+                non_empty_count_per_row.append(non_empty_count)
+
+            cells_per_row = [count] * len(rows)
+            population = sample["total_rows"]
+            empty_rate, empty_rate_ci = ratio_estimate(empty_per_row, cells_per_row, population, upper=1.0)
+            avg_len, avg_len_ci = ratio_estimate(len_per_row, cells_per_row, population)
+            avg_non_empty_len, avg_non_empty_len_ci = ratio_estimate(non_empty_len_per_row, non_empty_count_per_row, population)
+
+            final_summary[dtype] = {
+                "column_count": count,
+                "avg_empty_rate": round(empty_rate, 3),
+                "avg_empty_rate_ci95": [round(v, 3) for v in empty_rate_ci],
+                "overall_max_cell_len": max_len,
+                "avg_cell_len": round(avg_len, 2),
+                "avg_cell_len_ci95": [round(v, 2) for v in avg_len_ci],
+                "avg_non_empty_cell_len": round(avg_non_empty_len, 2),
+                "avg_non_empty_cell_len_ci95": [round(v, 2) for v in avg_non_empty_len_ci],
+            }
+
+        return {
+            "filename": filename,
+            "total_data_rows": sample["total_rows"],
+            "column_count": num_columns,
+            "column_property_summary": final_summary,
+            "sampling": sampling_info(sample, seed)
+        }
+    except Exception as e:
+        print(f"\nファイル処理中にエラーが発生しました {filename}: {e}")
+        return None
+
+def main(csv_dir: str, output_filepath: str, workers: typing.Optional[int] = None,
+         sample_rows: typing.Optional[int] = None, seed: int = 0, sample_method: str = "reservoir"):
+    """メインの実行関数 (sample_rowsを指定するとサンプリングによる推定モード)"""
     print(f"--- '{csv_dir}' 内のCSV列プロパティ分析を開始 ---")
-    csv_files = glob.glob(os.path.join(csv_dir, '*.csv'))
+    if sample_rows:
+        print(f"サンプリングモード: 各ファイル {sample_rows:,} 行 ({sample_method})")
+    csv_files = sorted(glob.glob(os.path.join(csv_dir, '*.csv')))
     if not csv_files:
         print("分析対象のCSVファイルが見つかりません。")
         return
 
-    all_analyses = []
-    for csv_path in tqdm(csv_files, desc="Analyzing column properties"):
-        analysis = analyze_column_properties(csv_path)
-        if analysis:
-            all_analyses.append(analysis)
+    if sample_rows:
+        worker_func = functools.partial(analyze_column_properties_sampled, sample_rows=sample_rows, seed=seed, method=sample_method)
+    else:
+        worker_func = analyze_column_properties
+    analyses = run_parallel(worker_func, csv_files, workers, desc="Analyzing column properties")
+    all_analyses = [a for a in analyses if a]
 
     with open(output_filepath, 'w', encoding='utf-8') as f:
         json.dump(all_analyses, f, ensure_ascii=False, indent=2)
@@ -158,12 +261,20 @@ def main(csv_dir: str, output_filepath: str):
     print(f"\n分析結果が出力されました: {output_filepath}")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CSVの列プロパティを分析する")
+    parser.add_argument("--workers", type=int, default=None, help="並列ワーカー数 (既定: CPUコア数)")
+    parser.add_argument("--sample", type=int, default=None, metavar="N", help="各ファイルからN行をサンプリングして推定する")
+    parser.add_argument("--sample-method", choices=SAMPLE_METHODS, default="reservoir", help="サンプリング方式")
+    parser.add_argument("--seed", type=int, default=0, help="サンプリングの乱数シード")
+    args = parser.parse_args()
+
     project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     csv_input_dir = os.path.join(project_root, 'data', 'csv')
     analysis_dir = os.path.join(project_root, 'analysis')
     os.makedirs(analysis_dir, exist_ok=True)
-    summary_output_path = os.path.join(analysis_dir, 'column_property_summary.json')
+    output_name = 'column_property_summary_sampled.json' if args.sample else 'column_property_summary.json'
+    summary_output_path = os.path.join(analysis_dir, output_name)
     
-    main(csv_input_dir, summary_output_path)
+    main(csv_input_dir, summary_output_path, args.workers, args.sample, args.seed, args.sample_method)
     
     print("\n★★★ 列プロパティ分析が完了しました ★★★")
\ No newline at end of file
@@ -32,7 +32,8 @@ def stream_unpivot_pipeline(csv_dir, long_csv_dir):
                 fixed_col_names = [original_header[i] for i in fixed_col_indices]
 
                 # 新しい縦長データのヘッダー
-                new_header = fixed_col_names + ['original_column_name', 'value']
+                # source_row: 元のCSVでのデータ行の番号 (1始まり)。固定列が同じ行を区別し、行数を数えるために使う
+                new_header = fixed_col_names + ['source_row', 'original_column_name', 'value']
 
                 with open(output_filepath, 'w', newline='', encoding='utf-8-sig') as f_out:
                     writer = csv.writer(f_out)
@@ -40,7 +41,7 @@ def stream_unpivot_pipeline(csv_dir, long_csv_dir):
 
                     # --- ここからがストリーミング処理の核心 ---
                     # データ行を一行ずつループ
-                    for row in reader:
+                    for source_row, row in enumerate(reader, start=1):
                         try:
                             # 固定列の値を取得
                             fixed_values = [row[i] for i in fixed_col_indices]
@@ -54,7 +55,7 @@ def stream_unpivot_pipeline(csv_dir, long_csv_dir):
                                 # 値が空でなければ書き出す
                                 if value is not None and value.strip() != '':
                                     col_name = original_header[i]
-                                    new_row = fixed_values + [col_name, value]
+                                    new_row = fixed_values + [source_row, col_name, value]
                                     writer.writerow(new_row)
                         except IndexError:
                             # 行の途中でデータが途切れている場合など
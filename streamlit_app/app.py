@@ -2,16 +2,17 @@ import streamlit as st
 import os
 import sys
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src')) # retriever.pyが同じフォルダのモジュールをインポートするため
 from src.retriever import HybridRetriever
 from src.llm_handler import generate_answer # ★★★ LLMハンドラーをインポート ★★★
 
 st.set_page_config(page_title="Gyoukaku RAG System", layout="wide")
 
 @st.cache_resource
-def load_retriever(pyserini_index_name):
+def load_retriever(pyserini_index_name, analyzer="sudachi", label_weight=None):
     project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     analysis_dir = os.path.join(project_root, 'analysis')
-    return HybridRetriever(analysis_dir, pyserini_index_name)
+    return HybridRetriever(analysis_dir, pyserini_index_name, analyzer, label_weight)
 
 st.title(" Gyoukaku RAG System")
 st.write("行政事業レビューシートの内容について、自然言語で質問してください。")
@@ -23,11 +24,31 @@ with st.sidebar:
         ('75件 (テスト用)', '完全版'),
         index=1 # ★★★ デフォルトを「完全版」にしておく ★★★
     )
+    analyzer_label = st.radio(
+        "BM25のアナライザー:",
+        ('Sudachi (形態素解析)', '文字バイグラム'),
+        index=0
+    )
+    layout_label = st.radio(
+        "BM25インデックスのフィールド構成:",
+        ('ラベル+値 (従来)', '値のみ', '値+ラベル (別フィールド)'),
+        index=0
+    )
+    label_weight = None
+    if layout_label == '値+ラベル (別フィールド)':
+        label_weight = st.slider("ラベルの重み", 0.0, 1.0, 0.2, 0.05)
 
+analyzer = "bigram" if analyzer_label == '文字バイグラム' else "sudachi"
 pyserini_index_folder = "pyserini_index_75" if index_version == '75件 (テスト用)' else "pyserini_index"
+if analyzer == "bigram":
+    pyserini_index_folder += "_bigram"
+# preprocess_docs.py --layout values / fields で作ったインデックスは、フォルダ名の末尾にレイアウト名を付けておく
+layout = {'値のみ': "values", '値+ラベル (別フィールド)': "fields"}.get(layout_label)
+if layout:
+    pyserini_index_folder += f"_{layout}"
 
 try:
-    retriever = load_retriever(pyserini_index_folder)
+    retriever = load_retriever(pyserini_index_folder, analyzer, label_weight)
 
     user_query = st.text_input("質問を入力してください:", "随意契約の割合が高い事業について教えて")
 